@@ -10,7 +10,8 @@ import reversion
 from model_utils import Choices
 
 #import project modules
-from core.models import BaseModel, Facility, Employee
+from core.models import BaseModel, Employee
+from facilities.models import Facility
 
 
 class Priority(BaseModel):
@@ -2,13 +2,13 @@
     This modules defines CCE app API urls
 """
 from django.conf.urls import patterns, url, include
-from rest_framework import routers
+from core.api.routers import BaseModelRouter
 
 
 #create cce app REST API routers and urls
 from . import views
 
-router = routers.DefaultRouter()
+router = BaseModelRouter()
 router.register(r'storage-location', views.StorageLocationViewSet)
 router.register(r'storage-location-type', views.StorageLocationTypeViewSet)
 router.register(r'storage-location-temp-log', views.StorageLocationTempLogViewSet)
@@ -17,5 +17,7 @@ router.register(r'storage-location-problem-log', views.StorageLocationProblemLog
 
 # Wire up our API using automatic URL routing.
 urlpatterns = patterns('',
+    url(r'^storage-location-temp-log/ingest/$', views.StorageLocationTempLogIngestView.as_view()),
+    url(r'^storage-location-temp-history/$', views.StorageLocationTempHistoryView.as_view()),
     url(r'^', include(router.urls)),
 )
\ No newline at end of file
@@ -5,8 +5,23 @@
     functions can be added too.
 """
 
+#import core python modules
+import datetime
+
+#import core django modules
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+#import external modules
+from rest_framework import status, views
+from rest_framework.response import Response
+
 #import project modules
 from core.api.views import BaseModelViewSet
+from core.identity import get_identity
+from cce.history import get_temperature_history, RESOLUTIONS
+from cce.ingest import TemperatureLogIngester, IngestError, READERS
 from cce.models import StorageLocation, StorageLocationType, StorageLocationTempLog, StorageLocationProblemLog
 from .serializers import (StorageLocationSerializer, StorageLocationTypeSerializer, StorageLocationTempLogSerializer,
                           StorageLocationProblemLogSerializer)
@@ -45,4 +60,79 @@ class StorageLocationProblemLogViewSet(BaseModelViewSet):
         StorageLocationProblemLog models via REST API URL
     """
     queryset = StorageLocationProblemLog.objects.all()
-    serializer_class = StorageLocationProblemLogSerializer
\ No newline at end of file
+    serializer_class = StorageLocationProblemLogSerializer
+
+
+class StorageLocationTempLogIngestView(views.APIView):
+    """
+        API end-point that bulk loads temperature readings, POST thousands of readings at once as CSV with a header
+        row (Content-Type: text/csv) or as newline delimited JSON (Content-Type: application/x-ndjson).
+
+        each reading has storage_location (uuid or code), temperature, date_time_logged (ISO 8601) and optionally
+        temperature_uom (uuid, symbol or name). ?temperature_uom= sets the unit of readings that do not name one,
+        else the temperature unit of the storage location is used. readings already logged for the same storage
+        location and time are skipped, invalid readings are skipped and returned in errors with their line number.
+    """
+    def post(self, request, format=None):
+        content_type = request.META.get('CONTENT_TYPE', '').split(';')[0].strip()
+        if content_type not in READERS:
+            return Response(data={'detail': 'Unsupported content type, use one of: {types}.'.format(
+                types=', '.join(sorted(READERS)))}, status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+        ingester = TemperatureLogIngester(temperature_uom=request.QUERY_PARAMS.get('temperature_uom'),
+                                          user=get_identity(request).user)
+        try:
+            with transaction.atomic():
+                summary = ingester.ingest(READERS[content_type](request.stream))
+        except IngestError as e:
+            return Response(data={'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(data=summary, status=status.HTTP_201_CREATED)
+
+
+def parse_history_time(value):
+    """
+        returns aware datetime of an ISO 8601 date or date and time or None if value is neither
+    """
+    try:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            parsed = parse_date(value)
+            if parsed is not None:
+                parsed = datetime.datetime.combine(parsed, datetime.time())
+    except ValueError:
+        return None
+    if parsed is not None and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, timezone.get_current_timezone())
+    return parsed
+
+
+class StorageLocationTempHistoryView(views.APIView):
+    """
+        API end-point that returns the temperature history of a storage location for charts.
+
+        query parameters: storage_location (uuid), since and until (ISO 8601 date or date and time, until defaults
+        to now). the resolution is picked from the length of the range: every reading for short ranges, hourly or
+        daily rollups for longer ones, ?resolution=raw|hour|day asks for one.
+    """
+    def get(self, request, format=None):
+        storage_location = request.QUERY_PARAMS.get('storage_location')
+        if not storage_location:
+            return Response(data={'detail': 'Expected a storage_location.'}, status=status.HTTP_400_BAD_REQUEST)
+        times = {}
+        for name in ('since', 'until'):
+            value = request.QUERY_PARAMS.get(name)
+            if value:
+                times[name] = parse_history_time(value)
+                if times[name] is None:
+                    return Response(data={'detail': 'Expected an ISO 8601 date or date and time for {name}.'.format(
+                        name=name)}, status=status.HTTP_400_BAD_REQUEST)
+        if 'since' not in times:
+            return Response(data={'detail': 'Expected a since date.'}, status=status.HTTP_400_BAD_REQUEST)
+        resolution = request.QUERY_PARAMS.get('resolution')
+        if resolution and resolution not in RESOLUTIONS:
+            return Response(data={'detail': 'Unsupported resolution, use one of: {resolutions}.'.format(
+                resolutions=', '.join(RESOLUTIONS))}, status=status.HTTP_400_BAD_REQUEST)
+
+        resolution, points = get_temperature_history(storage_location, times['since'],
+                                                     times.get('until') or timezone.now(), resolution)
+        return Response(data={'resolution': resolution, 'results': points})
@@ -0,0 +1,214 @@
+"""
+    cce/archive.py moves temperature readings older than a cutoff out of StorageLocationTempLog into compact columnar
+    files, one pair of numpy arrays per storage location sorted by time: times (int64 microseconds since the epoch)
+    and temperatures (float64). the files are memory mapped when read, so long range analytics go through years of
+    readings without loading them into memory or querying the database.
+
+    each archive run of a storage location writes a new generation of its files holding the readings archived
+    before and the newly archived ones, and switches TemperatureArchive over to it in the transaction that deletes
+    the archived rows. readers that loaded the previous generation can keep reading it, older generations are
+    removed. hourly and daily rollups of archived readings are kept.
+
+    the files hold temperatures in one unit, the temperature unit of the storage location or the unit of its readings
+    if it has none, readings logged in other units are converted with core.uom.TemperatureConverter when they are
+    archived and read.
+"""
+
+#import core python modules
+import datetime
+import os
+import re
+
+#import core django modules
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+#import external modules
+import numpy
+
+#import project modules
+from cce.models import StorageLocation, StorageLocationTempLog, TemperatureArchive
+from core.cache import bump_model_version
+from core.uom import TemperatureConverter
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=timezone.utc)
+GENERATION_FILE = re.compile(r'^(\d+)\.(times|temperatures)\.npy$')
+
+
+def to_microseconds(value):
+    delta = value - EPOCH
+    return (delta.days * 24 * 60 * 60 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def from_microseconds(value):
+    return EPOCH + datetime.timedelta(microseconds=int(value))
+
+
+def get_archive_directory(storage_location_id):
+    return os.path.join(settings.TEMPERATURE_ARCHIVE_ROOT, str(storage_location_id))
+
+
+def get_archive_paths(storage_location_id, generation):
+    """
+        returns tuple of (times path, temperatures path) of a generation of the archive of a storage location
+    """
+    directory = get_archive_directory(storage_location_id)
+    return (os.path.join(directory, '{generation}.times.npy'.format(generation=generation)),
+            os.path.join(directory, '{generation}.temperatures.npy'.format(generation=generation)))
+
+
+def load_archive(archive):
+    """
+        returns tuple of (times, temperatures) memory mapped arrays of the given TemperatureArchive
+    """
+    times_path, temperatures_path = get_archive_paths(archive.storage_location_id, archive.generation)
+    return numpy.load(times_path, mmap_mode='r'), numpy.load(temperatures_path, mmap_mode='r')
+
+
+def get_archived_readings(archive, since=None, until=None):
+    """
+        returns tuple of (times, temperatures) arrays of the archived readings logged from since up to until, they
+        are slices of the memory mapped arrays.
+    """
+    times, temperatures = load_archive(archive)
+    first = 0 if since is None else numpy.searchsorted(times, to_microseconds(since), 'left')
+    last = len(times) if until is None else numpy.searchsorted(times, to_microseconds(until), 'left')
+    return times[first:last], temperatures[first:last]
+
+
+def get_temperature_arrays(storage_location_id, since=None, until=None):
+    """
+        returns tuple of (times, temperatures) numpy arrays of the readings of a storage location logged from since
+        up to until, oldest first. archived readings are read from the archive files and the rest from
+        StorageLocationTempLog, times are microseconds since the epoch, see from_microseconds(). temperatures are in
+        the unit of the archive or else the temperature unit of the storage location.
+    """
+    parts = []
+    archive = TemperatureArchive.objects.filter(storage_location=storage_location_id).first()
+    if archive is not None and archive.temperature_uom_id is not None:
+        temperature_uom_id = archive.temperature_uom_id
+    else:
+        temperature_uom_id = StorageLocation.objects.filter(pk=storage_location_id).values_list(
+            'temperature_uom', flat=True).first()
+    if archive is not None and (since is None or since < archive.archived_until):
+        archived_until = archive.archived_until if until is None else min(until, archive.archived_until)
+        parts.append(get_archived_readings(archive, since, archived_until))
+        since = archive.archived_until
+
+    if until is None or since is None or since < until:
+        logs = StorageLocationTempLog.objects.filter(storage_location=storage_location_id)
+        if since is not None:
+            logs = logs.filter(date_time_logged__gte=since)
+        if until is not None:
+            logs = logs.filter(date_time_logged__lt=until)
+        readings = list(logs.order_by('date_time_logged').values_list('date_time_logged', 'temperature',
+                                                                       'temperature_uom'))
+        if readings or not parts:
+            temperatures = numpy.array([temperature for _, temperature, _ in readings], dtype=numpy.float64)
+            if readings:
+                temperatures = TemperatureConverter().convert_array(temperatures, [uom_id for _, _, uom_id in readings],
+                                                                    temperature_uom_id)
+            parts.append((numpy.fromiter((to_microseconds(logged) for logged, _, _ in readings), dtype=numpy.int64,
+                                         count=len(readings)), temperatures))
+    if len(parts) == 1:
+        return parts[0]
+    return numpy.concatenate([times for times, _ in parts]), numpy.concatenate([values for _, values in parts])
+
+
+def archive_storage_location(storage_location_id, cutoff):
+    """
+        archives the readings of a storage location logged before cutoff and returns the number of readings archived.
+        cutoff should be the start of a day so that archived hours and days line up with the rollups.
+    """
+    new_paths = None
+    try:
+        with transaction.atomic():
+            #ingestion and rollup refreshes of the storage location wait for the archive to be switched
+            temperature_uom_id = StorageLocation.objects.select_for_update().filter(
+                pk=storage_location_id).values_list('temperature_uom', flat=True).first()
+            archive = TemperatureArchive.objects.select_for_update().filter(
+                storage_location=storage_location_id).first()
+            if archive is not None and archive.archived_until >= cutoff:
+                return 0
+            readings = list(StorageLocationTempLog.objects.filter(
+                storage_location=storage_location_id, date_time_logged__lt=cutoff).order_by(
+                'date_time_logged').values_list('date_time_logged', 'temperature', 'temperature_uom'))
+            if temperature_uom_id is None:
+                #the storage location has no temperature unit, the archive keeps the unit it has or takes one
+                if archive is not None and archive.temperature_uom_id is not None:
+                    temperature_uom_id = archive.temperature_uom_id
+                elif readings:
+                    temperature_uom_id = readings[0][2]
+            converter = TemperatureConverter()
+            times = numpy.fromiter((to_microseconds(logged) for logged, _, _ in readings), dtype=numpy.int64,
+                                   count=len(readings))
+            temperatures = converter.convert_array([temperature for _, temperature, _ in readings],
+                                                   [uom_id for _, _, uom_id in readings], temperature_uom_id)
+            if archive is None:
+                archive = TemperatureArchive(storage_location_id=storage_location_id)
+            else:
+                archived_times, archived_temperatures = load_archive(archive)
+                if archive.temperature_uom_id is not None and archive.temperature_uom_id != temperature_uom_id:
+                    #the temperature unit of the storage location has changed since the last run
+                    archived_temperatures = converter.convert_array(
+                        archived_temperatures, [archive.temperature_uom_id] * len(archived_temperatures),
+                        temperature_uom_id)
+                times = numpy.concatenate([archived_times, times])
+                temperatures = numpy.concatenate([archived_temperatures, temperatures])
+                order = numpy.argsort(times, kind='mergesort')
+                times, temperatures = times[order], temperatures[order]
+
+            generation = archive.generation + 1
+            new_paths = get_archive_paths(storage_location_id, generation)
+            if not os.path.isdir(os.path.dirname(new_paths[0])):
+                os.makedirs(os.path.dirname(new_paths[0]))
+            numpy.save(new_paths[0], times)
+            numpy.save(new_paths[1], temperatures)
+
+            archive.archived_until = cutoff
+            archive.generation = generation
+            archive.count = len(times)
+            archive.temperature_uom_id = temperature_uom_id
+            archive.save()
+            #a set-based delete, QuerySet.delete() would load every row and send a post_delete signal for each
+            connection.cursor().execute(
+                'DELETE FROM {table} WHERE storage_location_id = %s AND date_time_logged < %s'.format(
+                    table=StorageLocationTempLog._meta.db_table), [storage_location_id, cutoff])
+        #the delete does not send post_delete signals
+        bump_model_version(StorageLocationTempLog)
+    except Exception:
+        if new_paths is not None:
+            for path in new_paths:
+                if os.path.exists(path):
+                    os.remove(path)
+        raise
+    remove_old_generations(storage_location_id, generation)
+    return len(readings)
+
+
+def remove_old_generations(storage_location_id, generation):
+    """
+        removes archive files older than the generation before the given one
+    """
+    directory = get_archive_directory(storage_location_id)
+    for name in os.listdir(directory):
+        match = GENERATION_FILE.match(name)
+        if match and int(match.group(1)) < generation - 1:
+            os.remove(os.path.join(directory, name))
+
+
+def archive_temperature_logs(cutoff, storage_location_ids=None):
+    """
+        archives readings logged before cutoff of the given storage locations or of every storage location, returns
+        tuple of (storage locations archived, readings archived).
+    """
+    logs = StorageLocationTempLog.all_objects.filter(date_time_logged__lt=cutoff)
+    if storage_location_ids is not None:
+        logs = logs.filter(storage_location__in=storage_location_ids)
+    locations, readings = 0, 0
+    for storage_location_id in logs.values_list('storage_location', flat=True).distinct():
+        archived = archive_storage_location(storage_location_id, cutoff)
+        locations += 1 if archived else 0
+        readings += archived
+    return locations, readings
@@ -0,0 +1,226 @@
+"""
+    cce/excursions.py watches temperature readings as they are logged and raises an on-site notification for the
+    facility of a storage location whose temperature stays above its maximum or below its minimum temperature for
+    longer than TEMPERATURE_EXCURSION_MIN_MINUTES. excursions shorter than that, e.g a single reading taken while the
+    door was open, are ignored.
+
+    the state of each storage location (temperature range, facility and the excursion going on) is kept in memory by
+    the process wide detector, it is loaded from the database the first time a storage location is seen and when
+    storage locations change. readings are fed in batches, the database is only written to when an excursion is
+    confirmed or ends. readings are compared with the temperature range in the temperature unit of their storage
+    location, those logged in another unit are converted with core.uom.TemperatureConverter.
+
+    the database has the last word: feeds lock their storage locations for the rest of the transaction and check the
+    state in memory against it first, so excursions saved by other processes are picked up instead of saved twice,
+    and excursions and readings of transactions that were rolled back are forgotten.
+"""
+
+#import core python modules
+import threading
+import uuid
+from datetime import timedelta
+
+#import core django modules
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.encoding import smart_text
+
+#import project modules
+from alerts.models import OnSiteNotification, Priority
+from cce.models import StorageLocation, StorageLocationTempLog, TemperatureExcursion
+from core.cache import get_model_version
+from core.uom import TemperatureConverter, UOMConversionError
+
+
+def get_min_duration():
+    return timedelta(minutes=getattr(settings, 'TEMPERATURE_EXCURSION_MIN_MINUTES', 60))
+
+
+def get_excursion_kind(temperature, minimum, maximum):
+    """
+        returns TemperatureExcursion kind of a reading or None if the reading is within the temperature range
+    """
+    if maximum is not None and temperature > maximum:
+        return TemperatureExcursion.KINDS.high
+    if minimum is not None and temperature < minimum:
+        return TemperatureExcursion.KINDS.low
+    return None
+
+
+class LocationState(object):
+    """
+        what the detector knows about a storage location.
+
+        excursion: TemperatureExcursion going on or None, it is only saved once it has lasted long enough.
+        confirmed: True once the excursion going on has lasted long enough and has been notified.
+        last_logged: time of the latest reading seen, older readings arriving late are not looked at.
+    """
+    def __init__(self, code, facility_id, minimum, maximum, temperature_uom_id=None):
+        self.code = code
+        self.facility_id = facility_id
+        self.minimum = minimum
+        self.maximum = maximum
+        self.temperature_uom_id = temperature_uom_id
+        self.excursion = None
+        self.confirmed = False
+        self.last_logged = None
+
+
+class ExcursionDetector(object):
+    """
+        keeps LocationState of every storage location it has seen, feed() it readings in the order they were logged.
+    """
+    def __init__(self):
+        self.states = {}
+        self.version = None
+        self.lock = threading.Lock()
+
+    def feed(self, readings):
+        """
+            looks at list of (storage location id, date time logged, temperature, temperature uom id) readings and
+            returns list of TemperatureExcursion confirmed by them.
+        """
+        location_ids = set(location_id for location_id, _, _, _ in readings)
+        converter = None
+        with transaction.atomic():
+            #feeds of the same storage location wait for each other, across processes too. the row locks are taken
+            #before the thread lock, a thread waiting for them must not keep other threads from finishing
+            list(StorageLocation.objects.select_for_update().filter(pk__in=location_ids).order_by('pk').values_list(
+                'pk'))
+            with self.lock:
+                self.load_states(location_ids)
+                self.check_states(location_ids)
+                confirmed, ended = [], []
+                for location_id, logged, temperature, uom_id in sorted(readings, key=lambda reading: reading[1]):
+                    state = self.states.get(location_id)
+                    if state is None or (state.last_logged is not None and logged <= state.last_logged):
+                        continue
+                    if uom_id is not None and state.temperature_uom_id is not None and \
+                            uom_id != state.temperature_uom_id:
+                        if converter is None:
+                            converter = TemperatureConverter()
+                        try:
+                            temperature = converter.convert(temperature, uom_id, state.temperature_uom_id)
+                        except UOMConversionError:
+                            #can not be compared with the temperature range
+                            continue
+                    state.last_logged = logged
+                    self.look_at(state, location_id, logged, temperature, confirmed, ended)
+                if confirmed or ended:
+                    self.save(confirmed, ended)
+                return confirmed
+
+    def look_at(self, state, location_id, logged, temperature, confirmed, ended):
+        kind = get_excursion_kind(temperature, state.minimum, state.maximum)
+        excursion = state.excursion
+        if excursion is not None and excursion.kind != kind:
+            #back in range or gone the other way, an excursion that was not confirmed was only a spike
+            if state.confirmed:
+                excursion.ended_at = logged
+                ended.append(excursion)
+            state.excursion, state.confirmed = None, False
+            excursion = None
+        if kind is None:
+            return
+        if excursion is None:
+            state.excursion = TemperatureExcursion(storage_location_id=location_id, kind=kind, started_at=logged,
+                                                   peak_temperature=temperature)
+            return
+        if kind == TemperatureExcursion.KINDS.high:
+            excursion.peak_temperature = max(excursion.peak_temperature, temperature)
+        else:
+            excursion.peak_temperature = min(excursion.peak_temperature, temperature)
+        if not state.confirmed and logged - excursion.started_at >= get_min_duration():
+            excursion.notification = self.get_notification(state, excursion)
+            state.confirmed = True
+            confirmed.append(excursion)
+
+    def get_notification(self, state, excursion):
+        if excursion.kind == TemperatureExcursion.KINDS.high:
+            message = '{code}: temperature above {limit} since {started_at:%Y-%m-%d %H:%M}, peak {peak}.'
+            limit = state.maximum
+        else:
+            message = '{code}: temperature below {limit} since {started_at:%Y-%m-%d %H:%M}, lowest {peak}.'
+            limit = state.minimum
+        message = message.format(code=state.code, limit=limit, started_at=timezone.localtime(excursion.started_at),
+                                 peak=excursion.peak_temperature)
+        return OnSiteNotification(uuid=smart_text(uuid.uuid4()), source_id=state.facility_id,
+                                  destination_id=state.facility_id, message=message[:200],
+                                  priority_level=Priority.LEVELS.high, date_time=timezone.now())
+
+    def save(self, confirmed, ended):
+        """
+            saves confirmed excursions with their notifications and the end of excursions that were saved before.
+            check_states() has picked up the open excursions of the locked storage locations, so a confirmed
+            excursion is never a second open excursion of its storage location.
+        """
+        with transaction.atomic():
+            OnSiteNotification.objects.bulk_create([excursion.notification for excursion in confirmed])
+            TemperatureExcursion.objects.bulk_create(confirmed)
+            for excursion in ended:
+                TemperatureExcursion.objects.filter(pk=excursion.pk).update(
+                    ended_at=excursion.ended_at, peak_temperature=excursion.peak_temperature, modified=timezone.now())
+
+    def load_states(self, location_ids):
+        """
+            loads states of storage locations not seen before, all states are reloaded when storage locations have
+            changed since they were loaded. excursions going on are picked up from the database by check_states().
+        """
+        version = get_model_version(StorageLocation)[0]
+        previous = {}
+        if version != self.version:
+            #the temperature range or facility may have changed, excursions and readings seen are carried over
+            previous, self.states, self.version = self.states, {}, version
+            location_ids = location_ids | set(previous)
+        location_ids = [location_id for location_id in location_ids if location_id not in self.states]
+        if not location_ids:
+            return
+        for pk, code, facility_id, minimum, maximum, uom_id in StorageLocation.objects.filter(
+                pk__in=location_ids).values_list('pk', 'code', 'facility', 'minimum_temperature',
+                                                 'maximum_temperature', 'temperature_uom'):
+            state = self.states[pk] = LocationState(code, facility_id, minimum, maximum, uom_id)
+            if pk in previous:
+                state.excursion, state.confirmed = previous[pk].excursion, previous[pk].confirmed
+                state.last_logged = previous[pk].last_logged
+
+    def check_states(self, location_ids):
+        """
+            brings states of the given storage locations in line with the database. the open excursion saved in the
+            database is the excursion going on, it may have been saved or ended by another process, or not be there
+            at all when the transaction that saved it was rolled back. excursions not confirmed yet and the time of
+            the latest reading seen are forgotten when their readings are not in the database.
+        """
+        states = dict((location_id, self.states[location_id]) for location_id in location_ids
+                      if location_id in self.states)
+        if not states:
+            return
+        open_excursions = {}
+        for excursion in TemperatureExcursion.objects.filter(storage_location__in=list(states),
+                                                              ended_at__isnull=True).order_by('started_at'):
+            open_excursions.setdefault(excursion.storage_location_id, excursion)
+        for location_id, state in states.items():
+            excursion = open_excursions.get(location_id)
+            if excursion is not None:
+                if not (state.confirmed and state.excursion.pk == excursion.pk):
+                    state.excursion, state.confirmed = excursion, True
+            elif state.confirmed:
+                state.excursion, state.confirmed = None, False
+
+        times = set(state.last_logged for state in states.values() if state.last_logged is not None)
+        times.update(state.excursion.started_at for state in states.values()
+                     if state.excursion is not None and not state.confirmed)
+        if not times:
+            return
+        logged = set(StorageLocationTempLog.objects.filter(storage_location__in=list(states),
+                                                           date_time_logged__in=times).values_list(
+            'storage_location', 'date_time_logged'))
+        for location_id, state in states.items():
+            if state.excursion is not None and not state.confirmed and \
+                    (location_id, state.excursion.started_at) not in logged:
+                state.excursion = None
+            if state.last_logged is not None and (location_id, state.last_logged) not in logged:
+                state.last_logged = None
+
+
+detector = ExcursionDetector()
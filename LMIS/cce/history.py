@@ -0,0 +1,52 @@
+"""
+    cce/history.py returns the temperature history of a storage location at a resolution that suits the requested
+    time range: every reading for short ranges, hourly or daily rollups for longer ones. readings moved to the
+    archive by cce/archive.py are read from the archive files.
+"""
+
+#import core django modules
+from django.conf import settings
+
+#import project modules
+from cce.archive import get_temperature_arrays, from_microseconds
+from cce.models import StorageLocationTempRollup, HOUR
+
+RAW = 'raw'
+RESOLUTIONS = (RAW, StorageLocationTempRollup.RESOLUTIONS.hour, StorageLocationTempRollup.RESOLUTIONS.day)
+
+
+def get_history_resolution(since, until):
+    """
+        returns resolution of the temperature history between since and until: raw readings for ranges of up to
+        TEMPERATURE_HISTORY_RAW_DAYS days, else hourly rollups as long as there are no more than
+        TEMPERATURE_HISTORY_MAX_POINTS hours in the range, else daily rollups.
+    """
+    period = until - since
+    if period.total_seconds() <= getattr(settings, 'TEMPERATURE_HISTORY_RAW_DAYS', 2) * 24 * 60 * 60:
+        return RAW
+    if period.total_seconds() / HOUR.total_seconds() <= getattr(settings, 'TEMPERATURE_HISTORY_MAX_POINTS', 1000):
+        return StorageLocationTempRollup.RESOLUTIONS.hour
+    return StorageLocationTempRollup.RESOLUTIONS.day
+
+
+def get_temperature_history(storage_location_id, since, until, resolution=None):
+    """
+        returns tuple of (resolution, points) of the temperature history of a storage location from since up to
+        until, oldest first. resolution is picked with get_history_resolution() if it is not given.
+
+        raw points are dicts of time and temperature, rollup points are dicts of time (start of the hour or day),
+        count, minimum, maximum, mean and minutes_outside.
+    """
+    resolution = resolution or get_history_resolution(since, until)
+    if resolution == RAW:
+        times, temperatures = get_temperature_arrays(storage_location_id, since, until)
+        return resolution, [{'time': from_microseconds(logged), 'temperature': float(temperature)}
+                            for logged, temperature in zip(times, temperatures)]
+
+    rollups = StorageLocationTempRollup.objects.filter(
+        storage_location=storage_location_id, resolution=resolution, period_start__gte=since,
+        period_start__lt=until).order_by('period_start').values_list(
+        'period_start', 'count', 'minimum', 'maximum', 'total', 'minutes_outside')
+    return resolution, [{'time': start, 'count': count, 'minimum': minimum, 'maximum': maximum,
+                         'mean': total / count if count else None, 'minutes_outside': minutes_outside}
+                        for start, count, minimum, maximum, total, minutes_outside in rollups]
@@ -0,0 +1,280 @@
+"""
+    cce/ingest.py bulk loads temperature readings reported by fridges and cold rooms into StorageLocationTempLog.
+
+    readings are read from a CSV (with a header row) or newline delimited JSON stream a chunk at a time. storage
+    locations and units referenced by a chunk are looked up with one query each and remembered for the rest of the
+    stream, readings already logged for the same storage location and time are skipped and the new ones are written
+    with one multi-row INSERT per chunk. new readings are fed to the excursion detector a chunk at a time and
+    temperature rollups of the hours the stream touched are refreshed once at the end. no reversion revision is
+    saved for ingested readings.
+
+    readings are stored in the temperature unit of their storage location, those reported in another unit are
+    converted with core.uom.TemperatureConverter.
+"""
+
+#import core python modules
+import codecs
+import csv
+import json
+import math
+
+#import core django modules
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.db.models import Q
+from django.utils import six, timezone
+from django.utils.dateparse import parse_datetime
+
+#import project modules
+from cce.excursions import detector
+from cce.models import StorageLocation, StorageLocationTempLog, StorageLocationTempRollup, TemperatureArchive
+from core.cache import bump_model_version
+from core.models import UnitOfMeasurement
+from core.uom import TemperatureConverter, UOMConversionError
+
+REQUIRED_FIELDS = ('storage_location', 'temperature', 'date_time_logged')
+
+
+class IngestError(Exception):
+    """
+        raised when a stream of readings can not be read at all, e.g a CSV stream without the required columns.
+    """
+    pass
+
+
+def iter_lines(stream):
+    """
+        yields lines of a binary stream as text
+    """
+    if stream is None:
+        return iter(())
+    if six.PY3:
+        return codecs.iterdecode(stream, 'utf-8')
+    return stream
+
+
+def read_csv_readings(stream):
+    """
+        yields tuple of (line number, reading dict, error) for every row of a CSV stream
+    """
+    reader = csv.DictReader(iter_lines(stream))
+    if reader.fieldnames is None:
+        return
+    missing = [name for name in REQUIRED_FIELDS if name not in reader.fieldnames]
+    if missing:
+        raise IngestError('Missing CSV columns: {columns}.'.format(columns=', '.join(missing)))
+    for row in reader:
+        yield reader.line_num, row, None
+
+
+def read_ndjson_readings(stream):
+    """
+        yields tuple of (line number, reading dict, error) for every line of a newline delimited JSON stream
+    """
+    for number, line in enumerate(iter_lines(stream), 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            reading = json.loads(line)
+        except ValueError:
+            yield number, None, 'Invalid JSON.'
+            continue
+        if not isinstance(reading, dict):
+            yield number, None, 'Expected an object.'
+            continue
+        yield number, reading, None
+
+
+READERS = {
+    'text/csv': read_csv_readings,
+    'application/x-ndjson': read_ndjson_readings,
+}
+
+
+def get_identifier(value):
+    if value is None or value == '':
+        return None
+    return six.text_type(value)
+
+
+class TemperatureLogIngester(object):
+    """
+        writes readings to StorageLocationTempLog a chunk at a time and keeps count of what was done with them.
+
+        temperature_uom: uuid, symbol or name of the unit of readings that do not name one, readings without a unit
+        default to the temperature unit of their storage location. readings are converted to the temperature unit of
+        their storage location if it has one.
+    """
+    def __init__(self, temperature_uom=None, user=None, chunk_size=None, max_readings=None):
+        self.temperature_uom = get_identifier(temperature_uom)
+        self.user = user
+        self.chunk_size = chunk_size or getattr(settings, 'TEMPERATURE_LOG_INGEST_CHUNK_SIZE', 5000)
+        self.max_readings = max_readings or getattr(settings, 'TEMPERATURE_LOG_INGEST_MAX_READINGS', 100000)
+        #identifier: (uuid, temperature_uom uuid, archived until) or None if there is no such storage location
+        self.storage_locations = {}
+        #identifier: uuid or None if there is no such unit
+        self.units = {}
+        #TemperatureConverter, created when the first reading in another unit than its storage location comes in
+        self.converter = None
+        #(storage location id, hour start) of the temperature rollups changed by the ingested readings
+        self.changed_hours = set()
+        self.received = 0
+        self.created = 0
+        self.duplicates = 0
+        self.errors = []
+
+    def ingest(self, readings):
+        """
+            ingests tuples of (line number, reading, error) as read by one of the READERS and returns a summary.
+            call it inside transaction.atomic() to have all or none of the stream written.
+        """
+        chunk = []
+        for item in readings:
+            chunk.append(item)
+            if self.received + len(chunk) > self.max_readings:
+                raise IngestError('Expected at most {max_readings} readings.'.format(max_readings=self.max_readings))
+            if len(chunk) >= self.chunk_size:
+                self.ingest_chunk(chunk)
+                chunk = []
+        if chunk:
+            self.ingest_chunk(chunk)
+        StorageLocationTempRollup.objects.refresh(self.changed_hours)
+        #bulk_create() does not send post_save signals
+        bump_model_version(StorageLocationTempLog)
+        return self.get_summary()
+
+    def get_summary(self):
+        return {
+            'received': self.received,
+            'created': self.created,
+            'duplicates': self.duplicates,
+            'rejected': len(self.errors),
+            'errors': self.errors,
+        }
+
+    def ingest_chunk(self, chunk):
+        self.resolve_references([reading for number, reading, error in chunk if reading is not None])
+        logs = {}
+        for number, reading, error in chunk:
+            self.received += 1
+            log = None
+            if error is None:
+                log, error = self.build_log(reading)
+            if error is not None:
+                self.errors.append({'line': number, 'error': error})
+                continue
+            key = (log.storage_location_id, log.date_time_logged)
+            if key in logs:
+                self.duplicates += 1
+                continue
+            logs[key] = log
+        if not logs:
+            return
+
+        for attempt in range(2):
+            try:
+                with transaction.atomic():
+                    new_logs = self.remove_logged(logs)
+                    StorageLocationTempLog.objects.bulk_create(new_logs)
+                break
+            except IntegrityError:
+                #a concurrent request logged some of the same readings after they were looked up, they are visible
+                #now that it has committed.
+                if attempt:
+                    raise
+        self.changed_hours |= StorageLocationTempRollup.objects.get_changed_hours(
+            [(log.storage_location_id, log.date_time_logged) for log in new_logs])
+        detector.feed([(log.storage_location_id, log.date_time_logged, log.temperature, log.temperature_uom_id)
+                       for log in new_logs])
+        self.created += len(new_logs)
+        self.duplicates += len(logs) - len(new_logs)
+
+    def resolve_references(self, readings):
+        """
+            looks up storage locations and units referenced by readings that have not been seen before, one query
+            per model.
+        """
+        locations, units = set(), set()
+        for reading in readings:
+            locations.add(get_identifier(reading.get('storage_location')))
+            units.add(get_identifier(reading.get('temperature_uom')))
+        units.add(self.temperature_uom)
+        locations = set(identifier for identifier in locations if identifier and
+                        identifier not in self.storage_locations)
+        units = set(identifier for identifier in units if identifier and identifier not in self.units)
+
+        if locations:
+            for identifier in locations:
+                self.storage_locations[identifier] = None
+            found = list(StorageLocation.objects.filter(Q(uuid__in=locations) | Q(code__in=locations)).values_list(
+                'uuid', 'code', 'temperature_uom'))
+            archived = dict(TemperatureArchive.objects.filter(
+                storage_location__in=[uuid for uuid, _, _ in found]).values_list('storage_location', 'archived_until'))
+            for uuid, code, temperature_uom in found:
+                for identifier in (uuid, code):
+                    if identifier in locations:
+                        self.storage_locations[identifier] = (uuid, temperature_uom, archived.get(uuid))
+        if units:
+            for identifier in units:
+                self.units[identifier] = None
+            for uuid, symbol, name in UnitOfMeasurement.objects.filter(
+                    Q(uuid__in=units) | Q(symbol__in=units) | Q(name__in=units)).order_by('name').values_list(
+                    'uuid', 'symbol', 'name'):
+                for identifier in (uuid, symbol, name):
+                    if identifier in units and self.units[identifier] is None:
+                        self.units[identifier] = uuid
+
+    def build_log(self, reading):
+        """
+            returns tuple of (StorageLocationTempLog, None) or (None, error) for the given reading
+        """
+        location = self.storage_locations.get(get_identifier(reading.get('storage_location')))
+        if location is None:
+            return None, 'Unknown storage location.'
+        location_id, location_uom_id, archived_until = location
+
+        try:
+            temperature = float(reading.get('temperature'))
+        except (TypeError, ValueError):
+            temperature = None
+        if temperature is None or math.isnan(temperature) or math.isinf(temperature):
+            return None, 'Expected a number for temperature.'
+
+        try:
+            logged = parse_datetime(reading.get('date_time_logged') or '')
+        except (TypeError, ValueError):
+            logged = None
+        if logged is None:
+            return None, 'Expected an ISO 8601 date and time for date_time_logged.'
+        if timezone.is_naive(logged):
+            logged = timezone.make_aware(logged, timezone.get_current_timezone())
+        if archived_until is not None and logged < archived_until:
+            return None, 'Logged before the archived readings of the storage location end.'
+
+        uom = get_identifier(reading.get('temperature_uom')) or self.temperature_uom
+        uom_id = self.units.get(uom) if uom else location_uom_id
+        if uom_id is None:
+            return None, 'Unknown temperature unit.' if uom else 'The storage location has no temperature unit.'
+        if location_uom_id is not None and uom_id != location_uom_id:
+            if self.converter is None:
+                self.converter = TemperatureConverter()
+            try:
+                temperature = self.converter.convert(temperature, uom_id, location_uom_id)
+            except UOMConversionError:
+                return None, 'Can not convert the temperature to the unit of the storage location.'
+            uom_id = location_uom_id
+
+        return StorageLocationTempLog(storage_location_id=location_id, temperature=temperature,
+                                      temperature_uom_id=uom_id, date_time_logged=logged, created_by=self.user,
+                                      modified_by=self.user), None
+
+    def remove_logged(self, logs):
+        """
+            returns list of logs in the {(storage location, date time logged): log} dict that are not logged yet
+        """
+        times = [logged for location_id, logged in logs]
+        logged = set(StorageLocationTempLog.all_objects.filter(
+            storage_location__in=set(location_id for location_id, _ in logs),
+            date_time_logged__range=(min(times), max(times))).values_list('storage_location', 'date_time_logged'))
+        return [log for key, log in logs.items() if key not in logged]
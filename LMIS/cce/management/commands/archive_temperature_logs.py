@@ -0,0 +1,41 @@
+"""
+    manage.py archive_temperature_logs moves old temperature readings out of the database into the columnar archive.
+"""
+
+#import core python modules
+import datetime
+from optparse import make_option
+
+#import core django modules
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+#import project modules
+from cce.archive import archive_temperature_logs
+from cce.models import StorageLocation, get_period_start, DAY
+
+
+class Command(BaseCommand):
+    args = '<storage_location_code storage_location_code ...>'
+    help = 'Archives temperature readings older than --days days of the given storage locations or of all storage ' \
+           'locations.'
+    option_list = BaseCommand.option_list + (
+        make_option('--days', action='store', dest='days', type='int', default=None,
+                    help='Archive readings logged before this many days ago. Defaults to '
+                         'TEMPERATURE_ARCHIVE_AFTER_DAYS.'),
+    )
+
+    def handle(self, *codes, **options):
+        storage_location_ids = None
+        if codes:
+            locations = dict(StorageLocation.objects.filter(code__in=codes).values_list('code', 'pk'))
+            missing = set(codes) - set(locations)
+            if missing:
+                raise CommandError('Unknown storage location(s): {codes}'.format(codes=', '.join(sorted(missing))))
+            storage_location_ids = list(locations.values())
+        days = options['days'] or getattr(settings, 'TEMPERATURE_ARCHIVE_AFTER_DAYS', 365)
+        cutoff = get_period_start(timezone.now() - datetime.timedelta(days=days), DAY)
+        locations, readings = archive_temperature_logs(cutoff, storage_location_ids)
+        self.stdout.write('{readings} reading(s) of {locations} storage location(s) logged before {cutoff} '
+                          'archived.'.format(readings=readings, locations=locations, cutoff=cutoff.isoformat()))
@@ -0,0 +1,59 @@
+"""
+    manage.py rebuild_temperature_rollups recomputes hourly and daily temperature rollups from the temperature log.
+"""
+
+#import core python modules
+import datetime
+from optparse import make_option
+
+#import core django modules
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min, Max
+from django.utils.dateparse import parse_date
+from django.utils import timezone
+
+#import project modules
+from cce.models import StorageLocation, StorageLocationTempLog, StorageLocationTempRollup, get_period_start, HOUR, DAY
+
+
+class Command(BaseCommand):
+    args = '<storage_location_code storage_location_code ...>'
+    help = 'Recomputes temperature rollups of the given storage locations or of all storage locations.'
+    option_list = BaseCommand.option_list + (
+        make_option('--since', action='store', dest='since', default=None,
+                    help='Only recompute rollups from this date (YYYY-MM-DD).'),
+        make_option('--days', action='store', dest='days', type='int', default=7,
+                    help='Number of days of rollups recomputed per transaction. Defaults to 7.'),
+    )
+
+    def handle(self, *codes, **options):
+        logs = StorageLocationTempLog.objects.all()
+        if codes:
+            locations = dict(StorageLocation.objects.filter(code__in=codes).values_list('code', 'pk'))
+            missing = set(codes) - set(locations)
+            if missing:
+                raise CommandError('Unknown storage location(s): {codes}'.format(codes=', '.join(sorted(missing))))
+            logs = logs.filter(storage_location__in=locations.values())
+        if options['since']:
+            since = parse_date(options['since'])
+            if since is None:
+                raise CommandError('Expected a YYYY-MM-DD date for --since.')
+            logs = logs.filter(date_time_logged__gte=timezone.make_aware(
+                datetime.datetime.combine(since, datetime.time()), timezone.get_current_timezone()))
+
+        refreshed = 0
+        for location_id, first, last in logs.values_list('storage_location').annotate(
+                first=Min('date_time_logged'), last=Max('date_time_logged')).values_list(
+                'storage_location', 'first', 'last'):
+            start = get_period_start(first, DAY)
+            while start <= last:
+                end = start + DAY * options['days']
+                hours = set()
+                hour = start
+                while hour < end:
+                    hours.add((location_id, hour))
+                    hour += HOUR
+                StorageLocationTempRollup.objects.refresh(hours)
+                refreshed += len(hours)
+                start = end
+        self.stdout.write('{hours} hour(s) of rollups recomputed.'.format(hours=refreshed))
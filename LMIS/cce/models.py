@@ -3,8 +3,19 @@
     facility the CCE is at and the warehouse.
 """
 
+#import core python modules
+import bisect
+from datetime import timedelta
+from functools import reduce
+from operator import or_
+
 #import django modules
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Q
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
 
 #import external modules
 import reversion
@@ -12,7 +23,10 @@ from mptt.models import MPTTModel, TreeForeignKey
 from model_utils import Choices
 
 #import project app modules
+from core.cache import track_model_versions
 from core.models import BaseModel, UnitOfMeasurement
+from core.signals import post_update_is_deleted
+from core.uom import TemperatureConverter
 from facilities.models import Facility
 
 
@@ -60,10 +74,252 @@ class StorageLocationTempLog(BaseModel):
     storage_location = models.ForeignKey(StorageLocation)
     date_time_logged = models.DateTimeField()
 
+    class Meta:
+        unique_together = ('storage_location', 'date_time_logged')
+
     def __str__(self):
         return '{storage_loc_code}-{temp}'.format(storage_loc_code=self.storage_location.code, temp=self.temperature)
 
 
+HOUR = timedelta(hours=1)
+DAY = timedelta(days=1)
+
+
+def get_temperature_max_gap():
+    """
+        returns how long a temperature reading is taken to hold for when no reading follows it
+    """
+    return timedelta(minutes=max(getattr(settings, 'TEMPERATURE_ROLLUP_MAX_GAP_MINUTES', 30), 1))
+
+
+def get_period_start(value, period):
+    """
+        returns start of the local hour or day the given datetime falls in
+    """
+    value = timezone.localtime(value)
+    if period == DAY:
+        return value.replace(hour=0, minute=0, second=0, microsecond=0)
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def is_outside(temperature, minimum, maximum):
+    return (minimum is not None and temperature < minimum) or (maximum is not None and temperature > maximum)
+
+
+def summarise_readings(times, temperatures, start, end, minimum, maximum, max_gap):
+    """
+        returns dict of rollup fields of the readings logged from start up to end or None if there are none.
+
+        times and temperatures are the sorted readings of a storage location, including the ones logged up to
+        max_gap before start. each reading holds until the next one or for max_gap, whichever is sooner, and counts
+        towards minutes_outside for as long as it holds outside the minimum and maximum temperatures.
+
+        a period without readings of its own that a reading outside the temperature range holds into still gets a
+        rollup, with a count of 0 and the temperature of that reading as minimum and maximum, so the time outside is
+        not lost.
+    """
+    first, last = bisect.bisect_left(times, start), bisect.bisect_left(times, end)
+    #readings are sorted, only the last reading before start can hold into the period
+    readings = temperatures[first:last] or temperatures[max(first - 1, 0):first]
+    seconds_outside = 0
+    for index in range(max(first - 1, 0), last):
+        if not is_outside(temperatures[index], minimum, maximum):
+            continue
+        next_time = times[index + 1] if index + 1 < len(times) else end
+        held_from, held_to = max(times[index], start), min(next_time, times[index] + max_gap, end)
+        if held_to > held_from:
+            seconds_outside += (held_to - held_from).total_seconds()
+    if first == last and not seconds_outside:
+        return None
+    count = last - first
+    return {'count': count, 'minimum': min(readings), 'maximum': max(readings), 'total': sum(readings) if count else 0,
+            'minutes_outside': seconds_outside / 60.0}
+
+
+class StorageLocationTempRollupManager(models.Manager):
+    """
+        StorageLocationTempRollup manager, refresh() is the only way rollups should be changed.
+    """
+    def get_changed_hours(self, readings):
+        """
+            returns set of (storage location id, hour start) of the hourly rollups changed by adding or removing
+            readings, list of (storage location id, date time logged). a reading also changes the hours it holds
+            into, see summarise_readings().
+        """
+        max_gap = get_temperature_max_gap()
+        hours = set()
+        for location_id, logged in readings:
+            start = get_period_start(logged, HOUR)
+            while start < logged + max_gap:
+                hours.add((location_id, start))
+                start += HOUR
+        return hours
+
+    def refresh(self, hours):
+        """
+            recomputes the given (storage location id, hour start) hourly rollups from the readings and the daily
+            rollups of their days from the hourly rollups, readings are fetched with one query and rollups are
+            replaced with one DELETE and one INSERT per resolution.
+
+            storage locations are locked for the rest of the transaction, so concurrent refreshes of a storage
+            location do not overwrite each other. rollups of archived readings are left as they are. readings are
+            summarised in the temperature unit of their storage location, see TemperatureConverter.
+        """
+        if not hours:
+            return
+        archived = dict(TemperatureArchive.objects.filter(
+            storage_location__in=set(location_id for location_id, _ in hours)).values_list(
+            'storage_location', 'archived_until'))
+        hours = set((location_id, start) for location_id, start in hours
+                    if location_id not in archived or start >= archived[location_id])
+        if not hours:
+            return
+        max_gap = get_temperature_max_gap()
+        location_ids = set(location_id for location_id, _ in hours)
+        starts = [start for _, start in hours]
+        with transaction.atomic():
+            locations = dict((pk, (minimum, maximum, uom_id)) for pk, minimum, maximum, uom_id in
+                             StorageLocation.objects.filter(pk__in=location_ids).select_for_update().order_by(
+                                 'pk').values_list('pk', 'minimum_temperature', 'maximum_temperature',
+                                                   'temperature_uom'))
+            readings = {}
+            for location_id, logged, temperature, uom_id in StorageLocationTempLog.objects.filter(
+                    storage_location__in=location_ids, date_time_logged__gte=min(starts) - max_gap,
+                    date_time_logged__lt=max(starts) + HOUR).order_by('date_time_logged').values_list(
+                    'storage_location', 'date_time_logged', 'temperature', 'temperature_uom'):
+                times, temperatures, uom_ids = readings.setdefault(location_id, ([], [], []))
+                times.append(logged)
+                temperatures.append(temperature)
+                uom_ids.append(uom_id)
+            converter = None
+            for location_id, (times, temperatures, uom_ids) in readings.items():
+                location_uom_id = locations.get(location_id, (None, None, None))[2]
+                if location_uom_id is None or all(uom_id == location_uom_id for uom_id in uom_ids):
+                    continue
+                if converter is None:
+                    converter = TemperatureConverter()
+                readings[location_id] = (times, list(converter.convert_array(temperatures, uom_ids, location_uom_id)),
+                                         uom_ids)
+
+            rollups = []
+            for location_id, start in hours:
+                if location_id not in locations:
+                    continue
+                minimum, maximum, _ = locations[location_id]
+                times, temperatures, _ = readings.get(location_id, ([], [], []))
+                fields = summarise_readings(times, temperatures, start, start + HOUR, minimum, maximum, max_gap)
+                if fields is not None:
+                    rollups.append(StorageLocationTempRollup(storage_location_id=location_id, period_start=start,
+                                                             resolution=StorageLocationTempRollup.RESOLUTIONS.hour,
+                                                             **fields))
+            self.replace(StorageLocationTempRollup.RESOLUTIONS.hour, hours, rollups)
+
+            days = set((location_id, get_period_start(start, DAY)) for location_id, start in hours)
+            self.replace(StorageLocationTempRollup.RESOLUTIONS.day, days, self.get_daily_rollups(days))
+
+    def get_daily_rollups(self, days):
+        """
+            returns list of daily rollups of the given (storage location id, day start) worked out from the hourly
+            rollups
+        """
+        starts = [start for _, start in days]
+        totals = {}
+        for location_id, start, count, minimum, maximum, total, minutes_outside in self.filter(
+                storage_location__in=set(location_id for location_id, _ in days),
+                resolution=StorageLocationTempRollup.RESOLUTIONS.hour, period_start__gte=min(starts),
+                period_start__lt=max(starts) + DAY).values_list(
+                'storage_location', 'period_start', 'count', 'minimum', 'maximum', 'total', 'minutes_outside'):
+            key = (location_id, get_period_start(start, DAY))
+            if key not in days:
+                continue
+            if key not in totals:
+                totals[key] = {'count': count, 'minimum': minimum, 'maximum': maximum, 'total': total,
+                               'minutes_outside': minutes_outside}
+                continue
+            fields = totals[key]
+            fields['count'] += count
+            fields['minimum'] = min(fields['minimum'], minimum)
+            fields['maximum'] = max(fields['maximum'], maximum)
+            fields['total'] += total
+            fields['minutes_outside'] += minutes_outside
+        return [StorageLocationTempRollup(storage_location_id=location_id, period_start=start,
+                                          resolution=StorageLocationTempRollup.RESOLUTIONS.day, **fields)
+                for (location_id, start), fields in totals.items()]
+
+    def replace(self, resolution, periods, rollups):
+        """
+            deletes rollups of the given (storage location id, period start) and inserts rollups in their place
+        """
+        starts = {}
+        for location_id, start in periods:
+            starts.setdefault(location_id, []).append(start)
+        self.filter(reduce(or_, [Q(storage_location=location_id, period_start__in=location_starts)
+                                 for location_id, location_starts in starts.items()]),
+                    resolution=resolution).delete()
+        self.bulk_create(rollups)
+
+
+class StorageLocationTempRollup(BaseModel):
+    """
+        StorageLocationTempRollup summarises the temperature readings of a storage location over an hour or a day:
+        lowest, highest and mean temperature, number of readings and minutes spent outside the storage location
+        minimum and maximum temperature. they are kept up to date as readings are logged, so temperature charts
+        over long periods read a row per hour or day instead of every reading.
+
+        they can be recomputed from the readings with "manage.py rebuild_temperature_rollups".
+    """
+    RESOLUTIONS = Choices(('hour', 'Hourly'), ('day', 'Daily'))
+    storage_location = models.ForeignKey(StorageLocation, related_name='temp_rollups')
+    resolution = models.CharField(max_length=4, choices=RESOLUTIONS)
+    period_start = models.DateTimeField()
+    count = models.IntegerField()
+    minimum = models.FloatField()
+    maximum = models.FloatField()
+    total = models.FloatField()
+    minutes_outside = models.FloatField(default=0)
+
+    all_objects = models.Manager()
+    objects = StorageLocationTempRollupManager()
+
+    class Meta:
+        unique_together = ('storage_location', 'resolution', 'period_start')
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+
+class TemperatureExcursion(BaseModel):
+    """
+        TemperatureExcursion is a period the temperature of a storage location stayed above its maximum or below its
+        minimum temperature for longer than TEMPERATURE_EXCURSION_MIN_MINUTES, it is recorded by the excursion
+        detector in cce/excursions.py. ended_at is None while the excursion is going on.
+    """
+    KINDS = Choices(('high', 'Too warm'), ('low', 'Too cold'))
+    storage_location = models.ForeignKey(StorageLocation, related_name='temp_excursions')
+    kind = models.CharField(max_length=4, choices=KINDS)
+    started_at = models.DateTimeField()
+    ended_at = models.DateTimeField(blank=True, null=True)
+    peak_temperature = models.FloatField()
+    notification = models.ForeignKey('alerts.OnSiteNotification', blank=True, null=True, on_delete=models.SET_NULL)
+
+    class Meta:
+        index_together = (('storage_location', 'ended_at'),)
+
+
+class TemperatureArchive(BaseModel):
+    """
+        TemperatureArchive records the temperature readings of a storage location moved out of
+        StorageLocationTempLog into columnar files by cce/archive.py. readings logged before archived_until are only
+        in the files of the current generation, their temperatures are in temperature_uom units.
+    """
+    storage_location = models.OneToOneField(StorageLocation, related_name='temp_archive')
+    archived_until = models.DateTimeField()
+    generation = models.IntegerField(default=0)
+    count = models.IntegerField(default=0)
+    temperature_uom = models.ForeignKey(UnitOfMeasurement, related_name='temp_archives', blank=True, null=True)
+
+
 class StorageLocationProblemLog(BaseModel):
     """
         This model is used to keep problem log for storage locations
@@ -82,4 +338,52 @@ class StorageLocationProblemLog(BaseModel):
 reversion.register(StorageLocationType)
 reversion.register(StorageLocation)
 reversion.register(StorageLocationTempLog)
-reversion.register(StorageLocationProblemLog)
\ No newline at end of file
+reversion.register(StorageLocationProblemLog)
+
+#the excursion detector reloads temperature ranges when the StorageLocation version changes
+track_model_versions(StorageLocation)
+
+
+@receiver(pre_save, sender=StorageLocationTempLog)
+def remember_temp_log_reading(sender, instance, **kwargs):
+    """
+        remembers the storage location and time of a temperature reading before it is changed, the rollups of the
+        hours it is moved out of have to be refreshed too
+    """
+    instance._previous_reading = None
+    if instance.pk:
+        instance._previous_reading = sender.all_objects.filter(pk=instance.pk).values_list(
+            'storage_location', 'date_time_logged').first()
+
+
+@receiver(post_save, sender=StorageLocationTempLog)
+@receiver(post_delete, sender=StorageLocationTempLog)
+def refresh_temp_log_rollups(sender, instance, **kwargs):
+    """
+        refreshes rollups of temperature readings logged, changed or deleted one at a time
+    """
+    readings = [(instance.storage_location_id, instance.date_time_logged)]
+    previous, instance._previous_reading = getattr(instance, '_previous_reading', None), None
+    if previous is not None and previous != readings[0]:
+        readings.append(previous)
+    StorageLocationTempRollup.objects.refresh(StorageLocationTempRollup.objects.get_changed_hours(readings))
+
+
+@receiver(post_update_is_deleted, sender=StorageLocationTempLog)
+def refresh_temp_log_rollups_is_deleted(sender, uuids, is_deleted, **kwargs):
+    """
+        refreshes rollups of temperature readings soft deleted or recovered by a set-based update
+    """
+    StorageLocationTempRollup.objects.refresh(StorageLocationTempRollup.objects.get_changed_hours(
+        sender.all_objects.filter(uuid__in=uuids).values_list('storage_location', 'date_time_logged')))
+
+
+@receiver(post_save, sender=StorageLocationTempLog)
+def detect_temp_log_excursion(sender, instance, created, **kwargs):
+    """
+        feeds temperature readings logged one at a time to the excursion detector
+    """
+    if created and not instance.is_deleted:
+        from cce.excursions import detector
+        detector.feed([(instance.storage_location_id, instance.date_time_logged, instance.temperature,
+                        instance.temperature_uom_id)])
@@ -1,3 +1,318 @@
+#import core python modules
+import datetime
+import shutil
+import tempfile
+
+#import core django modules
+from django.db import connection, transaction
 from django.test import TestCase
+from django.test.utils import override_settings, CaptureQueriesContext
+from django.utils import timezone
+
+#import external modules
+from rest_framework.test import APITestCase
+
+#import project modules
+from alerts.models import OnSiteNotification
+from cce.archive import archive_storage_location, get_temperature_arrays
+from cce.excursions import ExcursionDetector
+from cce.history import get_history_resolution, RAW
+from cce.ingest import TemperatureLogIngester
+from cce.models import (StorageLocationTempLog, StorageLocationTempRollup, TemperatureExcursion, summarise_readings,
+                        HOUR, DAY)
+from core.cache import get_model_version
+from core.models import UOMCategory, UnitOfMeasurement
+from core.testing import QueryBudgetMixin
+from inventory.tests import create_facility, create_storage_location
+
+
+MAX_GAP = datetime.timedelta(minutes=30)
+
+
+def at(hour, minute=0):
+    return timezone.make_aware(datetime.datetime(2014, 3, 1, hour, minute), timezone.get_current_timezone())
+
+
+class SummariseReadingsTest(TestCase):
+    """
+        each reading holds until the next one or for the longest gap, time outside the range is counted per hour
+    """
+    def test_minutes_outside(self):
+        times = [at(10), at(10, 20), at(10, 40)]
+        summary = summarise_readings(times, [5.0, 9.0, 1.0], at(10), at(11), 2.0, 8.0, MAX_GAP)
+        self.assertEqual(summary['count'], 3)
+        self.assertEqual((summary['minimum'], summary['maximum'], summary['total']), (1.0, 9.0, 15.0))
+        #20 minutes too warm, 20 minutes too cold, the last reading holds up to the end of the hour
+        self.assertEqual(summary['minutes_outside'], 40.0)
+
+    def test_reading_holds_for_the_longest_gap(self):
+        summary = summarise_readings([at(10)], [9.0], at(10), at(11), 2.0, 8.0, MAX_GAP)
+        self.assertEqual(summary['minutes_outside'], 30.0)
+
+    def test_time_outside_carried_into_an_hour_without_readings(self):
+        summary = summarise_readings([at(10, 50)], [9.0], at(11), at(12), 2.0, 8.0, MAX_GAP)
+        self.assertEqual(summary, {'count': 0, 'minimum': 9.0, 'maximum': 9.0, 'total': 0, 'minutes_outside': 20.0})
+
+    def test_hour_without_readings_or_time_outside(self):
+        self.assertIsNone(summarise_readings([at(10, 50)], [5.0], at(11), at(12), 2.0, 8.0, MAX_GAP))
+        self.assertIsNone(summarise_readings([], [], at(11), at(12), 2.0, 8.0, MAX_GAP))
+
+
+@override_settings(TEMPERATURE_ROLLUP_MAX_GAP_MINUTES=30)
+class RollupRefreshTest(TestCase):
+    """
+        hourly and daily rollups follow the readings as they are logged, changed and deleted
+    """
+    def setUp(self):
+        category = UOMCategory.objects.create(name='Temperature', description='Temperature')
+        self.celsius = UnitOfMeasurement.objects.create(name='Celsius', symbol='C', uom_category=category)
+        self.location = create_storage_location('CR-1', create_facility('SUP'))
+        self.location.minimum_temperature, self.location.maximum_temperature = 2.0, 8.0
+        self.location.save()
+
+    def log(self, logged, temperature, unit=None):
+        return StorageLocationTempLog.objects.create(storage_location=self.location, date_time_logged=logged,
+                                                     temperature=temperature, temperature_uom=unit or self.celsius)
+
+    def get_rollup(self, start, resolution=StorageLocationTempRollup.RESOLUTIONS.hour):
+        return StorageLocationTempRollup.objects.filter(storage_location=self.location, resolution=resolution,
+                                                        period_start=start).first()
+
+    def test_incremental_refresh(self):
+        self.log(at(10), 5.0)
+        self.log(at(10, 45), 9.0)
+        hour = self.get_rollup(at(10))
+        self.assertEqual((hour.count, hour.minimum, hour.maximum), (2, 5.0, 9.0))
+        self.assertEqual(hour.minutes_outside, 15.0)
+        #the warm reading holds 15 minutes into the next hour, which has no readings of its own
+        self.assertEqual(self.get_rollup(at(11)).minutes_outside, 15.0)
+        day = self.get_rollup(at(0), StorageLocationTempRollup.RESOLUTIONS.day)
+        self.assertEqual((day.count, day.minutes_outside), (2, 30.0))
+
+        warm = StorageLocationTempLog.objects.get(date_time_logged=at(10, 45))
+        warm.delete()
+        hour = self.get_rollup(at(10))
+        self.assertEqual((hour.count, hour.maximum, hour.minutes_outside), (1, 5.0, 0.0))
+        self.assertIsNone(self.get_rollup(at(11)))
+
+    def test_moved_reading_leaves_its_old_hours(self):
+        reading = self.log(at(3), 9.0)
+        reading.date_time_logged = at(10) + DAY
+        reading.save()
+        self.assertIsNone(self.get_rollup(at(3)))
+        self.assertIsNone(self.get_rollup(at(0), StorageLocationTempRollup.RESOLUTIONS.day))
+        self.assertEqual(self.get_rollup(at(10) + DAY).count, 1)
+        self.assertEqual(self.get_rollup(at(0) + DAY, StorageLocationTempRollup.RESOLUTIONS.day).count, 1)
+
+    def test_readings_summarised_in_the_storage_location_unit(self):
+        fahrenheit = UnitOfMeasurement.objects.create(name='Fahrenheit', symbol='F',
+                                                      uom_category=self.celsius.uom_category)
+        self.location.temperature_uom = self.celsius
+        self.location.save()
+        self.log(at(10), 5.0)
+        self.log(at(10, 30), 44.6, fahrenheit)
+        hour = self.get_rollup(at(10))
+        self.assertEqual(hour.count, 2)
+        self.assertAlmostEqual(hour.maximum, 7.0)
+        self.assertEqual(hour.minutes_outside, 0.0)
+
+
+@override_settings(TEMPERATURE_EXCURSION_MIN_MINUTES=60)
+class ExcursionDetectorTest(TestCase):
+    """
+        excursions are confirmed once they last long enough, spikes are ignored and the database has the last word
+    """
+    def setUp(self):
+        category = UOMCategory.objects.create(name='Temperature', description='Temperature')
+        self.celsius = UnitOfMeasurement.objects.create(name='Celsius', symbol='C', uom_category=category)
+        self.location = create_storage_location('CR-1', create_facility('SUP'))
+        self.location.minimum_temperature, self.location.maximum_temperature = 2.0, 8.0
+        self.location.save()
+        self.detector = ExcursionDetector()
+
+    def feed(self, readings, detector=None, unit=None):
+        #readings are written without post_save, the process wide detector is left out
+        unit = unit or self.celsius
+        StorageLocationTempLog.objects.bulk_create([
+            StorageLocationTempLog(storage_location=self.location, date_time_logged=logged, temperature=temperature,
+                                   temperature_uom=unit) for logged, temperature in readings])
+        return (detector or self.detector).feed([(self.location.pk, logged, temperature, unit.pk)
+                                                 for logged, temperature in readings])
+
+    def test_excursion_confirmed_after_min_duration(self):
+        self.assertEqual(self.feed([(at(10), 9.0), (at(10, 30), 10.5)]), [])
+        confirmed = self.feed([(at(11), 9.5)])
+        self.assertEqual(len(confirmed), 1)
+        excursion = TemperatureExcursion.objects.get(storage_location=self.location)
+        self.assertEqual((excursion.kind, excursion.started_at, excursion.peak_temperature, excursion.ended_at),
+                         (TemperatureExcursion.KINDS.high, at(10), 10.5, None))
+        self.assertEqual(OnSiteNotification.objects.filter(pk=excursion.notification_id).count(), 1)
+
+    def test_readings_compared_in_the_storage_location_unit(self):
+        fahrenheit = UnitOfMeasurement.objects.create(name='Fahrenheit', symbol='F',
+                                                      uom_category=self.celsius.uom_category)
+        self.location.temperature_uom = self.celsius
+        self.location.save()
+        #44.6 F is 7 C and within the range, 50 F is 10 C and above it
+        self.assertEqual(self.feed([(at(10), 44.6), (at(11, 30), 44.6)], unit=fahrenheit), [])
+        self.assertFalse(TemperatureExcursion.objects.filter(storage_location=self.location).exists())
+        self.feed([(at(12), 50.0)], unit=fahrenheit)
+        confirmed = self.feed([(at(13), 50.0)], unit=fahrenheit)
+        self.assertEqual(len(confirmed), 1)
+        self.assertAlmostEqual(confirmed[0].peak_temperature, 10.0)
+
+    def test_spikes_are_ignored(self):
+        self.feed([(at(10), 9.0), (at(10, 30), 5.0), (at(10, 45), 1.0), (at(11), 5.0), (at(11, 30), 9.0)])
+        self.assertFalse(TemperatureExcursion.objects.exists())
+        self.assertFalse(OnSiteNotification.objects.exists())
+
+    def test_excursion_ends_back_in_range(self):
+        self.feed([(at(10), 1.0), (at(11), 0.5)])
+        self.feed([(at(11, 15), 5.0)])
+        excursion = TemperatureExcursion.objects.get(storage_location=self.location)
+        self.assertEqual((excursion.kind, excursion.ended_at, excursion.peak_temperature),
+                         (TemperatureExcursion.KINDS.low, at(11, 15), 0.5))
+        #a new excursion starts from scratch
+        self.feed([(at(12), 9.0)])
+        self.assertEqual(TemperatureExcursion.objects.count(), 1)
+
+    def test_rolled_back_feed_is_forgotten(self):
+        try:
+            with transaction.atomic():
+                self.assertEqual(len(self.feed([(at(10), 9.0), (at(11), 9.0)])), 1)
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertFalse(TemperatureExcursion.objects.exists())
+        self.feed([(at(12), 9.0)])
+        self.assertFalse(TemperatureExcursion.objects.exists())
+        self.feed([(at(13), 9.0)])
+        self.assertEqual(TemperatureExcursion.objects.get(storage_location=self.location).started_at, at(12))
+
+    def test_excursion_saved_by_another_process_is_not_saved_twice(self):
+        self.feed([(at(10), 9.0), (at(11), 9.0)])
+        other = ExcursionDetector()
+        self.assertEqual(self.feed([(at(11, 30), 9.0), (at(12, 30), 11.0)], detector=other), [])
+        excursion = TemperatureExcursion.objects.get(storage_location=self.location)
+        self.feed([(at(13), 5.0)])
+        excursion = TemperatureExcursion.objects.get(pk=excursion.pk)
+        self.assertEqual(excursion.ended_at, at(13))
+
+
+class TemperatureArchiveTest(TestCase):
+    """
+        archived readings are converted to the temperature unit of their storage location
+    """
+    def setUp(self):
+        category = UOMCategory.objects.create(name='Temperature', description='Temperature')
+        self.celsius = UnitOfMeasurement.objects.create(name='Celsius', symbol='C', uom_category=category)
+        self.fahrenheit = UnitOfMeasurement.objects.create(name='Fahrenheit', symbol='F', uom_category=category)
+        self.location = create_storage_location('CR-1', create_facility('SUP'))
+        self.location.temperature_uom = self.celsius
+        self.location.save()
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_readings_archived_in_the_storage_location_unit(self):
+        StorageLocationTempLog.objects.bulk_create([
+            StorageLocationTempLog(storage_location=self.location, date_time_logged=logged, temperature=temperature,
+                                   temperature_uom=unit)
+            for logged, temperature, unit in [(at(10), 5.0, self.celsius), (at(11), 42.8, self.fahrenheit),
+                                              (at(10) + DAY, 44.6, self.fahrenheit)]])
+        version = get_model_version(StorageLocationTempLog)[0]
+        with self.settings(TEMPERATURE_ARCHIVE_ROOT=self.root):
+            self.assertEqual(archive_storage_location(self.location.pk, at(0) + DAY), 2)
+            times, temperatures = get_temperature_arrays(self.location.pk)
+        for temperature, expected in zip(temperatures, [5.0, 6.0, 7.0]):
+            self.assertAlmostEqual(temperature, expected)
+        self.assertEqual(self.location.temp_archive.temperature_uom, self.celsius)
+        self.assertEqual(StorageLocationTempLog.objects.filter(storage_location=self.location).count(), 1)
+        self.assertNotEqual(get_model_version(StorageLocationTempLog)[0], version)
+
+
+class TemperatureLogIngestTest(TestCase):
+    """
+        ingested readings are stored in the temperature unit of their storage location
+    """
+    def setUp(self):
+        category = UOMCategory.objects.create(name='Temperature', description='Temperature')
+        self.celsius = UnitOfMeasurement.objects.create(name='Celsius', symbol='C', uom_category=category)
+        self.fahrenheit = UnitOfMeasurement.objects.create(name='Fahrenheit', symbol='F', uom_category=category)
+        self.decicelsius = UnitOfMeasurement.objects.create(name='Decicelsius', symbol='dC', uom_category=category,
+                                                            factor=10)
+        self.location = create_storage_location('CR-1', create_facility('SUP'))
+        self.location.temperature_uom = self.celsius
+        self.location.save()
+
+    def test_readings_converted_to_the_storage_location_unit(self):
+        summary = TemperatureLogIngester(temperature_uom='F').ingest([
+            (1, {'storage_location': 'CR-1', 'temperature': 46.4, 'date_time_logged': at(10).isoformat()}, None),
+            (2, {'storage_location': 'CR-1', 'temperature': 5.0, 'temperature_uom': 'C',
+                 'date_time_logged': at(11).isoformat()}, None),
+            (3, {'storage_location': 'CR-1', 'temperature': 50, 'temperature_uom': 'dC',
+                 'date_time_logged': at(12).isoformat()}, None)])
+        self.assertEqual(summary['created'], 2)
+        self.assertEqual(summary['errors'], [
+            {'line': 3, 'error': 'Can not convert the temperature to the unit of the storage location.'}])
+        logs = StorageLocationTempLog.objects.filter(storage_location=self.location).order_by('date_time_logged')
+        self.assertEqual([log.temperature_uom_id for log in logs], [self.celsius.pk] * 2)
+        self.assertAlmostEqual(logs[0].temperature, 8.0)
+        self.assertAlmostEqual(logs[1].temperature, 5.0)
+
+
+class StorageLocationApiTest(QueryBudgetMixin, APITestCase):
+    """
+        listing storage locations and writing readings in bulk take the same number of queries however many rows
+    """
+    def setUp(self):
+        category = UOMCategory.objects.create(name='Temperature', description='Temperature')
+        self.celsius = UnitOfMeasurement.objects.create(name='Celsius', symbol='C', uom_category=category)
+        self.facility = create_facility('SUP')
+
+    def create_locations(self, start, count):
+        return [create_storage_location('CR-{index}'.format(index=index), self.facility)
+                for index in range(start, start + count)]
+
+    def get_readings(self, location, start, count):
+        return [{'storage_location': location.pk, 'temperature': 5.0, 'temperature_uom': self.celsius.pk,
+                 'date_time_logged': (at(0) + index * HOUR).isoformat()} for index in range(start, start + count)]
+
+    def test_list_query_count_does_not_grow(self):
+        url = '/api/v1/cce/storage-location/'
+        self.create_locations(0, 2)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.create_locations(2, 20)
+        with self.assertMaxQueries(len(queries)):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 22)
+
+    def test_bulk_readings_query_count_does_not_grow(self):
+        url = '/api/v1/cce/storage-location-temp-log/bulk/'
+        location = self.create_locations(0, 1)[0]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, self.get_readings(location, 0, 2), format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        with self.assertMaxQueries(len(queries)):
+            response = self.client.post(url, self.get_readings(location, 2, 50), format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(StorageLocationTempLog.objects.filter(storage_location=location).count(), 52)
+
 
-# Create your tests here.
+class HistoryResolutionTest(TestCase):
+    """
+        short ranges return every reading, longer ones hourly and then daily rollups
+    """
+    @override_settings(TEMPERATURE_HISTORY_RAW_DAYS=2, TEMPERATURE_HISTORY_MAX_POINTS=1000)
+    def test_resolution_follows_range(self):
+        since = at(0)
+        self.assertEqual(get_history_resolution(since, since + 2 * DAY), RAW)
+        self.assertEqual(get_history_resolution(since, since + 2 * DAY + HOUR),
+                         StorageLocationTempRollup.RESOLUTIONS.hour)
+        self.assertEqual(get_history_resolution(since, since + 1000 * HOUR),
+                         StorageLocationTempRollup.RESOLUTIONS.hour)
+        self.assertEqual(get_history_resolution(since, since + 1001 * HOUR),
+                         StorageLocationTempRollup.RESOLUTIONS.day)
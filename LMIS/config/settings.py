@@ -45,7 +45,8 @@ class Common(Configuration):
         'inventory',
         'locations',
         'orders',
-        'partners'
+        'partners',
+        'alerts',
     )
 
     INSTALLED_APPS = DJANGO_APPS + THIRD_PARTY_APPS + LOCAL_APPS
@@ -231,6 +232,68 @@ class Common(Configuration):
     }
     ########## END LOGGING CONFIGURATION
 
+    ########## API CONFIGURATION
+    # default number of rows returned per page by BaseModelViewSet list end-points when a client sends ?cursor=
+    API_CURSOR_PAGE_SIZE = values.IntegerValue(100)
+
+    # maximum number of rows a client can ask for per page via ?page_size=
+    API_CURSOR_MAX_PAGE_SIZE = values.IntegerValue(1000)
+
+    # maximum number of items accepted by a single bulk create or bulk update request
+    API_BULK_MAX_ITEMS = values.IntegerValue(1000)
+
+    # number of objects written by each UPDATE statement of a bulk update request
+    API_BULK_UPDATE_CHUNK_SIZE = values.IntegerValue(100)
+
+    # seconds the changes feed holds back recent rows on top of rows saved after the oldest transaction in flight
+    # started, it allows for clock differences between the application servers and the database
+    API_CHANGES_FEED_LAG = values.IntegerValue(5)
+
+    # number of rows fetched and serialized at a time by streaming exports
+    API_EXPORT_CHUNK_SIZE = values.IntegerValue(1000)
+
+    # seconds cached master data API responses and model versions are kept in the cache
+    API_RESPONSE_CACHE_TIMEOUT = values.IntegerValue(60 * 60 * 24)
+
+    # seconds the employee and facility of a user are cached for, saving an Employee invalidates them
+    IDENTITY_CACHE_TIMEOUT = values.IntegerValue(60)
+    ########## END API CONFIGURATION
+
+    ########## INVENTORY CONFIGURATION
+    # days ahead the expiry risk scanner looks for batches that will expire before they are used
+    EXPIRY_RISK_HORIZON_DAYS = values.IntegerValue(365)
+
+    # days of consumption records the expiry risk scanner projects consumption rates from
+    EXPIRY_RISK_CONSUMPTION_DAYS = values.IntegerValue(180)
+    ########## END INVENTORY CONFIGURATION
+
+    ########## CCE CONFIGURATION
+    # number of temperature readings written per INSERT by the bulk temperature log ingestion end-point
+    TEMPERATURE_LOG_INGEST_CHUNK_SIZE = values.IntegerValue(5000)
+
+    # maximum number of temperature readings accepted by a single bulk ingestion request
+    TEMPERATURE_LOG_INGEST_MAX_READINGS = values.IntegerValue(100000)
+
+    # minutes a temperature reading is taken to hold for when no reading follows it, used to work out the minutes
+    # temperature rollups spend outside the storage location temperature range
+    TEMPERATURE_ROLLUP_MAX_GAP_MINUTES = values.IntegerValue(30)
+
+    # minutes the temperature of a storage location has to stay out of its range before an excursion is notified
+    TEMPERATURE_EXCURSION_MIN_MINUTES = values.IntegerValue(60)
+
+    # longest range in days the temperature history end-point returns every reading for
+    TEMPERATURE_HISTORY_RAW_DAYS = values.IntegerValue(2)
+
+    # most hourly rollups the temperature history end-point returns before it switches to daily rollups
+    TEMPERATURE_HISTORY_MAX_POINTS = values.IntegerValue(1000)
+
+    # directory the columnar archive files of old temperature readings are kept in
+    TEMPERATURE_ARCHIVE_ROOT = join(BASE_DIR, 'archive', 'temperature')
+
+    # days temperature readings stay in the database before "manage.py archive_temperature_logs" archives them
+    TEMPERATURE_ARCHIVE_AFTER_DAYS = values.IntegerValue(365)
+    ########## END CCE CONFIGURATION
+
 
     ########## Below this line define 3rd party library settings
 
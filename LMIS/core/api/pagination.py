@@ -0,0 +1,233 @@
+"""
+    core/api/pagination.py holds the keyset (cursor) pagination used by BaseModelViewSet list end-points.
+
+    Pages are cut with a "WHERE (modified, uuid) > (last_modified, last_uuid)" filter instead of OFFSET, so fetching
+    page N costs the same as fetching page 1 no matter how large the table is. Cursors are opaque base64 tokens that
+    carry the position of the first or last row of the current page and the direction to paginate in.
+"""
+
+#import core python modules
+import base64
+from datetime import timedelta
+
+#import core django modules
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from django.http import QueryDict
+from django.utils.dateparse import parse_datetime
+from django.utils import timezone
+from django.utils.http import urlencode
+from django.utils.six.moves.urllib.parse import parse_qs, urlsplit, urlunsplit
+
+#import external modules
+from rest_framework.exceptions import ParseError
+from rest_framework.response import Response
+from rest_framework.templatetags.rest_framework import replace_query_param
+
+
+def remove_query_param(url, key):
+    """
+        returns the given url without the key query parameter
+    """
+    (scheme, netloc, path, query, fragment) = urlsplit(url)
+    query_dict = QueryDict(query).copy()
+    query_dict.pop(key, None)
+    return urlunsplit((scheme, netloc, path, query_dict.urlencode(), fragment))
+
+
+class InvalidCursor(ParseError):
+    """
+        raised when a client sends a cursor that can not be decoded, the API responds with 400 Bad Request.
+    """
+    default_detail = 'Invalid cursor.'
+
+
+class CursorPagination(object):
+    """
+        Keyset paginator for BaseModel querysets ordered by (modified, uuid).
+
+        page_size_query_param: lets clients ask for smaller or bigger pages, it is capped at max_page_size.
+    """
+    ordering = ('modified', 'uuid')
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def __init__(self, page_size=None, max_page_size=None):
+        self.page_size = page_size or getattr(settings, 'API_CURSOR_PAGE_SIZE', 100)
+        self.max_page_size = max_page_size or getattr(settings, 'API_CURSOR_MAX_PAGE_SIZE', 1000)
+        self.position = None
+        self.next_position = None
+        self.previous_position = None
+        self.has_next = False
+        self.has_previous = False
+
+    def get_page_size(self, request):
+        """
+            returns the page size asked for by the client, falls back to the default page size if the client did
+            not ask for one or sent a rubbish value.
+        """
+        try:
+            page_size = int(request.QUERY_PARAMS[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return min(self.page_size, self.max_page_size)
+        if page_size < 1:
+            return min(self.page_size, self.max_page_size)
+        return min(page_size, self.max_page_size)
+
+    @classmethod
+    def is_requested(cls, request):
+        """
+            returns True if the client asked for a page, clients that do not know about pagination get the whole
+            collection.
+        """
+        return cls.cursor_query_param in request.QUERY_PARAMS or cls.page_size_query_param in request.QUERY_PARAMS
+
+    @classmethod
+    def encode_cursor(cls, position, reverse=False):
+        """
+            encodes (modified, uuid) position and pagination direction into an opaque url safe token
+        """
+        modified, uuid = position
+        params = {'p': '{modified}|{uuid}'.format(modified=modified.isoformat(), uuid=uuid)}
+        if reverse:
+            params['r'] = '1'
+        return base64.urlsafe_b64encode(urlencode(params).encode('ascii')).decode('ascii')
+
+    @classmethod
+    def decode_cursor(cls, token):
+        """
+            decodes cursor token and returns tuple of ((modified, uuid), reverse)
+        """
+        try:
+            params = parse_qs(base64.urlsafe_b64decode(token.encode('ascii')).decode('ascii'), strict_parsing=True)
+            modified, uuid = params['p'][0].split('|', 1)
+            modified = parse_datetime(modified)
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise InvalidCursor()
+        if modified is None or not uuid:
+            raise InvalidCursor()
+        return (modified, uuid), params.get('r', ['0'])[0] == '1'
+
+    @classmethod
+    def filter_after(cls, queryset, position, reverse=False):
+        """
+            returns rows that come after (or before if reverse is True) the given (modified, uuid) position.
+        """
+        modified, uuid = position
+        if reverse:
+            return queryset.filter(Q(modified__lt=modified) | Q(modified=modified, uuid__lt=uuid))
+        return queryset.filter(Q(modified__gt=modified) | Q(modified=modified, uuid__gt=uuid))
+
+    @classmethod
+    def get_position(cls, obj):
+        return obj.modified, obj.uuid
+
+    def paginate_queryset(self, queryset, request):
+        """
+            returns list of objects on the page the request cursor points to. raises InvalidCursor if the cursor
+            sent by the client can not be decoded.
+        """
+        self.request = request
+        page_size = self.get_page_size(request)
+        token = request.QUERY_PARAMS.get(self.cursor_query_param)
+        position, reverse = self.decode_cursor(token) if token else (None, False)
+        self.position = position
+
+        if reverse:
+            queryset = queryset.order_by(*['-{field}'.format(field=field) for field in self.ordering])
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if position is not None:
+            queryset = self.filter_after(queryset, position, reverse)
+
+        #fetch one extra row to know if there is another page without doing a COUNT(*)
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+            self.has_previous, self.has_next = has_more, True
+        else:
+            self.has_previous, self.has_next = position is not None, has_more
+
+        if results:
+            self.previous_position = self.get_position(results[0])
+            self.next_position = self.get_position(results[-1])
+        return results
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.next_position is None:
+            #paginated backwards past the first row, the next page is the first page.
+            return remove_query_param(url, self.cursor_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_previous_link(self):
+        if not self.has_previous or self.previous_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param,
+                                   self.encode_cursor(self.previous_position, reverse=True))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+
+class ChangesFeedPagination(CursorPagination):
+    """
+        Forward only keyset pagination for the incremental sync feed. the cursor is a watermark the client stores and
+        sends back as ?since= on its next sync.
+
+        rows saved by transactions that are still in flight when the feed is read must not be skipped by the returned
+        watermark, so rows modified after the oldest transaction in flight started are held back until it ends,
+        however long it runs. rows modified in the last API_CHANGES_FEED_LAG seconds are held back too, it covers
+        clock differences between the application servers and the database.
+    """
+    cursor_query_param = 'since'
+
+    def get_oldest_transaction_start(self, using):
+        """
+            returns start time of the oldest transaction in flight on the database other than the one of this
+            request, None if there is none or the backend can not tell. the modified time of every row a transaction
+            saves is later than the start of the transaction.
+        """
+        connection = connections[using]
+        if connection.vendor != 'postgresql':
+            return None
+        cursor = connection.cursor()
+        cursor.execute("SELECT min(xact_start) FROM pg_stat_activity WHERE datname = current_database() AND "
+                       "pid <> pg_backend_pid() AND state <> 'idle' AND xact_start IS NOT NULL")
+        return cursor.fetchone()[0]
+
+    def paginate_queryset(self, queryset, request):
+        lag = timedelta(seconds=getattr(settings, 'API_CHANGES_FEED_LAG', 5))
+        horizon = timezone.now() - lag
+        oldest = self.get_oldest_transaction_start(queryset.db)
+        if oldest is not None:
+            horizon = min(horizon, oldest - lag)
+        queryset = queryset.filter(modified__lte=horizon)
+        return super(ChangesFeedPagination, self).paginate_queryset(queryset, request)
+
+    def get_watermark(self):
+        """
+            returns watermark of the last row on this page or the watermark the client sent if there are no changes.
+        """
+        position = self.next_position or self.position
+        if position is None:
+            return None
+        return self.encode_cursor(position)
+
+    def get_paginated_response(self, data, deleted=()):
+        return Response({
+            'watermark': self.get_watermark(),
+            'has_more': self.has_next,
+            'results': data,
+            'deleted': list(deleted),
+        })
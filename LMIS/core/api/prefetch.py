@@ -0,0 +1,94 @@
+"""
+    core/api/prefetch.py works out the select_related() and prefetch_related() lookups a serializer needs so that
+    serializing a list of objects does not issue extra queries for every nested or to-many relation on every row, and
+    the columns it reads so that columns nobody asked for are not loaded with only().
+"""
+
+#import core django modules
+from django.db.models import OneToOneField
+from django.db.models.fields import FieldDoesNotExist
+
+#import external modules
+from rest_framework.relations import RelatedField, PrimaryKeyRelatedField
+from rest_framework.serializers import BaseSerializer
+
+
+def is_to_many(model, source):
+    """
+        returns True if source is a to-many relation on the given model, False if it is a to-one relation and None
+        if source is not a relation at all.
+    """
+    try:
+        model_field, _, direct, m2m = model._meta.get_field_by_name(source)
+    except FieldDoesNotExist:
+        return None
+    if m2m:
+        return True
+    if direct:
+        return False if getattr(model_field, 'rel', None) is not None else None
+    #reverse relation, model_field is a RelatedObject
+    return not isinstance(model_field.field, OneToOneField)
+
+
+def needs_related_object(field):
+    """
+        returns True if serializing the field touches the related object(s) and not just the foreign key column.
+    """
+    if isinstance(field, BaseSerializer):
+        return True
+    if isinstance(field, RelatedField):
+        return field.many or not isinstance(field, PrimaryKeyRelatedField)
+    return False
+
+
+def get_related_lookups(serializer, prefix='', prefetch=False):
+    """
+        walks the serializer fields tree and returns tuple of (select_related, prefetch_related) lookups.
+
+        to-one relations are joined with select_related(), to-many relations and everything nested below a to-many
+        relation are fetched with prefetch_related().
+    """
+    select_related, prefetch_related = [], []
+    opts = getattr(serializer, 'opts', None)
+    model = getattr(opts, 'model', None)
+    if model is None:
+        return select_related, prefetch_related
+
+    for field_name, field in serializer.fields.items():
+        if not needs_related_object(field):
+            continue
+        source = field.source or field_name
+        if source == '*' or '.' in source:
+            continue
+        to_many = is_to_many(model, source)
+        if to_many is None:
+            continue
+        lookup = prefix + source
+        nested_prefetch = prefetch or to_many
+        if nested_prefetch:
+            prefetch_related.append(lookup)
+        else:
+            select_related.append(lookup)
+
+        if isinstance(field, BaseSerializer):
+            nested_select, nested_prefetch_related = get_related_lookups(field, lookup + '__', nested_prefetch)
+            select_related.extend(nested_select)
+            prefetch_related.extend(nested_prefetch_related)
+    return select_related, prefetch_related
+
+
+def get_load_only_fields(serializer):
+    """
+        returns set of names of model fields the serializer reads or None if it reads anything that is not a model
+        field or relation, e.g a property or a method, which may need any of the model fields.
+    """
+    model = serializer.opts.model
+    concrete_fields = set(field.name for field in model._meta.fields)
+    names = set()
+    for field_name, field in serializer.fields.items():
+        source = field.source or field_name
+        if source in concrete_fields:
+            names.add(source)
+        elif not is_to_many(model, source):
+            return None
+    return names
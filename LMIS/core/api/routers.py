@@ -0,0 +1,55 @@
+"""
+    core/api/routers.py holds the REST API router used by the LMIS apps, it adds collection level routes such as
+    bulk writes, the changes feed and exports to the routes generated by rest_framework DefaultRouter.
+"""
+
+#import external modules
+from rest_framework.routers import DefaultRouter, Route
+
+
+class BaseModelRouter(DefaultRouter):
+    """
+        DefaultRouter that also routes collection level end-points implemented by BaseModelViewSet. routes whose
+        methods are not implemented by a ViewSet are skipped for that ViewSet.
+
+        collection routes must come before the detail route, else e.g "bulk" is taken as an object uuid.
+    """
+    list_route, detail_routes = DefaultRouter.routes[0], DefaultRouter.routes[1:]
+    collection_routes = [
+        Route(
+            url=r'^{prefix}/bulk{trailing_slash}$',
+            mapping={
+                'post': 'bulk_create',
+                'put': 'bulk_update',
+                'patch': 'bulk_partial_update',
+                'delete': 'bulk_destroy',
+            },
+            name='{basename}-bulk',
+            initkwargs={'suffix': 'List'}
+        ),
+        Route(
+            url=r'^{prefix}/recover{trailing_slash}$',
+            mapping={
+                'post': 'bulk_recover',
+            },
+            name='{basename}-bulk-recover',
+            initkwargs={'suffix': 'List'}
+        ),
+        Route(
+            url=r'^{prefix}/changes{trailing_slash}$',
+            mapping={
+                'get': 'changes',
+            },
+            name='{basename}-changes',
+            initkwargs={'suffix': 'List'}
+        ),
+        Route(
+            url=r'^{prefix}/export{trailing_slash}$',
+            mapping={
+                'get': 'export',
+            },
+            name='{basename}-export',
+            initkwargs={'suffix': 'List'}
+        ),
+    ]
+    routes = [list_route] + collection_routes + detail_routes
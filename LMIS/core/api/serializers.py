@@ -4,11 +4,16 @@
 
 #import core django module
 from django.contrib.auth.models import User, Permission
+from django.core.exceptions import ValidationError
+from django.utils import six
+from django.utils.encoding import smart_text
 
 #import external modules
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 
 #import project modules
+from core.api.prefetch import is_to_many
 from core.models import (Product, ProductCategory, UnitOfMeasurement, UOMCategory, CompanyCategory, Company,
                          Currency, Rate, Contact, Address, EmployeeCategory, Employee, ProductPresentation,
                          ModeOfAdministration, ProductItem, ProductFormulation)
@@ -16,19 +21,192 @@ from core.models import (Product, ProductCategory, UnitOfMeasurement, UOMCategor
 
 class UserSerializer(serializers.ModelSerializer):
     """
-        REST API serializer for User model
+        REST API serializer for User model, the password hash, groups and permissions are never returned.
     """
     class Meta:
         model = User
+        fields = ('id', 'username', 'first_name', 'last_name', 'email', 'is_active', 'is_staff', 'last_login',
+                  'date_joined')
+
+
+class PreloadedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+        PrimaryKeyRelatedField that looks up related objects in serializer context "preloaded_related" before querying
+        the database. bulk writes load every related object referenced by a batch with one query per related model
+        instead of one query per field per item.
+
+        context["preloaded_related"] is a dict of {model: {pk: object}}
+    """
+    def from_native(self, data):
+        preloaded = self.context.get('preloaded_related', {}).get(self.queryset.model)
+        if preloaded:
+            obj = preloaded.get(smart_text(data))
+            if obj is not None:
+                return obj
+        return super(PreloadedPrimaryKeyRelatedField, self).from_native(data)
+
+
+class LivePrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+        to-many PrimaryKeyRelatedField that leaves out soft deleted objects. related managers return them because
+        the default manager of BaseModel does, see core.models.BaseModel. objects are filtered after all() so
+        prefetched relations are not queried again.
+    """
+    def field_to_native(self, obj, field_name):
+        if not self.many:
+            return super(LivePrimaryKeyRelatedField, self).field_to_native(obj, field_name)
+        related = obj
+        for component in (self.source or field_name).split('.'):
+            if related is None:
+                return []
+            related = getattr(related, component)
+        items = related.all() if callable(getattr(related, 'all', None)) else related
+        return [self.to_native(item.pk) for item in items if not getattr(item, 'is_deleted', False)]
+
+
+def parse_expand(value):
+    """
+        parses ?expand= value e.g "products.created_by,modified_by" into {'products': {'created_by': {}},
+        'modified_by': {}}
+    """
+    expand = {}
+    for path in value.split(','):
+        node = expand
+        for name in path.strip().split('.'):
+            if name:
+                node = node.setdefault(name, {})
+    return expand
 
 
 class BaseModelSerializer(serializers.ModelSerializer):
     """
         Base Model Serializer for models
+
+        supports sparse fieldsets and opt-in expansion of nested relations via query parameters:
+            ?fields=uuid,name : only returns the listed fields, it is ignored on writes.
+            ?expand=products.created_by,modified_by : nested relations are returned as primary keys unless they are
+            listed in expand, dotted names expand relations of expanded relations.
     """
     created_by = UserSerializer(required=False, read_only=True)
     modified_by = UserSerializer(required=False, read_only=True)
 
+    def get_request_query_param(self, name):
+        request = self.context.get('request')
+        if request is None:
+            return None
+        return request.QUERY_PARAMS.get(name)
+
+    def get_requested_fields(self):
+        """
+            returns set of field names asked for via ?fields= or None if every field should be returned.
+        """
+        request = self.context.get('request')
+        fields = self.get_request_query_param('fields')
+        if not fields or request.method not in SAFE_METHODS:
+            return None
+        return set(name.strip() for name in fields.split(','))
+
+    def get_expand(self):
+        """
+            returns dict tree of nested relations to expand, nested serializers get theirs from the context.
+        """
+        if 'expand' in self.context:
+            return self.context['expand']
+        return parse_expand(self.get_request_query_param('expand') or '')
+
+    def get_fields(self):
+        """
+            over-rides ModelSerializer.get_fields() to drop fields that are not asked for and to replace nested
+            serializers that are not expanded with read only primary key fields.
+        """
+        fields = super(BaseModelSerializer, self).get_fields()
+        requested = self.get_requested_fields()
+        if requested is not None:
+            for field_name in list(fields.keys()):
+                if field_name not in requested:
+                    del fields[field_name]
+
+        expand = self.get_expand()
+        for field_name, field in list(fields.items()):
+            if not isinstance(field, serializers.BaseSerializer):
+                continue
+            source = field.source or field_name
+            if field_name not in expand:
+                fields[field_name] = LivePrimaryKeyRelatedField(
+                    source=field.source, read_only=True, many=bool(is_to_many(self.opts.model, source)))
+            elif expand[field_name] and isinstance(field, BaseModelSerializer):
+                fields[field_name] = field.__class__(source=field.source, read_only=True, many=field.many,
+                                                     context={'expand': expand[field_name]})
+        return fields
+
+    def get_related_field(self, model_field, related_model, to_many):
+        """
+            over-rides ModelSerializer.get_related_field() so that flat to-one relations are
+            PreloadedPrimaryKeyRelatedField and can be resolved from preloaded related objects, and flat to-many
+            relations leave out soft deleted objects.
+        """
+        kwargs = {'queryset': related_model._default_manager}
+        if model_field:
+            kwargs['required'] = not (model_field.null or model_field.blank)
+        if to_many:
+            return LivePrimaryKeyRelatedField(many=True, **kwargs)
+        return PreloadedPrimaryKeyRelatedField(**kwargs)
+
+    def get_resolved_relations(self):
+        """
+            returns names of the model fields written by PreloadedPrimaryKeyRelatedField, the field has looked up the
+            related object already so ForeignKey.validate() does not have to look it up again.
+        """
+        return [field.source or field_name for field_name, field in self.fields.items()
+                if isinstance(field, PreloadedPrimaryKeyRelatedField) and not field.read_only]
+
+    def full_clean(self, instance):
+        """
+            over-rides ModelSerializer.full_clean() so that related objects are not looked up twice. unique checks
+            are left out when the serializer context has validate_unique set to False, bulk writes check the unique
+            fields of the whole batch at once, see BaseModelViewSet.get_unique_errors().
+        """
+        exclude = self.get_validation_exclusions()
+        try:
+            instance.full_clean(exclude=exclude + self.get_resolved_relations(), validate_unique=False)
+            if self.context.get('validate_unique', True):
+                instance.validate_unique(exclude=exclude)
+        except ValidationError as err:
+            self._errors = err.message_dict
+            return None
+        return instance
+
+    def get_identity(self, data):
+        """
+            BaseModel objects are identified by uuid and not id.
+        """
+        try:
+            return data.get('uuid', None)
+        except AttributeError:
+            return None
+
+    @classmethod
+    def get_preloaded_related(cls, fields, items):
+        """
+            returns {model: {pk: object}} of every object referenced by flat to-one relation fields in the given list
+            of items, it costs one query per related model.
+        """
+        keys = {}
+        for field_name, field in fields.items():
+            if not isinstance(field, PreloadedPrimaryKeyRelatedField) or field.read_only:
+                continue
+            model_keys = keys.setdefault(field.queryset.model, (field.queryset, set()))[1]
+            for item in items:
+                value = item.get(field_name) if isinstance(item, dict) else None
+                if isinstance(value, (six.string_types, six.integer_types)) and value != '':
+                    model_keys.add(value)
+
+        preloaded = {}
+        for model, (queryset, model_keys) in keys.items():
+            if model_keys:
+                preloaded[model] = dict((smart_text(obj.pk), obj) for obj in queryset.filter(pk__in=model_keys))
+        return preloaded
+
 
 class ProductCategorySerializer(BaseModelSerializer):
     """
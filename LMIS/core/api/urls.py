@@ -4,13 +4,13 @@
 #import core Django modules
 from django.conf.urls import patterns, url, include
 
-#import external modules
-from rest_framework import routers
+#import LMIS project modules
+from core.api.routers import BaseModelRouter
 
 #create core REST API routers
 from . import views
 
-router = routers.DefaultRouter()
+router = BaseModelRouter()
 router.register(r'^product', views.ProductViewSet)
 router.register(r'^product-category', views.ProductCategoryViewSet)
 router.register(r'uom', views.UnitOfMeasurementViewSet)
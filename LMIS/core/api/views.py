@@ -5,17 +5,37 @@
     be added too.
 """
 
+#import core python modules
+import csv
+import hashlib
+import json
+from calendar import timegm
+
 #import from django core modules
+from django.conf import settings
 from django.contrib.auth.models import User, Permission
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import IntegerField, PositiveIntegerField, PositiveSmallIntegerField, SmallIntegerField
+from django.db.models.signals import pre_save, post_save
+from django.http import StreamingHttpResponse
+from django.utils import six, timezone
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
 
 #import external modules
+import reversion
+from mptt.models import MPTTModel
 from rest_framework import viewsets, status, views
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
 from rest_framework import filters
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, SAFE_METHODS
 
 #import project modules
+from core.cache import get_model_version, bump_model_version, get_cache_timeout
+from core.identity import get_identity
+from core.signals import post_update_is_deleted
 from core.models import (Product, ProductCategory, UnitOfMeasurement, UOMCategory, CompanyCategory, Company, Rate,
                          Contact, Address, EmployeeCategory, Employee, ProductPresentation, ModeOfAdministration,
                          ProductItem, Currency, ProductFormulation)
@@ -26,21 +46,125 @@ from .serializers import (ProductSerializer, ProductCategorySerializer, UnitOfMe
                           EmployeeSerializer, UserSerializer, PermissionSerializer, ProductPresentationSerializer,
                           ModeOfAdministrationSerializer, ProductItemSerializer, ProductFormulationSerializer)
 
+from .pagination import CursorPagination, ChangesFeedPagination
+from .prefetch import get_related_lookups, get_load_only_fields
+
 from facilities.api.serializers import FacilitySerializer
 from facilities.models import Facility
 
 
+class ExportBuffer(object):
+    """
+        file like object for csv.writer that hands back each written row instead of keeping it.
+    """
+    def write(self, value):
+        return value
+
+
 class BaseModelViewSet(viewsets.ModelViewSet):
     """
         Base API end-point for other model view sets end-point.
 
         permission_class:
             IsAuthenticated : ensures that only authenticated users can access the API
+
+        pagination_class:
+            CursorPagination : list() returns keyset paginated pages ordered by (modified, uuid) when the client asks
+            for them with ?page_size= or ?cursor=, else the whole collection as before. set it to None on a sub-class
+            to always return the whole collection.
     """
     filter_backends = (filters.DjangoFilterBackend,)
     filter_fields = ('is_deleted',)
     #TODO: activate permission on APIView; permission_classes = (IsAuthenticated,)
     lookup_field = 'uuid'
+    pagination_class = CursorPagination
+    include_deleted_actions = ('recover', 'changes')
+
+    def get_query_plan(self):
+        """
+            returns tuple of (select_related, prefetch_related, only) for the serializer of this request, only is None
+            if every column has to be loaded.
+
+            the plan is worked out by walking the serializer fields tree, it is cached per serializer class for
+            requests without ?fields= and ?expand=.
+        """
+        serializer_class = self.get_serializer_class()
+        params = self.request.QUERY_PARAMS if self.request else {}
+        cacheable = 'fields' not in params and 'expand' not in params
+        query_plans = self.get_query_plans()
+        if cacheable and serializer_class in query_plans:
+            return query_plans[serializer_class]
+
+        serializer = self.get_serializer()
+        select_related, prefetch_related = get_related_lookups(serializer)
+        only = get_load_only_fields(serializer)
+        if only is not None:
+            #needed by pagination and the changes feed
+            only = only | set(['uuid', 'modified', 'is_deleted'])
+        plan = select_related, prefetch_related, only
+        if cacheable:
+            query_plans[serializer_class] = plan
+        return plan
+
+    @classmethod
+    def get_query_plans(cls):
+        """
+            returns the query plan cache of this view set class, each sub-class gets its own dict instead of sharing
+            the dict of the class it inherits from.
+        """
+        if '_query_plans' not in cls.__dict__:
+            cls._query_plans = {}
+        return cls._query_plans
+
+    def include_deleted(self):
+        """
+            returns True if the request needs soft deleted objects: to recover them, to return tombstones on the
+            changes feed or to filter on ?is_deleted=
+        """
+        return getattr(self, 'action', None) in self.include_deleted_actions or \
+            'is_deleted' in self.request.QUERY_PARAMS
+
+    def get_queryset(self):
+        """
+            This is over-ridden to join or prefetch every relation the serializer renders, so that listing N objects
+            costs a fixed number of queries instead of several queries per object. on reads, only the columns the
+            serializer returns are loaded.
+
+            ViewSet querysets come from BaseModel.objects which leaves out soft deleted objects, all_objects is used
+            when the request needs them.
+        """
+        if self.include_deleted():
+            queryset = self.get_view_model_class().all_objects.all()
+        else:
+            queryset = super(BaseModelViewSet, self).get_queryset()
+        select_related, prefetch_related, only = self.get_query_plan()
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        if only is not None and self.request and self.request.method in SAFE_METHODS:
+            queryset = queryset.only(*only)
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        """
+            This over-rides ModelViewSet.list() so that clients can fetch large collections a page at a time using
+            opaque next and previous cursors instead of the whole table. requests without ?page_size= or ?cursor=
+            get the whole collection as a plain list, like they always did.
+        """
+        if self.pagination_class is None or not self.pagination_class.is_requested(request):
+            return super(BaseModelViewSet, self).list(request, *args, **kwargs)
+        self.object_list = self.filter_queryset(self.get_queryset())
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(self.object_list, request)
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    def get_request_user(self):
+        """
+            returns the authenticated user making the request or None, see core.identity
+        """
+        return get_identity(self.request).user
 
     def pre_save(self, obj):
         """
@@ -48,11 +172,298 @@ class BaseModelViewSet(viewsets.ModelViewSet):
 
             i did this here cause the model doesn't have access to request object
         """
-        if Employee.get_user_or_none(self.request.user.id):
+        if self.get_request_user():
             if obj.uuid is None:
                 obj.created_by = self.request.user
             obj.modified_by = self.request.user
 
+    def changes(self, request, *args, **kwargs):
+        """
+            Incremental sync feed. returns objects created, changed or soft deleted after the ?since= watermark,
+            oldest change first, served from the (modified, uuid) index. soft deleted objects are returned as uuids
+            in "deleted". clients store the returned watermark and call again with it until has_more is false.
+        """
+        paginator = ChangesFeedPagination()
+        page = paginator.paginate_queryset(self.filter_queryset(self.get_queryset()), request)
+        serializer = self.get_serializer([obj for obj in page if not obj.is_deleted], many=True)
+        return paginator.get_paginated_response(serializer.data, [obj.uuid for obj in page if obj.is_deleted])
+
+    export_formats = {
+        'csv': 'text/csv',
+        'ndjson': 'application/x-ndjson',
+    }
+
+    def export(self, request, *args, **kwargs):
+        """
+            streams the whole filtered collection as CSV or newline delimited JSON, ?export_format=csv|ndjson
+            (default ndjson). rows are fetched and serialized API_EXPORT_CHUNK_SIZE at a time, so memory use stays
+            flat however many rows are exported and the first bytes are sent before the first chunk is fetched.
+        """
+        export_format = request.QUERY_PARAMS.get('export_format', 'ndjson')
+        if export_format not in self.export_formats:
+            return Response(data={'detail': 'Unsupported export format, use one of: {formats}.'.format(
+                formats=', '.join(sorted(self.export_formats)))}, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        if export_format == 'csv':
+            content = self.iter_csv(queryset)
+        else:
+            content = self.iter_ndjson(queryset)
+        response = StreamingHttpResponse(content, content_type=self.export_formats[export_format])
+        response['Content-Disposition'] = 'attachment; filename="{name}.{ext}"'.format(
+            name=self.get_view_model_class()._meta.model_name, ext=export_format)
+        return response
+
+    def iter_export_chunks(self, queryset):
+        """
+            yields serialized rows of queryset a chunk at a time, chunks are cut on (modified, uuid) like cursor pages
+            so every chunk is an index range scan and prefetch_related() still works per chunk.
+        """
+        chunk_size = getattr(settings, 'API_EXPORT_CHUNK_SIZE', 1000)
+        queryset = queryset.order_by(*CursorPagination.ordering)
+        position = None
+        while True:
+            chunk_queryset = queryset if position is None else CursorPagination.filter_after(queryset, position)
+            chunk = list(chunk_queryset[:chunk_size])
+            if not chunk:
+                return
+            yield self.get_serializer(chunk, many=True).data
+            if len(chunk) < chunk_size:
+                return
+            position = CursorPagination.get_position(chunk[-1])
+
+    def iter_ndjson(self, queryset):
+        for chunk in self.iter_export_chunks(queryset):
+            yield ''.join(json.dumps(row, cls=JSONEncoder) + '\n' for row in chunk)
+
+    def iter_csv(self, queryset):
+        field_names = list(self.get_serializer().fields.keys())
+        buffer = ExportBuffer()
+        writer = csv.writer(buffer)
+        yield writer.writerow(field_names)
+        for chunk in self.iter_export_chunks(queryset):
+            yield ''.join(writer.writerow([self.get_csv_value(row.get(name)) for name in field_names])
+                          for row in chunk)
+
+    def get_csv_value(self, value):
+        """
+            nested objects and lists of related keys are written to CSV cells as JSON
+        """
+        if isinstance(value, (dict, list, tuple)):
+            return json.dumps(value, cls=JSONEncoder)
+        return value
+
+    def bulk_create(self, request, *args, **kwargs):
+        """
+            creates every object in the posted JSON array with bulk_create() in one transaction. it is all or nothing,
+            if any item is invalid nothing is saved and errors are returned in the same order as the items.
+        """
+        return self.bulk_save(request, update=False)
+
+    def bulk_update(self, request, *args, **kwargs):
+        """
+            updates every object in the JSON array, each item is matched to an existing object by its uuid.
+        """
+        return self.bulk_save(request, update=True)
+
+    def bulk_partial_update(self, request, *args, **kwargs):
+        """
+            same as bulk_update() but items only need to contain the fields that changed.
+        """
+        return self.bulk_save(request, update=True, partial=True)
+
+    def get_bulk_serializers(self, items, update=False, partial=False):
+        """
+            validates items in one pass and returns tuple of (serializers, errors), errors is empty if every item is
+            valid.
+
+            related objects referenced by the items are loaded with one query per related model, objects to be
+            updated are loaded with one query and unique fields are checked with one query per unique constraint,
+            see get_unique_errors().
+        """
+        instances = {}
+        if update:
+            uuids = [item.get('uuid') for item in items if isinstance(item, dict)]
+            uuids = [uuid for uuid in uuids if isinstance(uuid, six.string_types)]
+            instances = self.get_view_model_class().objects.in_bulk(uuids)
+
+        serializer_class = self.get_serializer_class()
+        context = self.get_serializer_context()
+        context['preloaded_related'] = serializer_class.get_preloaded_related(serializer_class(context=context).fields,
+                                                                              items)
+        context['validate_unique'] = False
+        serializers, errors, seen = [], [], set()
+        for item in items:
+            if not isinstance(item, dict):
+                errors.append({'non_field_errors': ['Expected an object.']})
+                continue
+            instance = None
+            if update:
+                instance = instances.get(item.get('uuid'))
+                if instance is None:
+                    errors.append({'uuid': ['Not found.']})
+                    continue
+                if instance.pk in seen:
+                    errors.append({'uuid': ['Duplicate item, this object is updated by an earlier item.']})
+                    continue
+                seen.add(instance.pk)
+            serializer = serializer_class(instance, data=item, partial=partial, context=context)
+            if serializer.is_valid():
+                serializers.append(serializer)
+                errors.append({})
+            else:
+                errors.append(serializer.errors)
+        if any(errors):
+            return serializers, errors
+        errors = self.get_unique_errors([serializer.object for serializer in serializers])
+        return serializers, errors if any(errors) else []
+
+    def get_unique_errors(self, objs):
+        """
+            returns list of errors dicts in the same order as objs, objects that have the same value of a unique field
+            (or unique_together fields) as another object in the list or as a saved object that is not in the list
+            get an error. it costs one query per unique constraint however many objects there are.
+        """
+        errors = [{} for obj in objs]
+        if not objs:
+            return errors
+        pks = set(obj.pk for obj in objs if obj.pk is not None)
+        unique_checks, _ = objs[0]._get_unique_checks()
+        for model_class, names in unique_checks:
+            fields = [model_class._meta.get_field(name) for name in names]
+            if len(fields) == 1 and fields[0].primary_key:
+                continue
+            positions = {}
+            for position, obj in enumerate(objs):
+                key = tuple(getattr(obj, field.attname) for field in fields)
+                #like Model.validate_unique(), empty values are not checked
+                if all(value is not None for value in key):
+                    positions.setdefault(key, []).append(position)
+            if not positions:
+                continue
+            #uniqueness is enforced by the database on every row, soft deleted rows included
+            saved = model_class._base_manager.filter(**{'{name}__in'.format(name=names[0]):
+                                                        set(key[0] for key in positions)})
+            if pks:
+                saved = saved.exclude(pk__in=pks)
+            saved = set(saved.values_list(*names))
+            for key, key_positions in positions.items():
+                if len(key_positions) == 1 and key not in saved:
+                    continue
+                message = objs[key_positions[0]].unique_error_message(model_class, names)
+                name = names[0] if len(names) == 1 else 'non_field_errors'
+                for position in key_positions:
+                    errors[position].setdefault(name, []).append(message)
+        return errors
+
+    def bulk_save(self, request, update=False, partial=False):
+        """
+            validates and saves list of objects posted in request in a single transaction.
+        """
+        items = request.DATA
+        max_items = getattr(settings, 'API_BULK_MAX_ITEMS', 1000)
+        if not isinstance(items, list):
+            return Response(data={'detail': 'Expected a list of items.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > max_items:
+            return Response(data={'detail': 'Expected at most {max_items} items.'.format(max_items=max_items)},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        serializers, errors = self.get_bulk_serializers(items, update=update, partial=partial)
+        if errors:
+            return Response(data={'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        objs = [serializer.object for serializer in serializers]
+        error = self.check_objects(request, objs)
+        if error is not None:
+            return error
+        for obj in objs:
+            self.pre_save(obj)
+
+        model = self.get_view_model_class()
+        with transaction.atomic():
+            if issubclass(model, MPTTModel):
+                #MPTT models need save() to work out their tree fields
+                for serializer in serializers:
+                    serializer.save()
+            else:
+                if update:
+                    self.update_objects(model, objs)
+                else:
+                    model.objects.bulk_create(objs)
+                for serializer in serializers:
+                    self.save_bulk_related_data(serializer.object)
+        #bulk_create() does not send post_save signals
+        bump_model_version(model)
+
+        return Response(data={'success': True, 'uuids': [obj.uuid for obj in objs]},
+                        status=status.HTTP_200_OK if update else status.HTTP_201_CREATED)
+
+    def check_objects(self, request, objs):
+        """
+            returns an error Response if the validated objects of a bulk write can not be saved together or None if
+            they can.
+        """
+        return None
+
+    def update_objects(self, model, objs):
+        """
+            saves every field of objs with one UPDATE ... SET column = CASE uuid WHEN ... END per chunk of
+            API_BULK_UPDATE_CHUNK_SIZE objects instead of one UPDATE per object. pre_save and post_save are sent for
+            each object like save() does.
+        """
+        fields = [field for field in model._meta.local_concrete_fields if not field.primary_key]
+        cast_types = [self.get_cast_type(field) for field in fields]
+        if any(cast_type is None for cast_type in cast_types):
+            #e.g geometry columns, they can not be cast from a parameter
+            for obj in objs:
+                obj.save()
+            return
+
+        quote_name = connection.ops.quote_name
+        pk_column = quote_name(model._meta.pk.column)
+        chunk_size = getattr(settings, 'API_BULK_UPDATE_CHUNK_SIZE', 100)
+        cursor = connection.cursor()
+        for start in range(0, len(objs), chunk_size):
+            chunk = objs[start:start + chunk_size]
+            for obj in chunk:
+                pre_save.send(sender=model, instance=obj, raw=False, using=connection.alias, update_fields=None)
+            assignments, params = [], []
+            for field, cast_type in zip(fields, cast_types):
+                cases = []
+                for obj in chunk:
+                    cases.append('WHEN %s THEN CAST(%s AS {cast_type})'.format(cast_type=cast_type))
+                    params.extend([obj.pk, field.get_db_prep_save(field.pre_save(obj, False), connection=connection)])
+                assignments.append('{column} = CASE {pk_column} {cases} END'.format(
+                    column=quote_name(field.column), pk_column=pk_column, cases=' '.join(cases)))
+            params.extend(obj.pk for obj in chunk)
+            cursor.execute('UPDATE {table} SET {assignments} WHERE {pk_column} IN ({pks})'.format(
+                table=quote_name(model._meta.db_table), assignments=', '.join(assignments), pk_column=pk_column,
+                pks=', '.join(['%s'] * len(chunk))), params)
+            for obj in chunk:
+                post_save.send(sender=model, instance=obj, created=False, raw=False, using=connection.alias,
+                               update_fields=None)
+
+    def get_cast_type(self, field):
+        """
+            returns the column type a parameter is cast to in update_objects(), the CHECK constraint of positive
+            integer columns is left out like ForeignKey.db_type() does.
+        """
+        if isinstance(field, PositiveSmallIntegerField):
+            return SmallIntegerField().db_type(connection)
+        if isinstance(field, PositiveIntegerField):
+            return IntegerField().db_type(connection)
+        return field.db_type(connection)
+
+    def save_bulk_related_data(self, obj):
+        """
+            saves many-to-many and reverse relations data restored by the serializer on obj, bulk_create() only
+            saves the object fields.
+        """
+        for accessor_name, object_list in getattr(obj, '_m2m_data', {}).items():
+            setattr(obj, accessor_name, object_list)
+        for accessor_name, related in getattr(obj, '_related_data', {}).items():
+            setattr(obj, accessor_name, related)
+
     def update_obj_is_deleted(self, is_deleted):
         """
             updates given object is_deleted field
@@ -80,6 +491,72 @@ class BaseModelViewSet(viewsets.ModelViewSet):
             return Response(data={'success': True})
         return Response(data={'detail': 'not found'})
 
+    def bulk_destroy(self, request, *args, **kwargs):
+        """
+            soft deletes every object matching the request filter query parameters and/or the "uuids" list in the
+            request body with a single UPDATE, see bulk_update_is_deleted()
+        """
+        return self.bulk_update_is_deleted(request, is_deleted=True)
+
+    def bulk_recover(self, request, *args, **kwargs):
+        """
+            recovers every soft deleted object matching the request filters with a single UPDATE.
+        """
+        return self.bulk_update_is_deleted(request, is_deleted=False)
+
+    def bulk_update_is_deleted(self, request, is_deleted):
+        """
+            sets is_deleted on every matching object in one transaction: matching rows are locked and their uuids
+            read, they are updated with one UPDATE ... WHERE and one reversion revision holding a version of each
+            object is saved with bulk_create().
+
+            ?dry_run=true only returns the number of objects that would change.
+        """
+        uuids = request.DATA.get('uuids') if isinstance(request.DATA, dict) else None
+        if uuids is not None and not (isinstance(uuids, list) and
+                                      all(isinstance(uuid, six.string_types) for uuid in uuids)):
+            return Response(data={'detail': 'Expected "uuids" to be a list of uuids.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        #?is_deleted= only says which side of the flag to match, on its own it would match the whole table
+        filters = [name for name in request.QUERY_PARAMS if name in self.filter_fields and name != 'is_deleted']
+        if not filters and not uuids:
+            return Response(data={'detail': 'Expected filter query parameters or a list of uuids.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        model = self.get_view_model_class()
+        queryset = self.filter_queryset(model.all_objects.filter(is_deleted=not is_deleted))
+        if uuids:
+            queryset = queryset.filter(uuid__in=uuids)
+        if request.QUERY_PARAMS.get('dry_run') in ('1', 'true', 'True'):
+            return Response(data={'dry_run': True, 'count': queryset.count()})
+
+        user = self.get_request_user()
+        updates = {'is_deleted': is_deleted, 'modified': timezone.now()}
+        if user:
+            updates['modified_by'] = user
+        with transaction.atomic():
+            uuids = list(queryset.select_for_update().values_list('uuid', flat=True))
+            error = self.check_is_deleted_update(request, uuids, is_deleted)
+            if error is not None:
+                return error
+            if uuids:
+                model.all_objects.filter(uuid__in=uuids).update(**updates)
+                post_update_is_deleted.send(sender=model, uuids=uuids, is_deleted=is_deleted)
+                if reversion.is_registered(model):
+                    comment = 'Soft deleted' if is_deleted else 'Recovered'
+                    reversion.default_revision_manager.save_revision(
+                        list(model.all_objects.filter(uuid__in=uuids)), user=user, comment=comment)
+        #QuerySet.update() does not send post_save signals
+        bump_model_version(model)
+        return Response(data={'success': True, 'count': len(uuids)})
+
+    def check_is_deleted_update(self, request, uuids, is_deleted):
+        """
+            returns an error Response if is_deleted of the locked objects with the given uuids can not be changed by
+            bulk_update_is_deleted() or None if it can.
+        """
+        return None
+
     @action(methods=['POST', 'DELETE'])
     def recover(self, request, uuid):
         """
@@ -93,7 +570,69 @@ class BaseModelViewSet(viewsets.ModelViewSet):
         return Response(data={'detail': 'not found'})
 
 
-class ProductViewSet(BaseModelViewSet):
+class CachedResponseMixin(object):
+    """
+        Caches list() and retrieve() responses of master data end-points that rarely change.
+
+        responses are cached under a key made from the request path and the cache versions of cache_models, writes to
+        any of the models bump its version (see core.cache) which invalidates every cached response. the same key is
+        returned as ETag and the time of the last write as Last-Modified, clients that send a matching If-None-Match
+        or If-Modified-Since get 304 Not Modified without a database query.
+
+        cache_models defaults to the ViewSet model and User because BaseModelSerializer nests created_by and
+        modified_by users.
+    """
+    cache_models = None
+
+    def get_cache_models(self):
+        return self.cache_models or (self.get_view_model_class(), User)
+
+    def get_cache_validators(self, request):
+        """
+            returns tuple of (etag, last modified datetime) for the request
+        """
+        versions = [get_model_version(model) for model in self.get_cache_models()]
+        key = '{path}|{versions}'.format(path=request.get_full_path(),
+                                         versions=','.join(str(version) for version, _ in versions))
+        return hashlib.md5(key.encode('utf-8')).hexdigest(), max(modified for _, modified in versions)
+
+    def is_not_modified(self, request, etag, last_modified):
+        """
+            returns True if the client copy is still valid, If-None-Match takes precedence over If-Modified-Since.
+        """
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            etags = parse_etags(if_none_match)
+            return etag in etags or '*' in etags
+        if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        return if_modified_since is not None and int(timegm(last_modified.utctimetuple())) <= if_modified_since
+
+    def get_cached_response(self, request, view_method, *args, **kwargs):
+        etag, last_modified = self.get_cache_validators(request)
+        if self.is_not_modified(request, etag, last_modified):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            cache_key = 'lmis:api-response:{etag}'.format(etag=etag)
+            data = cache.get(cache_key)
+            if data is None:
+                response = view_method(request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                cache.set(cache_key, response.data, get_cache_timeout())
+            else:
+                response = Response(data)
+        response['ETag'] = '"{etag}"'.format(etag=etag)
+        response['Last-Modified'] = http_date(timegm(last_modified.utctimetuple()))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(request, super(CachedResponseMixin, self).list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(request, super(CachedResponseMixin, self).retrieve, *args, **kwargs)
+
+
+class ProductViewSet(CachedResponseMixin, BaseModelViewSet):
     """
         API end-point for product model
     """
@@ -101,7 +640,7 @@ class ProductViewSet(BaseModelViewSet):
     serializer_class = ProductSerializer
 
 
-class ProductCategoryViewSet(BaseModelViewSet):
+class ProductCategoryViewSet(CachedResponseMixin, BaseModelViewSet):
     """
         API end point for product category
     """
@@ -109,7 +648,7 @@ class ProductCategoryViewSet(BaseModelViewSet):
     serializer_class = ProductCategorySerializer
 
 
-class UnitOfMeasurementViewSet(BaseModelViewSet):
+class UnitOfMeasurementViewSet(CachedResponseMixin, BaseModelViewSet):
     """
        API end point for Unit of Measurement
     """
@@ -117,7 +656,7 @@ class UnitOfMeasurementViewSet(BaseModelViewSet):
     serializer_class = UnitOfMeasurementSerializer
 
 
-class UOMCategoryViewSet(BaseModelViewSet):
+class UOMCategoryViewSet(CachedResponseMixin, BaseModelViewSet):
     """
         API end point for unit of measurement category
     """
@@ -141,12 +680,13 @@ class CompanyViewSet(BaseModelViewSet):
     serializer_class = CompanySerializer
 
 
-class CurrencyViewSet(BaseModelViewSet):
+class CurrencyViewSet(CachedResponseMixin, BaseModelViewSet):
     """
         API end point for Currency model
     """
     queryset = Currency.objects.all()
     serializer_class = CurrencySerializer
+    cache_models = (Currency, Rate, User)
 
 
 class RateViewSet(BaseModelViewSet):
@@ -194,7 +734,7 @@ class UserFacilityView(views.APIView):
         API end-point that returns logged in user facility if any
     """
     def get(self, request, format=None):
-        serializer = FacilitySerializer(Employee.get_user_facility_or_none(request.user))
+        serializer = FacilitySerializer(get_identity(request).facility, context={'request': request})
         return Response(serializer.data, status=status.HTTP_200_OK, template_name=None, headers=None, content_type=None)
 
 
@@ -214,7 +754,7 @@ class PermissionViewSet(viewsets.ModelViewSet):
     serializer_class = PermissionSerializer
 
 
-class ProductPresentationViewSet(BaseModelViewSet):
+class ProductPresentationViewSet(CachedResponseMixin, BaseModelViewSet):
     """
         API end-point for ProductPresentation model
     """
@@ -222,7 +762,7 @@ class ProductPresentationViewSet(BaseModelViewSet):
     serializer_class = ProductPresentationSerializer
 
 
-class ModeOfAdministrationViewSet(BaseModelViewSet):
+class ModeOfAdministrationViewSet(CachedResponseMixin, BaseModelViewSet):
     """
         API end-point for ModeOfAdministration model
     """
@@ -238,7 +778,7 @@ class ProductItemViewSet(BaseModelViewSet):
     serializer_class = ProductItemSerializer
 
 
-class ProductFormulationViewSet(BaseModelViewSet):
+class ProductFormulationViewSet(CachedResponseMixin, BaseModelViewSet):
     """
         API end point for Product Formulation
     """
@@ -0,0 +1,77 @@
+"""
+    core/cache.py keeps a version counter per model in the shared cache. the counter is bumped whenever an object of
+    the model is saved or deleted, so anything cached under a key that includes the version is invalidated by the
+    write without having to know or delete the cached keys.
+"""
+
+#import core python modules
+import time
+
+#import core django modules
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.utils import timezone
+
+
+#saves that only write these fields leave the version alone, e.g django.contrib.auth saves last_login on every login
+UNTRACKED_FIELDS = frozenset(['last_login'])
+
+
+def get_model_version_key(model):
+    return 'lmis:model-version:{label}'.format(label=model._meta.db_table)
+
+
+def get_model_modified_key(model):
+    return 'lmis:model-modified:{label}'.format(label=model._meta.db_table)
+
+
+def get_cache_timeout():
+    return getattr(settings, 'API_RESPONSE_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
+def get_model_version(model):
+    """
+        returns tuple of (version, last modified datetime) of the given model.
+
+        when a version is missing (first use or evicted) it is started from the current time in microseconds, so a
+        version number is never handed out twice and clients holding an old ETag never get a false match.
+    """
+    version_key, modified_key = get_model_version_key(model), get_model_modified_key(model)
+    values = cache.get_many([version_key, modified_key])
+    if version_key not in values or modified_key not in values:
+        return bump_model_version(model)
+    return values[version_key], values[modified_key]
+
+
+def bump_model_version(model):
+    """
+        bumps version of the given model and returns tuple of (version, last modified datetime). it is connected to
+        post_save and post_delete signals of tracked models and should be called after writes that bypass signals
+        such as bulk_create() or QuerySet.update().
+    """
+    version_key, modified_key = get_model_version_key(model), get_model_modified_key(model)
+    modified = timezone.now()
+    try:
+        version = cache.incr(version_key)
+    except ValueError:
+        version = int(time.time() * 1000000)
+        cache.set(version_key, version, get_cache_timeout())
+    cache.set(modified_key, modified, get_cache_timeout())
+    return version, modified
+
+
+def track_model_versions(*models):
+    """
+        bumps the version of each of the given models whenever one of its objects is saved or deleted, saves with
+        update_fields that only name UNTRACKED_FIELDS are left out.
+    """
+    for model in models:
+        post_save.connect(_bump_sender_version, sender=model, dispatch_uid=get_model_version_key(model) + ':save')
+        post_delete.connect(_bump_sender_version, sender=model, dispatch_uid=get_model_version_key(model) + ':delete')
+
+
+def _bump_sender_version(sender, update_fields=None, **kwargs):
+    if update_fields and UNTRACKED_FIELDS.issuperset(update_fields):
+        return
+    bump_model_version(sender)
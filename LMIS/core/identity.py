@@ -0,0 +1,73 @@
+"""
+    core/identity.py resolves who is making an API request: the user, their employee record and the facility of the
+    employee current company. it is resolved once per request and the employee and facility keys are kept in the
+    shared cache for IDENTITY_CACHE_TIMEOUT seconds, saving or deleting an Employee invalidates the cached keys of its
+    user.
+"""
+
+#import core django modules
+from django.conf import settings
+from django.core.cache import cache
+
+
+def get_identity_cache_key(user_id):
+    return 'lmis:identity:{user_id}'.format(user_id=user_id)
+
+
+def invalidate_identity(user_id):
+    cache.delete(get_identity_cache_key(user_id))
+
+
+class Identity(object):
+    """
+        Identity of a request user. employee and facility objects are only loaded when they are used.
+
+        user: authenticated user or None for anonymous users.
+    """
+    def __init__(self, user=None, employee_id=None, facility_id=None):
+        self.user = user
+        self.employee_id = employee_id
+        self.facility_id = facility_id
+
+    @property
+    def employee(self):
+        if not hasattr(self, '_employee'):
+            from core.models import Employee
+            self._employee = Employee.objects.filter(pk=self.employee_id).first() if self.employee_id else None
+        return self._employee
+
+    @property
+    def facility(self):
+        if not hasattr(self, '_facility'):
+            from facilities.models import Facility
+            self._facility = Facility.objects.filter(pk=self.facility_id).first() if self.facility_id else None
+        return self._facility
+
+
+def load_identity(user):
+    """
+        returns Identity of the given user, employee and facility keys come from the shared cache or from one query.
+    """
+    from core.models import Employee
+    if user is None or not user.is_authenticated():
+        return Identity()
+
+    cache_key = get_identity_cache_key(user.id)
+    keys = cache.get(cache_key)
+    if keys is None:
+        keys = Employee.objects.filter(user__id=user.id).values_list('uuid', 'current_company__facility__pk').first()
+        keys = keys or (None, None)
+        cache.set(cache_key, keys, getattr(settings, 'IDENTITY_CACHE_TIMEOUT', 60))
+    employee_id, facility_id = keys
+    return Identity(user, employee_id, facility_id)
+
+
+def get_identity(request):
+    """
+        returns Identity of the user making the request, it is resolved once per request.
+    """
+    identity = getattr(request, '_lmis_identity', None)
+    if identity is None:
+        identity = load_identity(getattr(request, 'user', None))
+        request._lmis_identity = identity
+    return identity
@@ -0,0 +1,154 @@
+"""
+    core/indexes.py holds database indexes shared by every BaseModel table. BaseModel fields come from abstract
+    models (TimeStampedModel), so these indexes can not be declared on the fields, they are created when tables are
+    created by syncdb and on existing databases with "manage.py create_indexes".
+
+    syncdb does not change tables that already exist, so "manage.py create_indexes" also creates the indexes declared
+    on models (db_index, index_together and unique_together) that were added after their table was created.
+"""
+
+#import core django modules
+from django.db import connections, models, DEFAULT_DB_ALIAS
+from django.db.backends.util import truncate_name
+
+
+#(index name suffix, indexed columns, WHERE clause for partial indexes or None)
+BASE_MODEL_INDEXES = (
+    ('modified_uuid', ('modified', 'uuid'), None),
+    ('is_deleted_modified', ('is_deleted', 'modified'), None),
+    #serves BaseModel.objects keyset pages and filters, which only read rows that are not soft deleted
+    ('live_modified_uuid', ('modified', 'uuid'), 'is_deleted = false'),
+)
+
+#database backends whose indexes get_existing_indexes() can list
+INDEX_VENDORS = ('postgresql', 'sqlite')
+
+
+def get_base_models(app_models=None):
+    """
+        returns BaseModel sub-classes in app_models or in every installed app if app_models is None
+    """
+    from core.models import BaseModel
+    if app_models is None:
+        app_models = models.get_models()
+    return [model for model in app_models if issubclass(model, BaseModel) and model._meta.managed and
+            not model._meta.proxy]
+
+
+def get_index_sql(model, using=DEFAULT_DB_ALIAS):
+    """
+        returns list of (index name, CREATE INDEX statement) for BASE_MODEL_INDEXES that apply to model table, multi
+        table inheritance children e.g Facility don't have the parent columns on their table and are skipped.
+    """
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    table = model._meta.db_table
+    local_columns = set(field.column for field in model._meta.local_fields)
+    statements = []
+    for suffix, columns, where in BASE_MODEL_INDEXES:
+        if not local_columns.issuperset(columns):
+            continue
+        name = truncate_name('{table}_{suffix}'.format(table=table, suffix=suffix), connection.ops.max_name_length())
+        sql = 'CREATE INDEX {name} ON {table} ({columns})'.format(
+            name=qn(name), table=qn(table), columns=', '.join(qn(column) for column in columns))
+        if where:
+            sql = '{sql} WHERE {where}'.format(sql=sql, where=where)
+        statements.append((name, sql))
+    return statements
+
+
+def get_declared_index_sql(model, using=DEFAULT_DB_ALIAS):
+    """
+        returns list of (index name, columns, CREATE INDEX statement) for the indexes declared on model: fields with
+        db_index, index_together and unique_together. columns is a tuple, in index order.
+    """
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    table = model._meta.db_table
+    indexes = [((field.column,), False) for field in model._meta.local_fields if field.db_index and not field.unique]
+    for field_names, unique in ([(names, False) for names in model._meta.index_together] +
+                                [(names, True) for names in model._meta.unique_together]):
+        indexes.append((tuple(model._meta.get_field(field_name).column for field_name in field_names), unique))
+    statements = []
+    for columns, unique in indexes:
+        name = truncate_name('{table}_{columns}{suffix}'.format(table=table, columns='_'.join(columns),
+                                                                suffix='_uniq' if unique else ''),
+                             connection.ops.max_name_length())
+        statements.append((name, columns, 'CREATE {unique}INDEX {name} ON {table} ({columns})'.format(
+            unique='UNIQUE ' if unique else '', name=qn(name), table=qn(table),
+            columns=', '.join(qn(column) for column in columns))))
+    return statements
+
+
+def get_index_columns(cursor, table, using=DEFAULT_DB_ALIAS):
+    """
+        returns set of (columns, unique) of the indexes on the given table that are not partial. indexes syncdb or
+        South created are named differently and unique_together is a table constraint whose index is named by the
+        database, so declared indexes are looked up by their columns.
+    """
+    vendor = connections[using].vendor
+    if vendor not in INDEX_VENDORS:
+        raise NotImplementedError('Can not list indexes on {vendor} databases.'.format(vendor=vendor))
+    indexes = set()
+    if vendor == 'postgresql':
+        cursor.execute('SELECT a.attnum, a.attname FROM pg_attribute a JOIN pg_class t ON t.oid = a.attrelid '
+                       'WHERE t.relname = %s AND a.attnum > 0', [table])
+        names = dict((str(number), name) for number, name in cursor.fetchall())
+        cursor.execute('SELECT CAST(i.indkey AS text), i.indisunique FROM pg_index i JOIN pg_class t '
+                       'ON t.oid = i.indrelid WHERE t.relname = %s AND i.indpred IS NULL', [table])
+        for numbers, unique in cursor.fetchall():
+            indexes.add((tuple(names.get(number) for number in numbers.split()), unique))
+    else:
+        qn = connections[using].ops.quote_name
+        cursor.execute('PRAGMA index_list({table})'.format(table=qn(table)))
+        for row in cursor.fetchall():
+            if len(row) > 4 and row[4]:
+                #partial index
+                continue
+            cursor.execute('PRAGMA index_info({index})'.format(index=qn(row[1])))
+            indexes.add((tuple(info[2] for info in sorted(cursor.fetchall())), bool(row[2])))
+    return indexes
+
+
+def get_existing_indexes(cursor, table, using=DEFAULT_DB_ALIAS):
+    """
+        returns set of names of indexes on the given table. syncdb sends post_syncdb once per app, so indexes that
+        exist have to be found on every backend or the next call would create them again.
+    """
+    vendor = connections[using].vendor
+    if vendor not in INDEX_VENDORS:
+        #the partial indexes of BASE_MODEL_INDEXES need PostgreSQL or SQLite anyway
+        raise NotImplementedError('Can not list indexes on {vendor} databases.'.format(vendor=vendor))
+    if vendor == 'postgresql':
+        cursor.execute('SELECT indexname FROM pg_indexes WHERE tablename = %s', [table])
+    else:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = %s", [table])
+    return set(row[0] for row in cursor.fetchall())
+
+
+def create_indexes(app_models=None, using=DEFAULT_DB_ALIAS, declared=True):
+    """
+        creates BASE_MODEL_INDEXES missing on BaseModel tables and returns list of names of created indexes.
+
+        if declared is True the get_declared_index_sql() indexes that no index on the same columns stands in for
+        are created too, syncdb creates those itself on new tables. a unique index fails to be created if the table
+        has duplicate rows.
+    """
+    created = []
+    cursor = connections[using].cursor()
+    for model in get_base_models(app_models):
+        table = model._meta.db_table
+        existing = get_existing_indexes(cursor, table, using)
+        statements = get_index_sql(model, using)
+        if declared:
+            columns = get_index_columns(cursor, table, using)
+            unique_columns = set(index_columns for index_columns, unique in columns if unique)
+            all_columns = set(index_columns for index_columns, unique in columns)
+            statements += [(name, sql) for name, index_columns, sql in get_declared_index_sql(model, using)
+                           if index_columns not in (unique_columns if sql.startswith('CREATE UNIQUE')
+                                                    else all_columns)]
+        for name, sql in statements:
+            if name not in existing:
+                cursor.execute(sql)
+                created.append(name)
+    return created
@@ -0,0 +1,33 @@
+"""
+    manage.py create_indexes creates indexes shared by BaseModel tables and indexes declared on the models that are
+    missing on an existing database.
+"""
+
+#import core python modules
+from optparse import make_option
+
+#import core django modules
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import get_app, get_models
+
+#import project modules
+from core.indexes import create_indexes
+
+
+class Command(BaseCommand):
+    args = '<app_label app_label ...>'
+    help = 'Creates missing indexes of BaseModel tables of the given apps or of all installed apps.'
+    option_list = BaseCommand.option_list + (
+        make_option('--database', action='store', dest='database', default=DEFAULT_DB_ALIAS,
+                    help='Nominates a database to create the indexes on. Defaults to the "default" database.'),
+    )
+
+    def handle(self, *app_labels, **options):
+        app_models = None
+        if app_labels:
+            app_models = [model for app_label in app_labels for model in get_models(get_app(app_label))]
+        created = create_indexes(app_models, using=options['database'])
+        for name in created:
+            self.stdout.write('Created index {name}'.format(name=name))
+        self.stdout.write('{count} index(es) created.'.format(count=len(created)))
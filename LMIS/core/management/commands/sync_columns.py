@@ -0,0 +1,62 @@
+"""
+    manage.py sync_columns brings tables of apps without South migrations up to date with their models on an existing
+    database. syncdb only creates missing tables, so columns added to a model later are missing on tables created
+    before, and fields made nullable keep their NOT NULL constraint.
+"""
+
+#import core python modules
+import copy
+from optparse import make_option
+
+#import core django modules
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+from django.db.models import get_app, get_models
+
+#import external modules
+from south.db import dbs
+
+
+class Command(BaseCommand):
+    args = '<app_label app_label ...>'
+    help = ('Adds columns missing on existing tables of the given apps or of all installed apps and drops NOT NULL '
+            'from columns of nullable fields.')
+    option_list = BaseCommand.option_list + (
+        make_option('--database', action='store', dest='database', default=DEFAULT_DB_ALIAS,
+                    help='Nominates a database to update. Defaults to the "default" database.'),
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+                    help='Only lists the changes.'),
+    )
+
+    def handle(self, *app_labels, **options):
+        if app_labels:
+            app_models = [model for app_label in app_labels for model in get_models(get_app(app_label))]
+        else:
+            app_models = get_models()
+        connection = connections[options['database']]
+        db = dbs[options['database']]
+        cursor = connection.cursor()
+        tables = set(connection.introspection.table_names(cursor))
+
+        changes = 0
+        with transaction.atomic(using=options['database']):
+            for model in app_models:
+                table = model._meta.db_table
+                if not model._meta.managed or model._meta.proxy or table not in tables:
+                    continue
+                columns = dict((row[0], row) for row in connection.introspection.get_table_description(cursor, table))
+                for field in model._meta.local_fields:
+                    if field.column not in columns:
+                        self.stdout.write('Adding {table}.{column}'.format(table=table, column=field.column))
+                        if not options['dry_run']:
+                            db.add_column(table, field.name, copy.deepcopy(field), keep_default=False)
+                        changes += 1
+                    elif field.null and not columns[field.column][6]:
+                        self.stdout.write('Dropping NOT NULL from {table}.{column}'.format(table=table,
+                                                                                            column=field.column))
+                        if not options['dry_run']:
+                            db.alter_column(table, field.column, copy.deepcopy(field))
+                        changes += 1
+            if not options['dry_run']:
+                db.execute_deferred_sql()
+        self.stdout.write('{count} column(s) changed.'.format(count=changes))
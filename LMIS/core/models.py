@@ -2,8 +2,14 @@
     CORE module holds core models that are used throughout the LMIS project.
 """
 
+#import core python modules
+import warnings
+
 #import django modules
-from django.db import models
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import connections, models, DEFAULT_DB_ALIAS
+from django.db.models.signals import post_syncdb, post_save, post_delete
+from django.dispatch import receiver
 from django.contrib.auth.models import User
 
 #import external modules
@@ -14,6 +20,19 @@ from model_utils.models import TimeStampedModel
 from model_utils import Choices
 from django_countries.fields import CountryField
 
+#import project modules
+from core.cache import track_model_versions
+from core.identity import invalidate_identity
+from core.indexes import create_indexes, INDEX_VENDORS
+
+
+class LiveManager(models.Manager):
+    """
+        BaseModel.objects manager, it only returns objects that are not soft deleted.
+    """
+    def get_queryset(self):
+        return super(LiveManager, self).get_queryset().filter(is_deleted=False)
+
 
 class BaseModel(TimeStampedModel):
     """
@@ -22,6 +41,10 @@ class BaseModel(TimeStampedModel):
         it extends TimeStampedModel which adds self-updating created and modified fields on any model that
         inherits from it.
 
+        all_objects: returns every object including soft deleted ones. it is declared first so that it is the
+        default manager (_default_manager) used by admin, related managers, unique and foreign key validation, which
+        must see soft deleted rows.
+        objects: returns objects that are not soft deleted, it is served by the partial indexes in core/indexes.py
     """
     uuid = UUIDField(version=4, primary_key=True)
     is_deleted = models.BooleanField(default=False)
@@ -29,6 +52,9 @@ class BaseModel(TimeStampedModel):
     modified_by = models.ForeignKey(User, blank=True, null=True,
                                     related_name='%(app_label)s_%(class)s_modified_by')
 
+    all_objects = models.Manager()
+    objects = LiveManager()
+
     class Meta:
         abstract = True
 
@@ -36,10 +62,11 @@ class BaseModel(TimeStampedModel):
 class VVMStage(BaseModel):
     """
         This is used to represent possible stages of vaccine vial monitor attached to vaccines to  which gives a visual
-        indication of whether the vaccine has been kept at a temperature which preserves its potency.
+        indication of whether the vaccine has been kept at a temperature which preserves its potency. stages are
+        stored as their number in vvm_stage integer fields, vaccines at stage 3 or 4 must not be used.
     """
-    STAGES = Choices(('stage_one', 'Stage 1'), ('stage_two', 'Stage 2'), ('stage_three', 'Stage 3'),
-                     ('stage_four', 'Stage 4'))
+    STAGES = Choices((1, 'stage_one', 'Stage 1'), (2, 'stage_two', 'Stage 2'), (3, 'stage_three', 'Stage 3'),
+                     (4, 'stage_four', 'Stage 4'))
 
     class Meta:
         managed = False
@@ -271,9 +298,9 @@ class Employee(Party):
             This class method returns the Facility this given user belongs to and None if there is no facility.
         """
         try:
-            employee = Employee.objects.get(user__id=user.id)
+            employee = Employee.objects.select_related('current_company__facility').get(user__id=user.id)
             return employee.current_company.facility
-        except (Employee.DoesNotExist, Exception, ):
+        except ObjectDoesNotExist:
             return None
 
 
@@ -388,7 +415,7 @@ class ProductItem(BaseModel):
     gtin = models.CharField(max_length=35, blank=True)
     price_per_unit = models.DecimalField(max_digits=21, decimal_places=2)
     price_currency = models.ForeignKey(Currency, blank=True, null=True)
-    expiration_date = models.DateField()
+    expiration_date = models.DateField(db_index=True)
     mode_of_use = models.ForeignKey('ModeOfAdministration', blank=True, null=True)
     formulation = models.ForeignKey('ProductFormulation', blank=True, null=True)
     description = models.CharField(max_length=100, blank=True)
@@ -434,3 +461,30 @@ reversion.register(ModeOfAdministration)
 reversion.register(ProductItem)
 reversion.register(ProductFormulation)
 
+#bump cache versions of master data models whose API responses are cached
+track_model_versions(User, UOMCategory, UnitOfMeasurement, Rate, Currency, ProductCategory, Product,
+                     ProductPresentation, ModeOfAdministration, ProductFormulation)
+
+
+@receiver(post_syncdb)
+def create_base_model_indexes(sender, created_models, db=DEFAULT_DB_ALIAS, **kwargs):
+    """
+        creates indexes shared by BaseModel tables on tables just created by syncdb. other backends are skipped with
+        a warning so syncdb still works on them, "manage.py create_indexes" reports the error.
+    """
+    vendor = connections[db].vendor
+    if vendor not in INDEX_VENDORS:
+        warnings.warn('BaseModel indexes are not created on {vendor} databases.'.format(vendor=vendor))
+        return
+    #syncdb creates the indexes declared on the models itself after post_syncdb
+    create_indexes(created_models, using=db, declared=False)
+
+
+@receiver(post_save, sender=Employee)
+@receiver(post_delete, sender=Employee)
+def invalidate_employee_identity(sender, instance, **kwargs):
+    """
+        drops cached identity of the employee user so the next request resolves the new employee and facility
+    """
+    if instance.user_id:
+        invalidate_identity(instance.user_id)
@@ -0,0 +1,11 @@
+"""
+    core/signals.py holds custom signals sent by the LMIS API for writes that bypass model save() and delete().
+"""
+
+#import core django modules
+from django.dispatch import Signal
+
+
+#sent by set-based soft delete and recover with the uuids of the objects whose is_deleted flag was set, it is sent
+#inside the transaction of the update so receivers can keep derived tables in step.
+post_update_is_deleted = Signal(providing_args=['uuids', 'is_deleted'])
@@ -0,0 +1,40 @@
+"""
+    core/testing.py holds helpers shared by the LMIS apps test cases.
+"""
+
+#import core django modules
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class _AssertMaxQueriesContext(CaptureQueriesContext):
+    def __init__(self, test_case, budget, connection):
+        self.test_case = test_case
+        self.budget = budget
+        super(_AssertMaxQueriesContext, self).__init__(connection)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        super(_AssertMaxQueriesContext, self).__exit__(exc_type, exc_value, traceback)
+        if exc_type is not None:
+            return
+        executed = len(self)
+        self.test_case.assertTrue(
+            executed <= self.budget, '{executed} queries executed, query budget is {budget}\n{queries}'.format(
+                executed=executed, budget=self.budget,
+                queries='\n'.join(query['sql'] for query in self.captured_queries)))
+
+
+class QueryBudgetMixin(object):
+    """
+        TestCase mixin that adds assertMaxQueries(), it works like TestCase.assertNumQueries() but only fails if more
+        than the given number of queries were executed. e.g
+
+            with self.assertMaxQueries(5):
+                self.client.get('/api/v1/facilities/facility/')
+    """
+    def assertMaxQueries(self, budget, func=None, *args, **kwargs):
+        context = _AssertMaxQueriesContext(self, budget, connection)
+        if func is None:
+            return context
+        with context:
+            func(*args, **kwargs)
@@ -1,3 +1,379 @@
+#import core python modules
+import warnings
+
+#import core django modules
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import override_settings
+
+#import external modules
+from rest_framework.test import APITestCase
+
+#import project modules
+from cce.models import StorageLocationTempLog
+from core.api.views import CompanyCategoryViewSet, UnitOfMeasurementViewSet
+from core.cache import get_model_version
+from core.indexes import create_indexes, get_existing_indexes, get_index_columns, get_index_sql
+from core.models import (CompanyCategory, UOMCategory, UnitOfMeasurement, Currency, Rate, ProductItem,
+                         create_base_model_indexes)
+from core.testing import QueryBudgetMixin
+from core.uom import TemperatureConverter, UOMConverter, UOMConversionError
+
+
+class CursorPaginationTest(APITestCase):
+    """
+        list end-points return the whole collection unless the client asks for a page
+    """
+    url = '/api/v1/core/company-category/'
+
+    def setUp(self):
+        self.categories = [CompanyCategory.objects.create(name='Category {index}'.format(index=index))
+                           for index in range(5)]
+
+    def test_list_without_page_params_returns_every_object(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response.data, list)
+        self.assertEqual(len(response.data), 5)
+
+    def test_pages_cover_collection_once(self):
+        response = self.client.get(self.url, {'page_size': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.data['previous'])
+        names = [row['name'] for row in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            names.extend(row['name'] for row in response.data['results'])
+        self.assertEqual(sorted(names), sorted(category.name for category in self.categories))
+
+    def test_previous_link_returns_previous_page(self):
+        first = self.client.get(self.url, {'page_size': 2})
+        second = self.client.get(first.data['next'])
+        previous = self.client.get(second.data['previous'])
+        self.assertEqual(previous.data['results'], first.data['results'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {'cursor': 'rubbish'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_pagination_opt_out(self):
+        CompanyCategoryViewSet.pagination_class = None
+        try:
+            response = self.client.get(self.url, {'page_size': 2})
+        finally:
+            del CompanyCategoryViewSet.pagination_class
+        self.assertIsInstance(response.data, list)
+        self.assertEqual(len(response.data), 5)
+
+
+class ExpandUserTest(APITestCase):
+    """
+        expanded users leave out the password hash, groups and permissions
+    """
+    def test_expanded_created_by(self):
+        user = User.objects.create_user('clerk', 'clerk@example.com', 'secret')
+        CompanyCategory.objects.create(name='Store', created_by=user)
+        response = self.client.get('/api/v1/core/company-category/', {'expand': 'created_by'})
+        created_by = response.data[0]['created_by']
+        self.assertEqual(created_by['username'], 'clerk')
+        for name in ('password', 'groups', 'user_permissions'):
+            self.assertNotIn(name, created_by)
+
+
+class QueryPlanCacheTest(APITestCase):
+    """
+        query plans are cached per view set class, a sub-class does not share the cache of the class it inherits from
+    """
+    def test_each_view_set_class_has_its_own_cache(self):
+        self.client.get('/api/v1/core/company-category/')
+        plans = CompanyCategoryViewSet.get_query_plans()
+        self.assertEqual(len(plans), 1)
+        self.assertIsNot(UnitOfMeasurementViewSet.get_query_plans(), plans)
+        sub_class = type('SubCompanyCategoryViewSet', (CompanyCategoryViewSet,), {})
+        self.assertEqual(sub_class.get_query_plans(), {})
+        self.assertIs(CompanyCategoryViewSet.get_query_plans(), plans)
+
+
+class BulkWriteTest(QueryBudgetMixin, APITestCase):
+    """
+        bulk create and update validate and write a batch with a fixed number of queries
+    """
+    url = '/api/v1/core/uom/bulk/'
+
+    def setUp(self):
+        self.category = UOMCategory.objects.create(name='Volume', description='Volume')
+
+    def get_items(self, count):
+        return [{'name': 'Unit {index}'.format(index=index), 'symbol': 'u', 'uom_category': self.category.pk}
+                for index in range(count)]
+
+    def test_bulk_create_query_budget(self):
+        with self.assertMaxQueries(8):
+            response = self.client.post(self.url, self.get_items(50), format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(UnitOfMeasurement.objects.filter(uom_category=self.category).count(), 50)
+
+    def test_bulk_create_rejects_duplicates_in_batch(self):
+        items = self.get_items(3)
+        items[2]['name'] = items[0]['name']
+        response = self.client.post(self.url, items, format='json')
+        self.assertEqual(response.status_code, 400)
+        errors = response.data['errors']
+        self.assertIn('name', errors[0])
+        self.assertEqual(errors[1], {})
+        self.assertIn('name', errors[2])
+        self.assertFalse(UnitOfMeasurement.objects.exists())
+
+    def test_bulk_create_rejects_saved_duplicates(self):
+        UnitOfMeasurement.all_objects.create(name='Unit 1', symbol='u', uom_category=self.category, is_deleted=True)
+        response = self.client.post(self.url, self.get_items(3), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('name', response.data['errors'][1])
+
+    def test_bulk_create_rejects_unknown_relation(self):
+        items = self.get_items(2)
+        items[1]['uom_category'] = 'unknown'
+        response = self.client.post(self.url, items, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('uom_category', response.data['errors'][1])
+
+    def test_bulk_update_query_budget(self):
+        units = [UnitOfMeasurement.objects.create(name=item['name'], symbol='u', uom_category=self.category)
+                 for item in self.get_items(30)]
+        items = [{'uuid': unit.pk, 'name': unit.name, 'symbol': 'ml', 'uom_category': self.category.pk}
+                 for unit in units]
+        with self.assertMaxQueries(8):
+            response = self.client.put(self.url, items, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(UnitOfMeasurement.objects.values_list('symbol', flat=True)), set(['ml']))
+
+    def test_bulk_update_rejects_duplicate_uuid(self):
+        unit = UnitOfMeasurement.objects.create(name='Litre', symbol='l', uom_category=self.category)
+        response = self.client.patch(self.url, [{'uuid': unit.pk, 'symbol': 'L'}, {'uuid': unit.pk, 'symbol': 'l'}],
+                                     format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('uuid', response.data['errors'][1])
+
+
+class ChangesFeedTest(APITestCase):
+    """
+        the changes feed returns changes and tombstones once they can not be overtaken by transactions in flight
+    """
+    url = '/api/v1/core/company-category/changes/'
+
+    def test_recent_changes_are_held_back(self):
+        CompanyCategory.objects.create(name='New')
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['results'], [])
+        self.assertIsNone(response.data['watermark'])
+
+    @override_settings(API_CHANGES_FEED_LAG=0)
+    def test_changes_and_tombstones(self):
+        CompanyCategory.objects.create(name='Live')
+        deleted = CompanyCategory.all_objects.create(name='Deleted', is_deleted=True)
+        response = self.client.get(self.url)
+        self.assertEqual([row['name'] for row in response.data['results']], ['Live'])
+        self.assertEqual(response.data['deleted'], [deleted.pk])
+        self.assertFalse(response.data['has_more'])
+
+        response = self.client.get(self.url, {'since': response.data['watermark']})
+        self.assertEqual(response.data['results'], [])
+        self.assertEqual(response.data['deleted'], [])
+
+
+class CreateIndexesTest(TestCase):
+    """
+        syncdb sends post_syncdb once per app, creating the BaseModel indexes again must not fail
+    """
+    def test_create_indexes_twice(self):
+        create_indexes([CompanyCategory])
+        self.assertEqual(create_indexes([CompanyCategory]), [])
+        existing = get_existing_indexes(connection.cursor(), CompanyCategory._meta.db_table)
+        self.assertTrue(existing.issuperset(name for name, _ in get_index_sql(CompanyCategory)))
+
+    def test_declared_indexes_missing_on_existing_tables(self):
+        create_indexes([ProductItem, StorageLocationTempLog])
+        self.assertEqual(create_indexes([ProductItem, StorageLocationTempLog]), [])
+        cursor = connection.cursor()
+        self.assertIn((('storage_location_id', 'date_time_logged'), True),
+                      get_index_columns(cursor, StorageLocationTempLog._meta.db_table))
+
+        #drop the index syncdb created, as on a table created before expiration_date was indexed
+        field = ProductItem._meta.get_field('expiration_date')
+        sql = connection.creation.sql_indexes_for_field(ProductItem, field, no_style())[0]
+        cursor.execute('DROP INDEX {name}'.format(name=sql.split()[2]))
+        self.assertEqual(create_indexes([ProductItem]), ['{table}_expiration_date'.format(
+            table=ProductItem._meta.db_table)])
+        self.assertIn((('expiration_date',), False), get_index_columns(cursor, ProductItem._meta.db_table))
+
+    def test_syncdb_skips_other_backends(self):
+        connection.vendor = 'mysql'
+        try:
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                create_base_model_indexes(sender=None, created_models=[CompanyCategory])
+        finally:
+            del connection.vendor
+        self.assertEqual(len(caught), 1)
+
+
+class ModelVersionTest(TestCase):
+    """
+        cached master data is invalidated by writes that change it, not by logins
+    """
+    def setUp(self):
+        self.user = User.objects.create_user('clerk', password='secret')
+
+    def test_login_leaves_user_version_alone(self):
+        version = get_model_version(User)
+        self.assertTrue(self.client.login(username='clerk', password='secret'))
+        self.assertEqual(get_model_version(User), version)
+
+    def test_user_save_bumps_version(self):
+        version, _ = get_model_version(User)
+        self.user.first_name = 'Ada'
+        self.user.save()
+        self.assertNotEqual(get_model_version(User)[0], version)
+
+
+class SoftDeleteManagerTest(APITestCase):
+    """
+        objects leaves out soft deleted rows, the default manager and validation still see them
+    """
+    def setUp(self):
+        self.category = UOMCategory.objects.create(name='Volume', description='Volume')
+        self.deleted = UnitOfMeasurement.all_objects.create(name='Litre', symbol='l', uom_category=self.category,
+                                                            is_deleted=True)
+
+    def test_managers(self):
+        self.assertFalse(UnitOfMeasurement.objects.filter(pk=self.deleted.pk).exists())
+        self.assertTrue(UnitOfMeasurement._default_manager.filter(pk=self.deleted.pk).exists())
+        self.assertEqual(list(self.category.unitofmeasurement_set.all()), [self.deleted])
+
+    def test_duplicate_of_soft_deleted_row_is_a_validation_error(self):
+        response = self.client.post('/api/v1/core/uom/', {'name': 'Litre', 'symbol': 'l',
+                                                          'uom_category': self.category.pk}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('name', response.data)
+
+    def test_to_many_relations_leave_out_soft_deleted_objects(self):
+        currency = Currency.objects.create(name='Naira', symbol='N', code='NGN')
+        rate = Rate.objects.create(name='Naira', value=1, currency=currency)
+        Rate.all_objects.create(name='Old', value=2, currency=currency, is_deleted=True)
+        response = self.client.get('/api/v1/core/currency/{uuid}/'.format(uuid=currency.pk))
+        self.assertEqual(response.data['rates'], [rate.pk])
+
+
+class BulkSoftDeleteTest(QueryBudgetMixin, APITestCase):
+    """
+        bulk destroy and recover change the matching objects only, with a fixed number of queries
+    """
+    url = '/api/v1/core/company-category/bulk/'
+
+    def setUp(self):
+        self.categories = [CompanyCategory.objects.create(name='Category {index}'.format(index=index))
+                           for index in range(10)]
+
+    def test_is_deleted_alone_is_not_a_filter(self):
+        response = self.client.delete(self.url + '?is_deleted=false')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(CompanyCategory.objects.count(), 10)
+
+    def test_uuids_must_be_a_list(self):
+        response = self.client.delete(self.url, {'uuids': self.categories[0].pk}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(CompanyCategory.objects.count(), 10)
+
+    def test_dry_run(self):
+        uuids = [category.pk for category in self.categories[:3]]
+        response = self.client.delete(self.url + '?dry_run=true', {'uuids': uuids}, format='json')
+        self.assertEqual(response.data, {'dry_run': True, 'count': 3})
+        self.assertEqual(CompanyCategory.objects.count(), 10)
+
+    def test_destroy_and_recover(self):
+        uuids = [category.pk for category in self.categories[:5]]
+        with self.assertMaxQueries(8):
+            response = self.client.delete(self.url, {'uuids': uuids}, format='json')
+        self.assertEqual(response.data['count'], 5)
+        self.assertEqual(CompanyCategory.objects.count(), 5)
+
+        response = self.client.post('/api/v1/core/company-category/recover/', {'uuids': uuids[:2]}, format='json')
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(CompanyCategory.objects.count(), 7)
+
+
+class UOMConverterTest(TestCase):
+    """
+        units of one category tree convert into each other, results are rounded to the precision of the target unit
+    """
+    def setUp(self):
+        volume = UOMCategory.objects.create(name='Volume', description='Volume')
+        small = UOMCategory.objects.create(name='Small Volume', description='Small Volume', parent=volume)
+        self.litre = UnitOfMeasurement.objects.create(name='Litre', symbol='l', uom_category=volume,
+                                                      rounding_precision=2)
+        self.millilitre = UnitOfMeasurement.objects.create(name='Millilitre', symbol='ml', uom_category=small,
+                                                           factor=1000, rounding_precision=0)
+        self.cubic_metre = UnitOfMeasurement.objects.create(name='Cubic Metre', symbol='m3', uom_category=volume,
+                                                            rate=1000, rounding_precision=3)
+        weight = UOMCategory.objects.create(name='Weight', description='Weight')
+        self.kilogram = UnitOfMeasurement.objects.create(name='Kilogram', symbol='kg', uom_category=weight)
+        self.converter = UOMConverter()
+
+    def test_conversion_matrix(self):
+        #quantity of 1 unit of each row unit in each column unit
+        units = (self.litre, self.millilitre, self.cubic_metre)
+        expected = ((1, 1000, 0.001),
+                    (0.001, 1, 0.0),
+                    (1000, 1000000, 1))
+        for unit, row in zip(units, expected):
+            for other_unit, quantity in zip(units, row):
+                self.assertAlmostEqual(self.converter.convert(1, unit.pk, other_unit.pk), quantity)
+
+    def test_same_unit_is_rounded(self):
+        self.assertEqual(self.converter.convert(1.23456, self.litre.pk, self.litre.pk), 1.23)
+        self.assertEqual(self.converter.convert(1.23456, self.litre.pk, self.litre.pk, rounded=False), 1.23456)
+        self.assertEqual(self.converter.convert(2.5, self.millilitre.pk, self.litre.pk), 0.0)
+
+    def test_convert_array(self):
+        converted = self.converter.convert_array([1, 500, 0.002], [self.litre.pk, self.millilitre.pk,
+                                                                  self.cubic_metre.pk], self.litre.pk)
+        self.assertEqual(list(converted), [1.0, 0.5, 2.0])
+
+    def test_units_of_other_trees_are_refused(self):
+        self.assertRaises(UOMConversionError, self.converter.convert, 1, self.kilogram.pk, self.litre.pk)
+        self.assertRaises(UOMConversionError, self.converter.get_factors, [self.kilogram.pk, self.litre.pk])
+
+    def test_reference_round_trip(self):
+        reference = self.converter.to_reference_array([250, 2], [self.millilitre.pk, self.litre.pk])
+        self.assertEqual(list(reference), [0.25, 2.0])
+        self.assertAlmostEqual(self.converter.from_reference(reference.sum(), self.millilitre.pk), 2250)
+
+
+class TemperatureConverterTest(TestCase):
+    """
+        temperature scales are converted with their offsets, units defined by a factor of a scale are refused
+    """
+    def setUp(self):
+        category = UOMCategory.objects.create(name='Temperature', description='Temperature')
+        self.celsius = UnitOfMeasurement.objects.create(name='Celsius', symbol='C', uom_category=category)
+        self.fahrenheit = UnitOfMeasurement.objects.create(name='Degree Fahrenheit', symbol='F',
+                                                           uom_category=category, factor=1.8)
+        self.kelvin = UnitOfMeasurement.objects.create(name='Kelvin', symbol='K', uom_category=category)
+        self.decicelsius = UnitOfMeasurement.objects.create(name='Decicelsius', symbol='dC', uom_category=category,
+                                                            factor=10)
+        self.converter = TemperatureConverter()
+
+    def test_scales(self):
+        self.assertAlmostEqual(self.converter.convert(46.4, self.fahrenheit.pk, self.celsius.pk), 8.0)
+        self.assertAlmostEqual(self.converter.convert(-40, self.celsius.pk, self.fahrenheit.pk), -40.0)
+        self.assertAlmostEqual(self.converter.convert(0, self.kelvin.pk, self.celsius.pk), -273.15)
+        converted = self.converter.convert_array([5.0, 41.0, 278.15], [self.celsius.pk, self.fahrenheit.pk,
+                                                                       self.kelvin.pk], self.celsius.pk)
+        for temperature in converted:
+            self.assertAlmostEqual(temperature, 5.0)
 
-# Create your tests here.
+    def test_factor_units_of_scales_are_refused(self):
+        self.assertRaises(UOMConversionError, self.converter.convert, 50, self.decicelsius.pk, self.fahrenheit.pk)
+        self.assertRaises(UOMConversionError, self.converter.convert, 50, self.decicelsius.pk, self.celsius.pk)
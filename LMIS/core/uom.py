@@ -0,0 +1,258 @@
+"""
+    core/uom.py converts quantities between units of measurement.
+
+    UnitOfMeasurement.factor is the number of units in one reference unit of its category, e.g a dozen has factor
+    1/12 in a category whose reference unit is "Unit". rate is the inverse of factor and is used when factor is not
+    set, a unit with neither is a reference unit. units can be converted into each other when their categories are in
+    the same UOMCategory tree.
+
+    the conversion matrix of each category tree is worked out once and kept in the cache under the versions of the
+    UnitOfMeasurement and UOMCategory models, saving either model bumps its version which invalidates the matrices.
+
+    factors can not convert Celsius, Fahrenheit and Kelvin into each other, those scales differ by an offset too.
+    TemperatureConverter recognises them by their symbol or name and converts them with their formulas.
+"""
+
+#import core python modules
+import re
+
+#import core django modules
+from django.core.cache import cache
+
+#import external modules
+import numpy
+
+#import project modules
+from core.cache import get_model_version, get_cache_timeout
+from core.models import UnitOfMeasurement, UOMCategory
+
+
+class UOMConversionError(ValueError):
+    """
+        raised when a quantity can not be converted, e.g between units of different categories
+    """
+    pass
+
+
+def get_factor(factor, rate):
+    if factor:
+        return float(factor)
+    if rate:
+        return 1.0 / float(rate)
+    return 1.0
+
+
+class ConversionMatrix(object):
+    """
+        conversion matrix of the units of one UOMCategory tree.
+
+        units: list of unit ids, index: {unit id: position in units}
+        factors: numpy array of the unit factors, matrix[i, j] is the number of units j in one unit i
+        precisions: numpy array of the unit rounding precisions, -1 if the unit is not rounded
+    """
+    def __init__(self, category_id, units):
+        self.category_id = category_id
+        self.units = [str(unit_id) for unit_id, factor, rate, precision in units]
+        self.index = dict((unit_id, position) for position, unit_id in enumerate(self.units))
+        self.factors = numpy.array([get_factor(factor, rate) for unit_id, factor, rate, precision in units])
+        self.precisions = numpy.array([-1 if precision is None else precision
+                                       for unit_id, factor, rate, precision in units])
+        self.matrix = self.factors[numpy.newaxis, :] / self.factors[:, numpy.newaxis]
+
+
+class UOMConverter(object):
+    """
+        converts quantities with the conversion matrices that are current when the converter is created, create one
+        per request or job and use it for all its conversions. e.g
+
+            converter = UOMConverter()
+            converter.convert(2, dozen_id, unit_id)                            # 24.0
+            converter.convert_array(quantities, uom_ids, kilogram_id)         # numpy array in kilograms
+    """
+    def __init__(self):
+        self.version = (get_model_version(UnitOfMeasurement)[0], get_model_version(UOMCategory)[0])
+        self.families = self.get_cached('families', self.load_families)
+        self.matrices = {}
+
+    def get_cached(self, name, load):
+        key = 'lmis:uom:{name}:{uom_version}:{category_version}'.format(name=name, uom_version=self.version[0],
+                                                                        category_version=self.version[1])
+        value = cache.get(key)
+        if value is None:
+            value = load()
+            cache.set(key, value, get_cache_timeout())
+        return value
+
+    def load_families(self):
+        """
+            returns dict of {unit id: id of the root category of the unit category tree}
+        """
+        roots = dict(UOMCategory.objects.filter(level=0).values_list('tree_id', 'pk'))
+        return dict((str(unit_id), roots.get(tree_id)) for unit_id, tree_id in
+                    UnitOfMeasurement.objects.values_list('pk', 'uom_category__tree_id'))
+
+    def get_matrix(self, unit_id):
+        """
+            returns the ConversionMatrix of the category tree of the given unit
+        """
+        unit_id = str(unit_id)
+        if unit_id not in self.families:
+            raise UOMConversionError('Unknown unit of measurement {unit}.'.format(unit=unit_id))
+        category_id = self.families[unit_id]
+        if category_id not in self.matrices:
+            self.matrices[category_id] = self.get_cached('matrix:{category}'.format(category=category_id),
+                                                         lambda: self.load_matrix(category_id))
+        return self.matrices[category_id]
+
+    def load_matrix(self, category_id):
+        units = [unit_id for unit_id, family in self.families.items() if family == category_id]
+        return ConversionMatrix(category_id, list(UnitOfMeasurement.objects.filter(pk__in=units).order_by('pk')
+                                                  .values_list('pk', 'factor', 'rate', 'rounding_precision')))
+
+    def convert(self, quantity, from_unit_id, to_unit_id, rounded=True):
+        """
+            returns quantity in from_unit_id units converted to to_unit_id units, rounded like convert_array() even
+            when both units are the same.
+        """
+        return float(self.convert_array(numpy.array([quantity]), [from_unit_id], to_unit_id, rounded)[0])
+
+    def convert_array(self, quantities, from_unit_ids, to_unit_id, rounded=True):
+        """
+            returns numpy array of quantities converted to to_unit_id units, from_unit_ids is the unit of each
+            quantity. the units are looked up once per distinct unit, the conversion itself is one array operation.
+
+            if rounded is True results are rounded to the rounding precision of to_unit_id.
+        """
+        quantities = numpy.asarray(quantities, dtype=numpy.float64)
+        matrix = self.get_matrix(to_unit_id)
+        units, inverse = numpy.unique(numpy.asarray(from_unit_ids, dtype=object).astype(str), return_inverse=True)
+        positions = []
+        for unit_id in units:
+            if unit_id not in matrix.index:
+                raise UOMConversionError('Can not convert {from_unit} to {to_unit}.'.format(from_unit=unit_id,
+                                                                                           to_unit=to_unit_id))
+            positions.append(matrix.index[unit_id])
+        to_position = matrix.index[str(to_unit_id)]
+        ratios = matrix.matrix[numpy.array(positions, dtype=numpy.intp), to_position]
+        converted = quantities * ratios[inverse.reshape(-1)]
+        precision = matrix.precisions[to_position]
+        if rounded and precision >= 0:
+            converted = numpy.round(converted, int(precision))
+        return converted
+
+    def get_factors(self, unit_ids):
+        """
+            returns numpy array of the factors of the given units, every unit has to be of one category tree.
+        """
+        units, inverse = numpy.unique(numpy.asarray(unit_ids, dtype=object).astype(str), return_inverse=True)
+        if not len(units):
+            return numpy.zeros(0)
+        matrix = self.get_matrix(units[0])
+        factors = []
+        for unit_id in units:
+            if unit_id not in matrix.index:
+                raise UOMConversionError('Units {unit} and {other_unit} are not of one category.'.format(
+                    unit=unit_id, other_unit=units[0]))
+            factors.append(matrix.factors[matrix.index[unit_id]])
+        return numpy.array(factors)[inverse.reshape(-1)]
+
+    def to_reference_array(self, quantities, unit_ids):
+        """
+            returns numpy array of quantities converted to the reference unit of the category tree of their units, so
+            that quantities in e.g litres and cubic metres can be added up and converted back with from_reference().
+        """
+        return numpy.asarray(quantities, dtype=numpy.float64) / self.get_factors(unit_ids)
+
+    def from_reference(self, quantity, unit_id):
+        """
+            returns quantity in the reference unit of the category tree of unit_id converted to unit_id units
+        """
+        return quantity * float(self.get_factors([unit_id])[0])
+
+
+#temperature scales as (factor, offset) of kelvin = temperature * factor + offset
+TEMPERATURE_SCALES = {
+    'celsius': (1.0, 273.15),
+    'fahrenheit': (5.0 / 9.0, 273.15 - 32.0 * 5.0 / 9.0),
+    'kelvin': (1.0, 0.0),
+}
+
+#symbols and names of temperature scales once spaces, degree signs and "deg"/"degree(s)" are taken out
+TEMPERATURE_SCALE_NAMES = {
+    'c': 'celsius', 'celsius': 'celsius', 'centigrade': 'celsius',
+    'f': 'fahrenheit', 'fahrenheit': 'fahrenheit',
+    'k': 'kelvin', 'kelvin': 'kelvin',
+}
+
+TEMPERATURE_NAME_NOISE = re.compile(u'[\\s\u00b0\u00ba_.-]|degrees?|deg')
+
+
+def get_temperature_scale(symbol, name):
+    """
+        returns TEMPERATURE_SCALES key of a unit of measurement or None if it is not a temperature scale
+    """
+    for value in (symbol, name):
+        scale = TEMPERATURE_SCALE_NAMES.get(TEMPERATURE_NAME_NOISE.sub('', (value or '').lower()))
+        if scale is not None:
+            return scale
+    return None
+
+
+class TemperatureConverter(object):
+    """
+        converts temperatures, Celsius, Fahrenheit and Kelvin are converted into each other with their formulas and
+        other units with UOMConverter factors. converting between a temperature scale and a unit that is not one,
+        e.g a unit defined by a factor of Celsius, is refused since the factor would leave out the offset. e.g
+
+            converter = TemperatureConverter()
+            converter.convert(46.4, fahrenheit_id, celsius_id)                   # 8.0
+    """
+    def __init__(self, converter=None):
+        self.converter = converter or UOMConverter()
+        self.scales = self.converter.get_cached('temperature_scales', self.load_scales)
+
+    def load_scales(self):
+        """
+            returns dict of {unit id: TEMPERATURE_SCALES key} of the units that are temperature scales
+        """
+        scales = {}
+        for unit_id, symbol, name in UnitOfMeasurement.objects.values_list('pk', 'symbol', 'name'):
+            scale = get_temperature_scale(symbol, name)
+            if scale is not None:
+                scales[str(unit_id)] = scale
+        return scales
+
+    def convert(self, temperature, from_unit_id, to_unit_id):
+        return float(self.convert_array(numpy.array([temperature]), [from_unit_id], to_unit_id)[0])
+
+    def convert_array(self, temperatures, from_unit_ids, to_unit_id):
+        """
+            returns numpy array of temperatures converted to to_unit_id units, from_unit_ids is the unit of each
+            temperature. results are not rounded, temperatures are returned as they are when to_unit_id is None.
+        """
+        temperatures = numpy.asarray(temperatures, dtype=numpy.float64)
+        if to_unit_id is None or not len(temperatures):
+            return temperatures
+        to_unit_id = str(to_unit_id)
+        to_scale = self.scales.get(to_unit_id)
+        units, inverse = numpy.unique(numpy.asarray(from_unit_ids, dtype=object).astype(str), return_inverse=True)
+        inverse = inverse.reshape(-1)
+        converted = numpy.empty_like(temperatures)
+        for position, unit_id in enumerate(units):
+            selected = inverse == position
+            values = temperatures[selected]
+            scale = self.scales.get(unit_id)
+            if unit_id == to_unit_id:
+                pass
+            elif scale is not None and to_scale is not None:
+                factor, offset = TEMPERATURE_SCALES[scale]
+                to_factor, to_offset = TEMPERATURE_SCALES[to_scale]
+                values = (values * factor + offset - to_offset) / to_factor
+            elif scale is not None or to_scale is not None:
+                raise UOMConversionError('Can not convert temperatures in {from_unit} to {to_unit}, only Celsius, '
+                                         'Fahrenheit and Kelvin are converted into each other.'.format(
+                                             from_unit=unit_id, to_unit=to_unit_id))
+            else:
+                values = self.converter.convert_array(values, [unit_id] * len(values), to_unit_id, rounded=False)
+            converted[selected] = values
+        return converted
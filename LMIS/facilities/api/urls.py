@@ -1,13 +1,13 @@
 #import core Django modules
 from django.conf.urls import patterns, url, include
 
-#import external modules
-from rest_framework import routers
+#import LMIS project modules
+from core.api.routers import BaseModelRouter
 
 #import LMIS modules
 from . import views
 
-router = routers.DefaultRouter()
+router = BaseModelRouter()
 router.register(r'facility-supported-program-product', views.FacilitySupportedProgramProductViewSet)
 router.register(r'supervisory-node', views.SupervisoryNodeViewSet)
 router.register(r'order-group', views.OrderGroupViewSet)
@@ -1,3 +1,45 @@
-from django.test import TestCase
+#import core django modules
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
-# Create your tests here.
+#import external modules
+from rest_framework.test import APITestCase
+
+#import project modules
+from core.testing import QueryBudgetMixin
+from facilities.models import FacilitySupportedProgram
+from inventory.tests import create_facility
+from partners.models import Program
+
+
+class FacilitySupportedProgramApiTest(QueryBudgetMixin, APITestCase):
+    """
+        related facilities and programs are loaded with the rows, listing more rows does not take more queries
+    """
+    url = '/api/v1/facilities/facility-supported-program/'
+
+    def create_rows(self, start, count):
+        return [FacilitySupportedProgram.objects.create(
+            facility=create_facility('F{index}'.format(index=index)), active=True,
+            program=Program.objects.create(code='P{index}'.format(index=index),
+                                           name='Program {index}'.format(index=index), active=True))
+            for index in range(start, start + count)]
+
+    def test_list_query_count_does_not_grow(self):
+        self.create_rows(0, 2)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url)
+        self.create_rows(2, 20)
+        with self.assertMaxQueries(len(queries)):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 22)
+
+    def test_sparse_fields_and_soft_deleted_rows(self):
+        kept, deleted = self.create_rows(0, 2)
+        deleted.is_deleted = True
+        deleted.save()
+        response = self.client.get(self.url, {'fields': 'uuid,program'})
+        self.assertEqual(response.data, [{'uuid': kept.pk, 'program': kept.program.pk}])
+        response = self.client.get(self.url, {'is_deleted': 'True'})
+        self.assertEqual([row['uuid'] for row in response.data], [deleted.pk])
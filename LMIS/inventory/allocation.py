@@ -0,0 +1,96 @@
+"""
+    inventory/allocation.py fills requested product quantities from the batches (product items) on hand at a storage
+    location first-expiry-first-out (FEFO) and drafts the OutgoingShipmentLine rows that pick them.
+"""
+
+#import core python modules
+import heapq
+
+#import core django modules
+from django.utils import timezone
+
+#import project modules
+from core.models import VVMStage
+from inventory.models import StockBalance, IncomingShipmentLine, OutgoingShipmentLine
+
+
+#issue order of usable VVM stages, stage 2 batches are closer to their discard point so they go before stage 1
+#batches. batches at stage 3 or 4 must not be used and are never issued.
+VVM_STAGE_RANKS = {VVMStage.STAGES.stage_two: 0, VVMStage.STAGES.stage_one: 1}
+UNUSABLE_VVM_STAGES = (VVMStage.STAGES.stage_three, VVMStage.STAGES.stage_four)
+
+
+def get_vvm_stages(storage_location_id, product_item_ids):
+    """
+        returns dict of {product item id: VVM stage} of the stage last recorded for each product item received at the
+        storage location.
+    """
+    lines = IncomingShipmentLine.objects.filter(incoming_shipment__input_warehouse=storage_location_id,
+                                                incoming_shipment__is_deleted=False, product_item__in=product_item_ids,
+                                                vvm_stage__isnull=False)
+    return dict(lines.order_by('incoming_shipment__received_at', 'created').values_list('product_item', 'vvm_stage'))
+
+
+def get_batch_heaps(storage_location_id, product_ids, program_id=None, use_vvm_stage=False, today=None):
+    """
+        returns dict of {product id: heap of on hand batches}, heaps are ordered by expiration date, or by VVM stage
+        then expiration date, so the batch to issue next is always heap[0]. expired batches and batches last seen at
+        VVM stage 3 or 4 are left out.
+    """
+    today = today or timezone.now().date()
+    balances = StockBalance.objects.filter(storage_location=storage_location_id, quantity__gt=0,
+                                           product_item__product__in=product_ids,
+                                           product_item__expiration_date__gte=today)
+    if program_id is not None:
+        balances = balances.filter(program=program_id)
+    rows = list(balances.values_list('product_item', 'product_item__product', 'product_item__product__base_uom',
+                                     'product_item__expiration_date', 'product_item__batch_no', 'program',
+                                     'quantity'))
+    stages = get_vvm_stages(storage_location_id, set(row[0] for row in rows))
+
+    heaps = {}
+    for product_item_id, product_id, uom_id, expiration_date, batch_no, balance_program_id, quantity in rows:
+        stage = stages.get(product_item_id)
+        if stage in UNUSABLE_VVM_STAGES:
+            continue
+        #batches without a recorded stage sort last
+        vvm_key = VVM_STAGE_RANKS.get(stage, len(VVM_STAGE_RANKS)) if use_vvm_stage else 0
+        entry = (vvm_key, expiration_date, batch_no, str(product_item_id), str(balance_program_id),
+                 (product_item_id, balance_program_id, uom_id, quantity))
+        heaps.setdefault(product_id, []).append(entry)
+    for heap in heaps.values():
+        heapq.heapify(heap)
+    return heaps
+
+
+def allocate_fefo(storage_location_id, requested, program_id=None, use_vvm_stage=False, outgoing_shipment=None):
+    """
+        allocates requested dict of {product id: quantity} from batches on hand at the storage location and returns
+        tuple of (lines, shortfalls).
+
+        lines: unsaved OutgoingShipmentLine drafts with quantity_before and quantity_after set from the balances.
+        shortfalls: dict of {product id: quantity that could not be allocated}.
+
+        balances are read with one query and each product is filled from a heap of its batches, so allocation cost
+        grows with the number of batches picked and not with the stock held at the location. requested quantities
+        have to be positive, ValueError is raised otherwise.
+    """
+    invalid = [product_id for product_id, quantity in requested.items() if quantity <= 0]
+    if invalid:
+        raise ValueError('Requested quantities have to be positive: {products}'.format(products=', '.join(
+            str(product_id) for product_id in invalid)))
+    heaps = get_batch_heaps(storage_location_id, list(requested), program_id, use_vvm_stage)
+    lines, shortfalls = [], {}
+    for product_id, quantity in requested.items():
+        heap = heaps.get(product_id, [])
+        while quantity > 0 and heap:
+            product_item_id, balance_program_id, uom_id, balance = heapq.heappop(heap)[-1]
+            issued = min(quantity, balance)
+            lines.append(OutgoingShipmentLine(outgoing_shipment=outgoing_shipment, product_item_id=product_item_id,
+                                              program_id=balance_program_id, quantity_uom_id=uom_id,
+                                              quantity_issued=issued, quantity_before=balance,
+                                              quantity_after=balance - issued))
+            quantity -= issued
+        if quantity > 0:
+            shortfalls[product_id] = quantity
+    return lines, shortfalls
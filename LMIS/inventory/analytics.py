@@ -0,0 +1,145 @@
+"""
+    inventory/analytics.py works out consumption rates per facility and product from ConsumptionRecordLine rows.
+    a record has one line per batch (product item), lines are added up per record and product before records are
+    grouped per facility and product.
+
+    lines are read in columnar form with values_list() and every facility and product is computed at once with
+    NumPy group-by sums (bincount), so the cost is one query plus a few array passes however many facilities there
+    are.
+"""
+
+#import external modules
+import numpy
+
+#import project modules
+from inventory.models import ConsumptionRecordLine
+
+
+#average number of days in a month
+DAYS_PER_MONTH = 365.25 / 12
+
+COLUMNS = ('consumption_record', 'consumption_record__facility', 'product_item__product', 'consumption_record__start_date',
+           'consumption_record__end_date', 'quantity_used', 'total_discarded', 'current_balance')
+
+
+def get_consumption_columns(facility_ids=None, product_ids=None, since=None, until=None):
+    """
+        returns dict of {column name: numpy array} of consumption record lines matching the given filters.
+    """
+    lines = ConsumptionRecordLine.objects.filter(consumption_record__is_deleted=False)
+    if facility_ids is not None:
+        lines = lines.filter(consumption_record__facility__in=facility_ids)
+    if product_ids is not None:
+        lines = lines.filter(product_item__product__in=product_ids)
+    if since is not None:
+        lines = lines.filter(consumption_record__end_date__gte=since)
+    if until is not None:
+        lines = lines.filter(consumption_record__start_date__lte=until)
+
+    rows = list(lines.values_list(*COLUMNS))
+    columns = list(zip(*rows)) if rows else [()] * len(COLUMNS)
+    record, facility, product, start, end, used, discarded, balance = columns
+    return {
+        'record': numpy.array(record, dtype=object),
+        'facility': numpy.array(facility, dtype=object),
+        'product': numpy.array(product, dtype=object),
+        'start': numpy.array(start, dtype='datetime64[D]'),
+        'end': numpy.array(end, dtype='datetime64[D]'),
+        'used': numpy.array(used, dtype=numpy.float64),
+        'discarded': numpy.array(discarded, dtype=numpy.float64),
+        'balance': numpy.array(balance, dtype=numpy.float64),
+    }
+
+
+def group_sum(groups, values, count):
+    return numpy.bincount(groups, weights=values, minlength=count)
+
+
+def sum_per_record(columns):
+    """
+        returns columns with one row per (consumption record, product): used, discarded and balance of the lines of
+        every batch of a product in a record added up, so each record counts its days and its consumption once and
+        the balance is that of the product and not of one of its batches.
+    """
+    record_codes = numpy.unique(columns['record'].astype(str), return_inverse=True)[1]
+    product_keys, product_codes = numpy.unique(columns['product'].astype(str), return_inverse=True)
+    _, first, rows = numpy.unique(record_codes * len(product_keys) + product_codes, return_index=True,
+                                  return_inverse=True)
+    summed = dict((name, columns[name][first]) for name in ('record', 'facility', 'product', 'start', 'end'))
+    for name in ('used', 'discarded', 'balance'):
+        summed[name] = group_sum(rows, columns[name], len(first))
+    return summed
+
+
+def compute_consumption_rates(columns):
+    """
+        returns list of dicts, one per (facility, product), with:
+
+            months: number of months covered by the records
+            total_used, total_discarded: quantities over the whole range
+            wastage_rate: discarded / (used + discarded)
+            amc: average monthly consumption, total used / months covered
+            trend: change of the monthly consumption per month, the least squares slope of each record's monthly
+                   consumption against its mid date
+            current_balance: current balance of the latest record
+            days_of_stock: current balance / average daily consumption, None if nothing was consumed
+
+        columns hold one row per record line, see get_consumption_columns().
+    """
+    if not len(columns['used']):
+        return []
+    columns = sum_per_record(columns)
+
+    facility_keys, facility_codes = numpy.unique(columns['facility'].astype(str), return_inverse=True)
+    product_keys, product_codes = numpy.unique(columns['product'].astype(str), return_inverse=True)
+    group_keys, groups = numpy.unique(facility_codes * len(product_keys) + product_codes, return_inverse=True)
+    count = len(group_keys)
+
+    days = (columns['end'] - columns['start']).astype(numpy.int64).astype(numpy.float64) + 1
+    used, discarded = columns['used'], columns['discarded']
+    total_days = group_sum(groups, days, count)
+    total_used = group_sum(groups, used, count)
+    total_discarded = group_sum(groups, discarded, count)
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        daily = total_used / total_days
+        wastage = numpy.where(total_used + total_discarded > 0,
+                              total_discarded / (total_used + total_discarded), 0.0)
+
+        #least squares slope of monthly consumption (y) against mid date in months (x), per group
+        x = (columns['start'].astype(numpy.int64) + (days - 1) / 2) / DAYS_PER_MONTH
+        y = used / days * DAYS_PER_MONTH
+        n = numpy.bincount(groups, minlength=count).astype(numpy.float64)
+        x = x - (group_sum(groups, x, count) / n)[groups]
+        sxx = group_sum(groups, x * x, count)
+        trend = numpy.where(sxx > 0, group_sum(groups, x * y, count) / sxx, 0.0)
+
+    #current balance of the last record of each group: sort by (group, end date) and take the last row per group
+    order = numpy.lexsort((columns['end'].astype(numpy.int64), groups))
+    last = order[numpy.r_[numpy.nonzero(numpy.diff(groups[order]))[0], len(order) - 1]]
+    balance = numpy.zeros(count)
+    balance[groups[last]] = columns['balance'][last]
+
+    results = []
+    for index, key in enumerate(group_keys):
+        results.append({
+            'facility': facility_keys[key // len(product_keys)],
+            'product': product_keys[key % len(product_keys)],
+            'months': round(total_days[index] / DAYS_PER_MONTH, 2),
+            'total_used': total_used[index],
+            'total_discarded': total_discarded[index],
+            'wastage_rate': round(wastage[index], 4),
+            'amc': round(daily[index] * DAYS_PER_MONTH, 2),
+            'trend': round(trend[index], 2),
+            'current_balance': balance[index],
+            'days_of_stock': round(balance[index] / daily[index], 1) if daily[index] > 0 else None,
+        })
+    return results
+
+
+def get_consumption_rates(facility_ids=None, product_ids=None, since=None, until=None):
+    """
+        returns consumption rates of every facility and product with records in the given range, see
+        compute_consumption_rates()
+    """
+    return compute_consumption_rates(get_consumption_columns(facility_ids, product_ids, since, until))
@@ -5,7 +5,8 @@
 #import LMIS project modules
 from core.api.serializers import BaseModelSerializer
 from inventory.models import (Inventory, InventoryLine, ConsumptionRecord, ConsumptionRecordLine, IncomingShipment,
-                              IncomingShipmentLine, OutgoingShipment, OutgoingShipmentLine)
+                              IncomingShipmentLine, OutgoingShipment, OutgoingShipmentLine, StockBalance,
+                              PhysicalStockCount, PhysicalStockCountLine)
 
 
 class InventoryLineSerializer(BaseModelSerializer):
@@ -47,8 +48,10 @@ class IncomingShipmentSerializer(BaseModelSerializer):
     """
     class Meta:
         model = IncomingShipment
-        fields = ('supplier', 'stock_entry_type', 'input_warehouse', 'other', 'other_source', 'is_deleted',
-                  'incoming_shipment_lines',)
+        fields = ('supplier', 'stock_entry_type', 'input_warehouse', 'other', 'other_source', 'received_at',
+                  'is_deleted', 'incoming_shipment_lines',)
+        #lines are written as nested objects, see StockDocumentViewSet
+        read_only_fields = ('incoming_shipment_lines',)
 
 
 class IncomingShipmentLineSerializer(BaseModelSerializer):
@@ -65,7 +68,9 @@ class OutgoingShipmentSerializer(BaseModelSerializer):
     """
     class Meta:
         model = OutgoingShipment
-        fields = ('recipient', 'output_warehouse', 'status', 'is_deleted', 'outgoing_shipment_lines')
+        fields = ('recipient', 'output_warehouse', 'status', 'shipped_at', 'is_deleted', 'outgoing_shipment_lines')
+        #status is changed via the transition end-point, lines are written as nested objects
+        read_only_fields = ('status', 'outgoing_shipment_lines')
 
 
 class OutgoingShipmentLineSerializer(BaseModelSerializer):
@@ -73,4 +78,31 @@ class OutgoingShipmentLineSerializer(BaseModelSerializer):
         OutgoingShipmentLineSerializer is used by the API end-points to serialize OutgoingShipmentLine records
     """
     class Meta:
-        model = OutgoingShipmentLine
\ No newline at end of file
+        model = OutgoingShipmentLine
+        #worked out on the server when the shipment is assigned or done
+        read_only_fields = ('quantity_before', 'quantity_after')
+
+
+class StockBalanceSerializer(BaseModelSerializer):
+    """
+        StockBalanceSerializer is used by the API end-point to serialize stock on hand balances
+    """
+    class Meta:
+        model = StockBalance
+        fields = ('uuid', 'storage_location', 'product_item', 'program', 'quantity', 'modified')
+
+
+class PhysicalStockCountSerializer(BaseModelSerializer):
+    """
+        PhysicalStockCountSerializer is used by the API end-point to serialize PhysicalStockCount records
+    """
+    class Meta:
+        model = PhysicalStockCount
+
+
+class PhysicalStockCountLineSerializer(BaseModelSerializer):
+    """
+        PhysicalStockCountLineSerializer is used by the API end-point to serialize PhysicalStockCountLine records
+    """
+    class Meta:
+        model = PhysicalStockCountLine
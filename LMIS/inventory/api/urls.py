@@ -5,13 +5,13 @@
 #import core Django modules
 from django.conf.urls import patterns, url, include
 
-#import external modules
-from rest_framework import routers
+#import LMIS project modules
+from core.api.routers import BaseModelRouter
 
 #create core REST API routers
 from . import views
 
-router = routers.DefaultRouter()
+router = BaseModelRouter()
 router.register(r'^inventory', views.InventoryViewSet)
 router.register(r'^inventory-lines', views.InventoryLineViewSet)
 router.register(r'consumption-record', views.ConsumptionRecordViewSet)
@@ -20,8 +20,13 @@ router.register(r'incoming-shipment', views.IncomingShipmentViewSet)
 router.register(r'incoming-shipment-line', views.IncomingShipmentLineViewSet)
 router.register(r'outgoing-shipment', views.OutgoingShipmentViewSet)
 router.register(r'outgoing-shipment-line', views.OutgoingShipmentLineViewSet)
+router.register(r'stock-balance', views.StockBalanceViewSet)
+router.register(r'physical-stock-count', views.PhysicalStockCountViewSet)
+router.register(r'physical-stock-count-line', views.PhysicalStockCountLineViewSet)
 
 # Wire up our API using automatic URL routing.
 urlpatterns = patterns('',
     url(r'^', include(router.urls)),
+    url(r'^consumption-analytics/$', views.ConsumptionAnalyticsView.as_view()),
+    url(r'^storage-capacity/$', views.StorageCapacityView.as_view()),
 )
\ No newline at end of file
@@ -2,13 +2,39 @@
     This module hold Inventory App API view end-point and the view set
 """
 
+#import core python modules
+import uuid as uuid_module
+
+#import core django modules
+from django.conf import settings
+from django.db import transaction
+from django.utils import six, timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.encoding import smart_text
+
+#import external modules
+from rest_framework import status, views
+from rest_framework.decorators import action
+from rest_framework.exceptions import ParseError
+from rest_framework.response import Response
+
 #import LMIS project modules
+from cce.models import StorageLocation
 from core.api.views import BaseModelViewSet
+from core.uom import UOMConversionError
+from inventory.allocation import allocate_fefo
+from inventory.analytics import get_consumption_rates
+from inventory.capacity import CapacityTree, check_shipment_fits
+from inventory.ledger import get_stock_balances_as_of
+from inventory.posting import transition_outgoing_shipment, PostingError
+from inventory.reconciliation import reconcile_physical_stock_count, ReconciliationError
 from inventory.models import (Inventory, InventoryLine, ConsumptionRecord, ConsumptionRecordLine, IncomingShipment,
-                              IncomingShipmentLine, OutgoingShipment, OutgoingShipmentLine)
+                              IncomingShipmentLine, OutgoingShipment, OutgoingShipmentLine, StockBalance,
+                              PhysicalStockCount, PhysicalStockCountLine, negate_movements)
 from .serializers import (InventorySerializer, InventoryLineSerializer, ConsumptionRecordSerializer,
                           ConsumptionRecordLineSerializer, IncomingShipmentSerializer, IncomingShipmentLineSerializer,
-                          OutgoingShipmentSerializer, OutgoingShipmentLineSerializer)
+                          OutgoingShipmentSerializer, OutgoingShipmentLineSerializer, StockBalanceSerializer,
+                          PhysicalStockCountSerializer, PhysicalStockCountLineSerializer)
 
 
 class InventoryViewSet(BaseModelViewSet):
@@ -43,33 +69,514 @@ class ConsumptionRecordLineViewSet(BaseModelViewSet):
     serializer_class = ConsumptionRecordLineSerializer
 
 
-class IncomingShipmentViewSet(BaseModelViewSet):
+class StockDocumentViewSet(BaseModelViewSet):
+    """
+        Base API end-point for shipments, a shipment and all its lines can be created or updated in one request by
+        sending the lines as a list of objects in the document lines field e.g
+
+            {"supplier": "<uuid>", ..., "incoming_shipment_lines": [{"product_item": "<uuid>", "quantity": 10}, ..]}
+
+        the lines are validated together, related objects they refer to e.g units of measurement are loaded once per
+        batch, new lines are inserted with one bulk insert and everything is saved in one transaction. lines of the
+        document left out of a PUT are deleted, a PATCH leaves them alone.
+
+        requests that send line uuids in the lines field, as before, are handled by BaseModelViewSet.
+    """
+    line_serializer_class = None
+
+    def get_lines_field(self):
+        return self.get_view_model_class().lines_field
+
+    def get_nested_lines(self, request):
+        """
+            returns list of line objects sent in the request or None if the request does not write nested lines
+        """
+        if not isinstance(request.DATA, dict):
+            return None
+        lines = request.DATA.get(self.get_lines_field())
+        if isinstance(lines, list) and lines and all(isinstance(line, dict) for line in lines):
+            return lines
+        return None
+
+    def can_change_lines(self, document):
+        return True
+
+    def check_document(self, request, document, header, lines, partial):
+        """
+            returns an error Response if the validated document and lines can not be saved or None if they can.
+            document is the saved document being updated or None, header and lines are the unsaved new versions.
+        """
+        return None
+
+    def update_objects(self, model, objs):
+        """
+            documents are saved one at a time in bulk updates, save() posts the lines again when a document is moved,
+            redated or deleted, see StockDocument.save().
+        """
+        for obj in objs:
+            obj.save()
+
+    def create(self, request, *args, **kwargs):
+        lines = self.get_nested_lines(request)
+        if lines is None:
+            return super(StockDocumentViewSet, self).create(request, *args, **kwargs)
+        return self.save_document(request, lines)
+
+    def update(self, request, *args, **kwargs):
+        lines = self.get_nested_lines(request)
+        if lines is None:
+            return super(StockDocumentViewSet, self).update(request, *args, **kwargs)
+        return self.save_document(request, lines, self.get_object(), partial=kwargs.pop('partial', False))
+
+    def save_document(self, request, items, document=None, partial=False):
+        """
+            validates the document and its lines together and saves them in one transaction.
+        """
+        max_items = getattr(settings, 'API_BULK_MAX_ITEMS', 1000)
+        if len(items) > max_items:
+            return Response(data={'detail': 'Expected at most {max_items} lines.'.format(max_items=max_items)},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if document is not None and not self.can_change_lines(document):
+            return Response(data={'detail': 'Lines of this document can not be changed.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        lines_field = self.get_lines_field()
+        header_data = dict((name, value) for name, value in request.DATA.items() if name != lines_field)
+        header_serializer = self.get_serializer(document, data=header_data, partial=partial)
+        if not header_serializer.is_valid():
+            return Response(data=header_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        header = header_serializer.object
+        self.pre_save(header)
+        if document is None:
+            #lines are validated against the document before it is inserted
+            header.uuid = smart_text(uuid_module.uuid4())
+
+        line_serializers, errors, removed = self.get_line_serializers(header, items, document is not None, partial)
+        if errors:
+            return Response(data={lines_field: errors}, status=status.HTTP_400_BAD_REQUEST)
+        error = self.check_document(request, document, header, [serializer.object for serializer in line_serializers],
+                                    partial)
+        if error is not None:
+            return error
+
+        new_lines = [serializer.object for serializer in line_serializers if serializer.object.uuid is None]
+        with transaction.atomic():
+            header_serializer.save(force_insert=document is None)
+            for line in new_lines:
+                self.pre_save(line)
+            for serializer in line_serializers:
+                if serializer.object.uuid is not None:
+                    self.pre_save(serializer.object)
+                    serializer.save()
+            line_model = self.line_serializer_class.Meta.model
+            line_model.objects.bulk_create(new_lines)
+            for line in removed:
+                line.is_deleted = True
+                self.pre_save(line)
+                line.save()
+
+        data = dict(header_serializer.data)
+        data[lines_field] = [serializer.data for serializer in line_serializers]
+        return Response(data=data, status=status.HTTP_201_CREATED if document is None else status.HTTP_200_OK)
+
+    def get_line_serializers(self, document, items, update, partial):
+        """
+            returns tuple of (serializers, errors, removed lines). lines with a uuid of a line of the document update
+            it, other lines are new, errors is empty if every line is valid.
+
+            the document, saved or not, is handed to the lines with the other related objects they refer to, so the
+            lines are validated with one query per related model and one per unique constraint however many lines
+            there are, see BaseModelViewSet.get_bulk_serializers().
+        """
+        line_model = self.line_serializer_class.Meta.model
+        document_field = line_model.document_field
+        existing = {}
+        if update:
+            existing = dict((smart_text(line.pk), line) for line in
+                            line_model.objects.filter(**{document_field: document.pk}))
+
+        context = self.get_serializer_context()
+        fields = self.line_serializer_class(context=context).fields
+        context['preloaded_related'] = self.line_serializer_class.get_preloaded_related(fields, items)
+        context['preloaded_related'].setdefault(type(document), {})[smart_text(document.pk)] = document
+        context['validate_unique'] = False
+
+        serializers, errors, kept = [], [], set()
+        for item in items:
+            item = dict(item)
+            item[document_field] = document.pk
+            instance = existing.get(smart_text(item.get('uuid')))
+            if instance is not None:
+                kept.add(smart_text(instance.pk))
+            else:
+                item.pop('uuid', None)
+            serializer = self.line_serializer_class(instance, data=item, partial=partial and instance is not None,
+                                                    context=context)
+            if serializer.is_valid():
+                serializers.append(serializer)
+                errors.append({})
+            else:
+                errors.append(serializer.errors)
+        removed = [] if partial else [line for pk, line in existing.items() if pk not in kept]
+        if not any(errors):
+            errors = self.get_unique_errors([serializer.object for serializer in serializers])
+        return serializers, errors if any(errors) else [], removed
+
+
+class CapacityExceeded(ParseError):
+    """
+        raised when an incoming shipment line saved on its own does not fit in the input warehouse of its shipment,
+        the API responds with 400 Bad Request.
+    """
+    default_detail = 'The shipment does not fit in its input warehouse.'
+
+
+class LinesLocked(ParseError):
+    """
+        raised when an outgoing shipment line is written on its own while its shipment is not a draft, the API
+        responds with 400 Bad Request.
+    """
+    default_detail = 'Lines of this document can not be changed.'
+
+
+def check_lines_capacity(request, input_warehouse_id, lines, released_lines=()):
+    """
+        returns an error Response if incoming shipment lines do not fit in the free volume of the input warehouse and
+        the storage locations above it or None if they do, see check_shipment_fits(). released_lines are the saved
+        lines the request replaces, lines being deleted only release theirs. ?ignore_capacity=true accepts them anyway.
+    """
+    if request.QUERY_PARAMS.get('ignore_capacity') in ('1', 'true', 'True'):
+        return None
+    try:
+        capacity = check_shipment_fits(input_warehouse_id, [
+            (line.product_item_id, line.quantity, line.quantity_uom_id, line.packed_volume, line.packed_volume_uom_id)
+            for line in lines if not line.is_deleted], [
+            (line.product_item_id, line.quantity, line.quantity_uom_id, line.packed_volume, line.packed_volume_uom_id)
+            for line in released_lines])
+    except UOMConversionError as e:
+        return Response(data={'detail': 'Capacity can not be checked: {error}'.format(error=e)},
+                        status=status.HTTP_400_BAD_REQUEST)
+    if capacity['fits'] is False:
+        return Response(data={'detail': CapacityExceeded.default_detail, 'capacity': capacity},
+                        status=status.HTTP_400_BAD_REQUEST)
+    return None
+
+
+class StockMovementLineViewSet(BaseModelViewSet):
+    """
+        Base API end-point for document lines, bulk updates post the change from the saved lines to the updated ones
+        to StockBalance like StockMovementModel.save() does.
+    """
+    def update_objects(self, model, objs):
+        saved = list(model.all_objects.filter(pk__in=[obj.pk for obj in objs]))
+        previous = model.get_bulk_stock_movements(saved)
+        super(StockMovementLineViewSet, self).update_objects(model, objs)
+        StockBalance.objects.post_movements(negate_movements(previous) + model.get_bulk_stock_movements(objs))
+
+
+class IncomingShipmentViewSet(StockDocumentViewSet):
     """
         API end-point for IncomingShipment model
     """
     queryset = IncomingShipment.objects.all()
     serializer_class = IncomingShipmentSerializer
+    line_serializer_class = IncomingShipmentLineSerializer
+
+    def check_document(self, request, document, header, lines, partial):
+        """
+            refuses shipments that do not fit in the free volume of their input warehouse and the storage locations
+            above it, ?ignore_capacity=true accepts them anyway.
+        """
+        if header.is_deleted:
+            return None
+        released = []
+        if document is not None and IncomingShipment.objects.filter(
+                pk=document.pk, input_warehouse=header.input_warehouse_id).exists():
+            #lines the request replaces or deletes are already on hand at the warehouse
+            changed = set(line.pk for line in lines if line.pk is not None)
+            released = [line for line in IncomingShipmentLine.objects.filter(incoming_shipment=document.pk)
+                        if not partial or line.pk in changed]
+        return check_lines_capacity(request, header.input_warehouse_id, lines, released)
 
 
-class IncomingShipmentLineViewSet(BaseModelViewSet):
+class IncomingShipmentLineViewSet(StockMovementLineViewSet):
     """
-        API end point for IncomingShipmentLine model
+        API end point for IncomingShipmentLine model, lines that do not fit in the input warehouse of their shipment
+        are refused like shipments saved with their lines, see IncomingShipmentViewSet.check_document().
     """
     queryset = IncomingShipmentLine.objects.all()
     serializer_class = IncomingShipmentLineSerializer
+    objects_checked = False
+
+    def check_objects(self, request, objs):
+        """
+            checks lines against the input warehouse of their shipments, lines being updated release the volume of
+            their saved version when it is at the same warehouse.
+        """
+        self.objects_checked = True
+        shipments = dict(IncomingShipment.objects.filter(
+            pk__in=set(line.incoming_shipment_id for line in objs)).values_list('pk', 'input_warehouse'))
+        warehouses = {}
+        for line in objs:
+            if line.incoming_shipment_id in shipments:
+                warehouses.setdefault(shipments[line.incoming_shipment_id], ([], []))[0].append(line)
+        for line in IncomingShipmentLine.objects.filter(pk__in=[line.pk for line in objs if line.pk is not None],
+                                                        incoming_shipment__is_deleted=False).select_related(
+                'incoming_shipment'):
+            if line.incoming_shipment.input_warehouse_id in warehouses:
+                warehouses[line.incoming_shipment.input_warehouse_id][1].append(line)
+        for input_warehouse_id, (lines, released) in warehouses.items():
+            error = check_lines_capacity(request, input_warehouse_id, lines, released)
+            if error is not None:
+                return error
+        return None
 
+    def pre_save(self, obj):
+        """
+            lines written one at a time are checked here, bulk writes check every line at once in check_objects().
+        """
+        super(IncomingShipmentLineViewSet, self).pre_save(obj)
+        if not self.objects_checked:
+            error = self.check_objects(self.request, [obj])
+            if error is not None:
+                raise CapacityExceeded(error.data['detail'])
 
-class OutgoingShipmentViewSet(BaseModelViewSet):
+
+class OutgoingShipmentViewSet(StockDocumentViewSet):
     """
         API end-point for OutgoingShipment model
     """
     queryset = OutgoingShipment.objects.all()
     serializer_class = OutgoingShipmentSerializer
+    line_serializer_class = OutgoingShipmentLineSerializer
+
+    def can_change_lines(self, document):
+        return document.status == OutgoingShipment.STATUS.draft
 
+    @action(methods=['POST'])
+    def allocate(self, request, uuid):
+        """
+            drafts lines that pick the requested products from the output warehouse first-expiry-first-out.
 
-class OutgoingShipmentLineViewSet(BaseModelViewSet):
+            request body: {"products": {"<product uuid>": quantity, ...}, "program": "<uuid>" (optional),
+            "use_vvm_stage": true to issue stage 2 batches before stage 1 ones, "save": true to save the drafts}
+        """
+        shipment = self.get_object()
+        requested = request.DATA.get('products') if isinstance(request.DATA, dict) else None
+        if not isinstance(requested, dict) or not requested:
+            return Response(data={'detail': 'Expected "products" mapping product uuids to quantities.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            requested = dict((product_id, int(quantity)) for product_id, quantity in requested.items())
+        except (TypeError, ValueError):
+            return Response(data={'detail': 'Expected whole number quantities.'}, status=status.HTTP_400_BAD_REQUEST)
+        if any(quantity <= 0 for quantity in requested.values()):
+            return Response(data={'detail': 'Expected positive quantities.'}, status=status.HTTP_400_BAD_REQUEST)
+        if shipment.status != OutgoingShipment.STATUS.draft:
+            return Response(data={'detail': 'Only draft shipments can be allocated.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        lines, shortfalls = allocate_fefo(shipment.output_warehouse_id, requested, request.DATA.get('program'),
+                                          bool(request.DATA.get('use_vvm_stage')), outgoing_shipment=shipment)
+        if request.DATA.get('save'):
+            user = self.get_request_user()
+            for line in lines:
+                line.created_by = line.modified_by = user
+            with transaction.atomic():
+                OutgoingShipmentLine.objects.bulk_create(lines)
+        serializer = OutgoingShipmentLineSerializer(lines, many=True, context=self.get_serializer_context())
+        return Response(data={'lines': serializer.data, 'shortfalls': shortfalls})
+
+    @action(methods=['POST'])
+    def transition(self, request, uuid):
+        """
+            moves the shipment to the status in the request body e.g {"status": "done"}, quantity_before and
+            quantity_after of its lines are worked out from the stock balances when it is assigned or done.
+        """
+        shipment = self.get_object()
+        value = request.DATA.get('status') if isinstance(request.DATA, dict) else None
+        if isinstance(value, six.string_types) and not value.isdigit():
+            value = getattr(OutgoingShipment.STATUS, value, None)
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            return Response(data={'detail': 'Expected a shipment status.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            shipment = transition_outgoing_shipment(shipment.pk, value, self.get_request_user())
+        except PostingError as e:
+            return Response(data={'detail': str(e)}, status=status.HTTP_409_CONFLICT)
+        lines = OutgoingShipmentLineSerializer(shipment.outgoing_shipment_lines.filter(is_deleted=False), many=True,
+                                               context=self.get_serializer_context())
+        return Response(data={'shipment': self.get_serializer(shipment).data, 'lines': lines.data})
+
+
+class OutgoingShipmentLineViewSet(StockMovementLineViewSet):
     """
-        API end-point for OutgoingShipmentLine model
+        API end-point for OutgoingShipmentLine model, lines can only be written while their shipment is a draft like
+        on OutgoingShipmentViewSet. lines of assigned and done shipments are only changed by the transition action,
+        which posts them with the stock balances locked.
     """
     queryset = OutgoingShipmentLine.objects.all()
-    serializer_class = OutgoingShipmentLineSerializer
\ No newline at end of file
+    serializer_class = OutgoingShipmentLineSerializer
+    objects_checked = False
+
+    def has_locked_shipments(self, line_uuids, shipment_ids=()):
+        """
+            returns True if the saved shipment of any of the lines or any of the given shipments is not a draft
+        """
+        shipment_ids = set(shipment_ids)
+        shipment_ids.update(OutgoingShipmentLine.all_objects.filter(pk__in=list(line_uuids))
+                            .values_list('outgoing_shipment', flat=True))
+        return OutgoingShipment.all_objects.filter(pk__in=shipment_ids).exclude(
+            status=OutgoingShipment.STATUS.draft).exists()
+
+    def check_objects(self, request, objs):
+        """
+            refuses lines whose saved or new shipment is not a draft, moving a line off a done shipment would
+            change its posted stock as much as editing it.
+        """
+        self.objects_checked = True
+        if self.has_locked_shipments([line.pk for line in objs if line.pk is not None],
+                                     [line.outgoing_shipment_id for line in objs]):
+            return Response(data={'detail': LinesLocked.default_detail}, status=status.HTTP_400_BAD_REQUEST)
+        return None
+
+    def check_is_deleted_update(self, request, uuids, is_deleted):
+        if self.has_locked_shipments(uuids):
+            return Response(data={'detail': LinesLocked.default_detail}, status=status.HTTP_400_BAD_REQUEST)
+        return None
+
+    def pre_save(self, obj):
+        """
+            lines written one at a time, deleted or recovered are checked here, bulk writes check every line at once
+            in check_objects().
+        """
+        super(OutgoingShipmentLineViewSet, self).pre_save(obj)
+        if not self.objects_checked and self.has_locked_shipments([obj.pk] if obj.pk else [],
+                                                                  [obj.outgoing_shipment_id]):
+            raise LinesLocked()
+
+
+class StockBalanceViewSet(BaseModelViewSet):
+    """
+        read only API end-point for stock on hand, e.g ?storage_location=<uuid>&product_item=<uuid> returns the
+        balance of a product item at a storage location with one lookup on the balance unique index.
+
+        ?as_of=<ISO 8601 date time> returns balances at a past time worked out from the nearest stock snapshot.
+
+        balances are changed by posting shipments and adjustments, not via this end-point.
+    """
+    queryset = StockBalance.objects.all()
+    serializer_class = StockBalanceSerializer
+    filter_fields = ('storage_location', 'product_item', 'program')
+    http_method_names = ['get', 'head', 'options']
+
+    def list(self, request, *args, **kwargs):
+        if 'as_of' not in request.QUERY_PARAMS:
+            return super(StockBalanceViewSet, self).list(request, *args, **kwargs)
+        try:
+            as_of = parse_datetime(request.QUERY_PARAMS['as_of'])
+        except ValueError:
+            as_of = None
+        if as_of is None:
+            return Response(data={'detail': 'Expected an ISO 8601 date time for as_of.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if timezone.is_naive(as_of):
+            as_of = timezone.make_aware(as_of, timezone.get_current_timezone())
+
+        storage_location_ids = request.QUERY_PARAMS.getlist('storage_location') or None
+        product_item_ids = request.QUERY_PARAMS.getlist('product_item') or None
+        balances = get_stock_balances_as_of(as_of, storage_location_ids, product_item_ids)
+        program = request.QUERY_PARAMS.get('program')
+        return Response(data={
+            'as_of': as_of,
+            'results': [{'storage_location': location_id, 'product_item': product_item_id, 'program': program_id,
+                         'quantity': quantity}
+                        for (location_id, product_item_id, program_id), quantity in balances.items()
+                        if program is None or program_id == program]
+        })
+
+
+class PhysicalStockCountViewSet(BaseModelViewSet):
+    """
+        API end-point for PhysicalStockCount model
+    """
+    queryset = PhysicalStockCount.objects.all()
+    serializer_class = PhysicalStockCountSerializer
+
+    @action(methods=['POST'])
+    def reconcile(self, request, uuid):
+        """
+            records the variances between the count and the stock balances of the counted storage location as
+            adjustments and returns a summary of the variances, ?dry_run=true only returns the summary.
+        """
+        stock_count = self.get_object()
+        dry_run = request.QUERY_PARAMS.get('dry_run') in ('1', 'true', 'True')
+        try:
+            summary = reconcile_physical_stock_count(stock_count, self.get_request_user(), dry_run)
+        except ReconciliationError as e:
+            return Response(data={'detail': str(e)}, status=status.HTTP_409_CONFLICT)
+        return Response(data=summary)
+
+
+class PhysicalStockCountLineViewSet(BaseModelViewSet):
+    """
+        API end-point for PhysicalStockCountLine model
+    """
+    queryset = PhysicalStockCountLine.objects.all()
+    serializer_class = PhysicalStockCountLineSerializer
+
+
+class ConsumptionAnalyticsView(views.APIView):
+    """
+        API end-point that returns average monthly consumption, consumption trend, wastage rate and days of stock per
+        facility and product worked out from consumption records.
+
+        query parameters: facility and product (uuids, can be repeated), since and until (YYYY-MM-DD) limit the
+        consumption records used.
+    """
+    def get(self, request, format=None):
+        dates = {}
+        for name in ('since', 'until'):
+            value = request.QUERY_PARAMS.get(name)
+            if value:
+                try:
+                    dates[name] = parse_date(value)
+                except ValueError:
+                    #well formed but not a valid date e.g 2014-02-30
+                    dates[name] = None
+                if dates[name] is None:
+                    return Response(data={'detail': 'Expected a YYYY-MM-DD date for {name}.'.format(name=name)},
+                                    status=status.HTTP_400_BAD_REQUEST)
+        results = get_consumption_rates(facility_ids=request.QUERY_PARAMS.getlist('facility') or None,
+                                        product_ids=request.QUERY_PARAMS.getlist('product') or None,
+                                        since=dates.get('since'), until=dates.get('until'))
+        return Response(data={'results': results})
+
+
+class StorageCapacityView(views.APIView):
+    """
+        API end-point that returns capacity, used and free volume and utilisation of every storage location, used
+        volume of a location includes the locations below it.
+
+        query parameters: storage_location (uuid) limits the results to the location and the locations below it,
+        uom (uuid) is the unit volumes are returned in, it defaults to the capacity unit used by most locations.
+    """
+    def get(self, request, format=None):
+        storage_location = request.QUERY_PARAMS.get('storage_location')
+        tree_ids, positions = None, None
+        if storage_location:
+            location = StorageLocation.objects.filter(pk=storage_location).values_list('tree_id', 'lft', 'rght').first()
+            if location is None:
+                return Response(data={'detail': 'Unknown storage location.'}, status=status.HTTP_400_BAD_REQUEST)
+            tree_ids = [location[0]]
+        try:
+            tree = CapacityTree(tree_ids)
+            if storage_location:
+                descendants = set(StorageLocation.objects.filter(tree_id=location[0], lft__gte=location[1],
+                                                                 rght__lte=location[2]).values_list('pk', flat=True))
+                positions = [position for position, pk in enumerate(tree.ids) if pk in descendants]
+            results = tree.get_utilisation(positions, request.QUERY_PARAMS.get('uom'))
+        except UOMConversionError as e:
+            return Response(data={'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(data={'results': results})
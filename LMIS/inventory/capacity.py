@@ -0,0 +1,258 @@
+"""
+    inventory/capacity.py works out how much of the volume of each storage location is used by the stock on hand and
+    whether an incoming shipment fits in its storage location.
+
+    the used volume of a storage location is the volume of the stock balances of the location and of every location
+    below it in the storage location tree. volume_per_unit of a product item is the volume of one unit of it, i.e one
+    presentation e.g a vial of 20 doses, stock balances are in the base unit of their product and shipment lines in
+    their quantity unit, quantities are converted to presentations before they are multiplied by volume_per_unit.
+    the capacity of a location is its net capacity, or its gross capacity if it has no net capacity, or the sum of the
+    capacities of the locations right below it.
+
+    volumes are converted one row at a time into one volume unit, see core/uom.py, a row whose units can not be
+    converted is counted as a volume that is not known instead of failing the whole tree.
+"""
+
+#import core python modules
+from collections import Counter
+
+#import external modules
+import numpy
+
+#import project modules
+from cce.models import StorageLocation
+from core.models import ProductItem
+from core.uom import UOMConverter, UOMConversionError
+from inventory.models import StockBalance
+
+
+class VolumeConverter(object):
+    """
+        converts volumes of single rows to uom_id units, ratios between units are worked out once per pair of units.
+        methods return None when a volume is not known or its units can not be converted.
+    """
+    def __init__(self, converter, uom_id):
+        self.converter = converter
+        self.uom_id = uom_id
+        self.ratios = {}
+
+    def get_ratio(self, from_uom_id, to_uom_id):
+        """
+            returns the number of to_uom_id units in one from_uom_id unit or None if they can not be converted
+        """
+        key = (from_uom_id, to_uom_id)
+        if key not in self.ratios:
+            try:
+                self.ratios[key] = self.converter.convert(1.0, from_uom_id, to_uom_id, rounded=False)
+            except UOMConversionError:
+                self.ratios[key] = None
+        return self.ratios[key]
+
+    def get_volume(self, volume, uom_id):
+        if volume is None or uom_id is None or self.uom_id is None:
+            return None
+        ratio = self.get_ratio(uom_id, self.uom_id)
+        return None if ratio is None else volume * ratio
+
+    def get_quantity_volume(self, quantity, quantity_uom_id, presentation_value, presentation_uom_id, volume_per_unit,
+                            volume_uom_id):
+        """
+            returns volume of quantity quantity_uom_id units of a product item whose presentation holds
+            presentation_value presentation_uom_id units and takes up volume_per_unit volume_uom_id units.
+        """
+        if not presentation_value or quantity_uom_id is None or presentation_uom_id is None or \
+                volume_per_unit is None:
+            return None
+        ratio = self.get_ratio(quantity_uom_id, presentation_uom_id)
+        if ratio is None:
+            return None
+        return self.get_volume(quantity * ratio / presentation_value * volume_per_unit, volume_uom_id)
+
+
+class CapacityTree(object):
+    """
+        storage location trees with the used volume and capacity of every storage location in uom_id units, which
+        defaults to the capacity unit used by most storage locations.
+
+        ids: storage location ids sorted by tree and lft, the arrays below are in the same order.
+        used: used volume of each location and the locations below it.
+        capacity: capacity of each location, nan if it is not known.
+        unknown: number of stock balances of each location and the locations below it whose volume is not known.
+    """
+    def __init__(self, tree_ids=None, converter=None, uom_id=None):
+        self.converter = converter or UOMConverter()
+        locations = StorageLocation.objects.all()
+        balances = StockBalance.objects.filter(quantity__gt=0)
+        if tree_ids is not None:
+            locations = locations.filter(tree_id__in=tree_ids)
+            balances = balances.filter(storage_location__tree_id__in=tree_ids)
+        rows = list(locations.order_by('tree_id', 'lft').values_list(
+            'pk', 'parent', 'tree_id', 'lft', 'rght', 'net_capacity', 'gross_capacity', 'capacity_uom'))
+        self.ids = [row[0] for row in rows]
+        self.index = dict((pk, position) for position, pk in enumerate(self.ids))
+        self.parents = [self.index.get(row[1]) for row in rows]
+        self.capacity_uoms = [row[7] for row in rows]
+
+        balances = [balance for balance in balances.values_list(
+            'storage_location', 'quantity', 'product_item__product__base_uom', 'product_item__presentation__value',
+            'product_item__presentation__uom', 'product_item__volume_per_unit', 'product_item__volume_uom')
+            if balance[0] in self.index]
+        self.uom_id = uom_id or self.get_default_uom_id([balance[6] for balance in balances])
+        volumes = VolumeConverter(self.converter, self.uom_id)
+
+        count = len(rows)
+        own_used, own_unknown = numpy.zeros(count), numpy.zeros(count)
+        for balance in balances:
+            volume = volumes.get_quantity_volume(*balance[1:])
+            if volume is None:
+                own_unknown[self.index[balance[0]]] += 1
+            else:
+                own_used[self.index[balance[0]]] += volume
+        capacity = numpy.full(count, numpy.nan)
+        for position, row in enumerate(rows):
+            value = volumes.get_volume(row[5] if row[5] is not None else row[6], row[7])
+            if value is not None:
+                capacity[position] = value
+
+        trees = numpy.array([row[2] for row in rows], dtype=numpy.int64)
+        lfts = numpy.array([row[3] for row in rows], dtype=numpy.int64)
+        rghts = numpy.array([row[4] for row in rows], dtype=numpy.int64)
+        self.used = self.get_subtree_totals(own_used, trees, lfts, rghts)
+        self.unknown = self.get_subtree_totals(own_unknown, trees, lfts, rghts)
+        self.capacity = self.add_up_capacities(capacity)
+
+    def get_subtree_totals(self, values, trees, lfts, rghts):
+        """
+            returns numpy array of the totals of values of each location and the locations below it.
+
+            locations are sorted by tree and lft, so the locations below a location come right after it up to the
+            first location whose lft is past its rght. each total is the difference of two prefix sums.
+        """
+        if not len(values):
+            return numpy.zeros(0)
+        span = int(rghts.max()) + 1
+        keys = trees * span + lfts
+        ends = numpy.searchsorted(keys, trees * span + rghts, 'right')
+        prefix = numpy.concatenate([[0], numpy.cumsum(values, dtype=numpy.float64)])
+        return prefix[ends] - prefix[numpy.arange(len(values))]
+
+    def add_up_capacities(self, capacity):
+        """
+            fills in capacities that are not known with the sum of the known capacities of the locations right below
+            them, children come after their parent so walking the locations backwards adds children up first.
+        """
+        children = numpy.zeros(len(capacity))
+        has_children = numpy.zeros(len(capacity), dtype=bool)
+        for position in range(len(capacity) - 1, -1, -1):
+            if numpy.isnan(capacity[position]) and has_children[position]:
+                capacity[position] = children[position]
+            parent = self.parents[position]
+            if parent is not None and not numpy.isnan(capacity[position]):
+                children[parent] += capacity[position]
+                has_children[parent] = True
+        return capacity
+
+    def get_default_uom_id(self, volume_uom_ids=()):
+        """
+            returns the capacity unit used by most storage locations, or the volume unit of most of volume_uom_ids if
+            no storage location has a capacity unit
+        """
+        counts = Counter(uom_id for uom_id in self.capacity_uoms if uom_id is not None) or \
+            Counter(uom_id for uom_id in volume_uom_ids if uom_id is not None)
+        return counts.most_common(1)[0][0] if counts else None
+
+    def get_ancestors(self, storage_location_id):
+        """
+            returns positions of the storage location and the locations above it, nearest first
+        """
+        positions = []
+        position = self.index.get(storage_location_id)
+        while position is not None:
+            positions.append(position)
+            position = self.parents[position]
+        return positions
+
+    def get_utilisation(self, positions=None, uom_id=None):
+        """
+            returns list of dicts of storage_location, capacity, used and free volume in uom_id units (or the units of
+            the tree), utilisation (used / capacity) and unknown_volumes, the number of stock balances left out
+            because their volume is not known. raises UOMConversionError if uom_id is not a unit of the tree volumes.
+        """
+        uom_id = uom_id or self.uom_id
+        factor = 1.0
+        if uom_id is not None and self.uom_id is not None:
+            factor = self.converter.convert(1.0, self.uom_id, uom_id, rounded=False)
+        positions = range(len(self.ids)) if positions is None else positions
+        results = []
+        for position in positions:
+            capacity = None if numpy.isnan(self.capacity[position]) else float(self.capacity[position]) * factor
+            used = float(self.used[position]) * factor
+            results.append({
+                'storage_location': self.ids[position],
+                'uom': uom_id,
+                'capacity': capacity,
+                'used': used,
+                'free': None if capacity is None else capacity - used,
+                'utilisation': used / capacity if capacity else None,
+                'unknown_volumes': int(self.unknown[position]),
+            })
+        return results
+
+
+def get_lines_volume(lines, volumes):
+    """
+        returns tuple of (volume in VolumeConverter units, number of lines whose volume is not known) of list of
+        (product item id, quantity, quantity uom id, packed volume, packed volume uom id) shipment lines. lines
+        without a packed volume take up the volume of their quantity of the product item.
+    """
+    total, unknown = 0.0, 0
+    items = dict((row[0], row[1:]) for row in ProductItem.objects.filter(
+        pk__in=set(line[0] for line in lines if line[3] is None or line[4] is None)).values_list(
+        'pk', 'presentation__value', 'presentation__uom', 'volume_per_unit', 'volume_uom'))
+    for product_item_id, quantity, quantity_uom_id, packed_volume, packed_volume_uom_id in lines:
+        if packed_volume is not None and packed_volume_uom_id is not None:
+            volume = volumes.get_volume(packed_volume, packed_volume_uom_id)
+        elif product_item_id in items:
+            volume = volumes.get_quantity_volume(quantity, quantity_uom_id, *items[product_item_id])
+        else:
+            volume = None
+        if volume is None:
+            unknown += 1
+        else:
+            total += volume
+    return total, unknown
+
+
+def check_shipment_fits(storage_location_id, lines, released_lines=()):
+    """
+        returns dict telling if shipment lines, list of (product item id, quantity, quantity uom id, packed volume,
+        packed volume uom id), fit in the free volume of the given storage location and of every location above it.
+        released_lines are lines already on hand at the storage location that the shipment replaces, e.g the lines of
+        a shipment being edited.
+
+        fits is None if none of the locations has a known capacity. overflows lists the locations that would be
+        over capacity. volumes are in the capacity unit of the nearest location that has one.
+    """
+    location = StorageLocation.objects.filter(pk=storage_location_id).values_list('tree_id', 'lft', 'rght').first()
+    uom_id = None
+    if location is not None:
+        uom_id = StorageLocation.objects.filter(
+            tree_id=location[0], lft__lte=location[1], rght__gte=location[2], capacity_uom__isnull=False).order_by(
+            '-lft').values_list('capacity_uom', flat=True).first()
+    converter = UOMConverter()
+    tree = CapacityTree([location[0]] if location is not None else [], converter, uom_id)
+    volumes = VolumeConverter(converter, tree.uom_id)
+    volume, unknown = get_lines_volume(lines, volumes)
+    released, _ = get_lines_volume(released_lines, volumes)
+    needed = volume - released
+
+    utilisation = tree.get_utilisation(tree.get_ancestors(storage_location_id))
+    overflows = [result for result in utilisation if result['free'] is not None and needed > result['free']]
+    return {
+        'fits': None if all(result['capacity'] is None for result in utilisation) else not overflows,
+        'uom': tree.uom_id,
+        'volume': needed,
+        'unknown_volumes': unknown,
+        'locations': utilisation,
+        'overflows': [result['storage_location'] for result in overflows],
+    }
@@ -0,0 +1,188 @@
+"""
+    inventory/consumption.py generates draft ConsumptionRecord rows for a ProcessingPeriod from the stock ledger
+    instead of having facilities fill them in by hand. for each facility, product item and program:
+
+        previous_balance: stock balance at the start of the period
+        current_balance: stock balance at the end of the period
+        quantity_received: incoming shipment lines received during the period
+        total_discarded: quantity taken off by broken, expired, frozen and VVM adjustments during the period
+        quantity_adjusted: quantity added by the other adjustments during the period, e.g found stock, less the
+            quantity they took off, e.g missing stock
+        quantity_used: previous_balance + quantity_received + quantity_adjusted - total_discarded - current_balance
+
+    every figure is taken on the business dates of the stock journal: balances as of the period start and end,
+    shipments by the date they were received and adjustments by the date they were made, so the figures add up
+    whenever the movements were entered. quantities are in the base unit of the product like the balances.
+
+    quantity_used is what left the facility otherwise, i.e issued stock. it is only negative when the journal has
+    entries no movement accounts for, e.g corrections of "manage.py rebuild_stock_balances", and is then recorded as
+    0 instead.
+
+    facilities are processed in chunks, each chunk costs a fixed number of grouped aggregate queries whatever its
+    number of facilities, and chunks can be run in a process pool.
+"""
+
+#import core python modules
+import multiprocessing
+
+#import core django modules
+from django.db import connections, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+#import project modules
+from cce.models import StorageLocation
+from core.models import Employee, ProcessingPeriod, ProductItem
+from core.uom import UOMConverter
+from inventory.ledger import add_converted_totals, get_stock_balances_as_of
+from inventory.models import (Adjustment, AdjustmentType, ConsumptionRecord, ConsumptionRecordLine,
+                              IncomingShipmentLine)
+
+
+#adjustment types that count as discarded stock
+DISCARD_TYPES = (AdjustmentType.TYPES.broken, AdjustmentType.TYPES.expired, AdjustmentType.TYPES.frozen,
+                 AdjustmentType.TYPES.vvm)
+
+FIGURES = ('previous_balance', 'current_balance', 'quantity_received', 'total_discarded', 'quantity_adjusted')
+
+
+def get_facility_locations(facility_ids=None):
+    """
+        returns dict of {facility id: [storage location ids]}
+    """
+    locations = StorageLocation.objects.all()
+    if facility_ids is not None:
+        locations = locations.filter(facility__in=facility_ids)
+    facility_locations = {}
+    for facility_id, location_id in locations.values_list('facility', 'pk'):
+        facility_locations.setdefault(facility_id, []).append(location_id)
+    return facility_locations
+
+
+def compute_consumption(period, facility_locations):
+    """
+        returns dict of {(facility id, product item id, program id): {figure: quantity}} for the given facilities
+    """
+    location_facility = dict((location_id, facility_id) for facility_id, location_ids in facility_locations.items()
+                             for location_id in location_ids)
+    location_ids = list(location_facility)
+    figures = {}
+
+    def add(facility_id, product_item_id, program_id, figure, quantity):
+        row = figures.setdefault((facility_id, product_item_id, program_id), dict.fromkeys(FIGURES, 0))
+        row[figure] += quantity or 0
+
+    for figure, as_of in (('previous_balance', period.start_date), ('current_balance', period.end_date)):
+        for (location_id, product_item_id, program_id), quantity in get_stock_balances_as_of(
+                as_of, storage_location_ids=location_ids).items():
+            add(location_facility[location_id], product_item_id, program_id, figure, quantity)
+
+    received = IncomingShipmentLine.objects.filter(
+        incoming_shipment__is_deleted=False, incoming_shipment__input_warehouse__in=location_ids,
+        incoming_shipment__received_at__gt=period.start_date, incoming_shipment__received_at__lte=period.end_date)
+    received_totals = {}
+    add_converted_totals(received_totals, received.values(
+        'incoming_shipment__input_warehouse', 'product_item', 'program', 'quantity_uom',
+        'product_item__product__base_uom').annotate(total=Sum('quantity')), UOMConverter(),
+        'incoming_shipment__input_warehouse')
+    for (location_id, product_item_id, program_id), quantity in received_totals.items():
+        add(location_facility[location_id], product_item_id, program_id, 'quantity_received', quantity)
+
+    adjustments = Adjustment.objects.filter(storage_location__in=location_ids, adjusted_at__gt=period.start_date,
+                                            adjusted_at__lte=period.end_date)
+    for row in adjustments.values('storage_location', 'product_item', 'program', 'adjustment_type').annotate(
+            previous=Sum('previous_quantity'), revised=Sum('revised_quantity')):
+        change = (row['revised'] or 0) - (row['previous'] or 0)
+        if row['adjustment_type'] in DISCARD_TYPES:
+            figure, change = 'total_discarded', -change
+        else:
+            figure = 'quantity_adjusted'
+        add(location_facility[row['storage_location']], row['product_item'], row['program'], figure, change)
+    return figures
+
+
+def get_period_dates(period):
+    """
+        returns tuple of local (start date, end date) of the period
+    """
+    return timezone.localtime(period.start_date).date(), timezone.localtime(period.end_date).date()
+
+
+def generate_facility_records(period, facility_locations, employee):
+    """
+        saves draft consumption records of the given facilities that have none for the period yet and returns the
+        number of records created. lines are kept per program, facilities whose stock is not held for any program
+        get no record.
+    """
+    start_date, end_date = get_period_dates(period)
+    existing = set(ConsumptionRecord.objects.filter(
+        facility__in=list(facility_locations), start_date=start_date, end_date=end_date
+    ).values_list('facility', flat=True))
+    facility_locations = dict((facility_id, location_ids) for facility_id, location_ids in facility_locations.items()
+                              if facility_id not in existing)
+    if not facility_locations:
+        return 0
+
+    #consumption record lines are kept per program
+    figures = dict((key, row) for key, row in compute_consumption(period, facility_locations).items()
+                   if key[2] is not None)
+    uoms = dict(ProductItem.objects.filter(pk__in=set(key[1] for key in figures))
+                .values_list('pk', 'product__base_uom'))
+    user = employee.user
+    records = {}
+    for facility_id in set(key[0] for key in figures):
+        records[facility_id] = ConsumptionRecord(facility_id=facility_id, performed_by=employee,
+                                                 start_date=start_date, end_date=end_date,
+                                                 created_by=user, modified_by=user)
+    with transaction.atomic():
+        ConsumptionRecord.objects.bulk_create(list(records.values()))
+        lines = []
+        for (facility_id, product_item_id, program_id), row in figures.items():
+            used = max(0, row['previous_balance'] + row['quantity_received'] + row['quantity_adjusted'] -
+                       row['total_discarded'] - row['current_balance'])
+            lines.append(ConsumptionRecordLine(consumption_record=records[facility_id],
+                                               product_item_id=product_item_id, program_id=program_id,
+                                               quantity_uom_id=uoms[product_item_id], quantity_used=used,
+                                               created_by=user, modified_by=user, **row))
+        ConsumptionRecordLine.objects.bulk_create(lines, batch_size=1000)
+    return len(records)
+
+
+def _generate_chunk(args):
+    """
+        process pool worker, it opens its own database connections.
+    """
+    period_id, facility_locations, employee_id = args
+    for connection in connections.all():
+        connection.close()
+    try:
+        return generate_facility_records(ProcessingPeriod.objects.get(pk=period_id), facility_locations,
+                                         Employee.objects.select_related('user').get(pk=employee_id))
+    finally:
+        for connection in connections.all():
+            connection.close()
+
+
+def generate_consumption_records(period, employee, facility_ids=None, chunk_size=50, processes=1):
+    """
+        generates draft consumption records of a processing period for every facility with storage locations, or
+        the given facilities, and returns the number of records created.
+
+        facilities are split in chunks of chunk_size, with processes > 1 the chunks are generated in a pool of that
+        many processes, each chunk in its own transaction.
+    """
+    facility_locations = sorted(get_facility_locations(facility_ids).items())
+    chunks = [dict(facility_locations[index:index + chunk_size])
+              for index in range(0, len(facility_locations), chunk_size)]
+    if processes <= 1 or len(chunks) <= 1:
+        return sum(generate_facility_records(period, chunk, employee) for chunk in chunks)
+
+    #forked workers must not share the parent database connections
+    for connection in connections.all():
+        connection.close()
+    pool = multiprocessing.Pool(processes)
+    try:
+        return sum(pool.map(_generate_chunk, [(period.pk, chunk, employee.pk) for chunk in chunks]))
+    finally:
+        pool.close()
+        pool.join()
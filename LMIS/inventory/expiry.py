@@ -0,0 +1,181 @@
+"""
+    inventory/expiry.py scans stock on hand for batches (product items) that will expire before they are used up at
+    the rate their facility consumes the product, records them as ExpiryRisk rows and raises an on-site notification
+    for the facility when a risk is found or gets worse: its priority goes up as the expiration date comes closer or
+    the share of the batch at risk reaches a higher RISK_BANDS threshold. other changes keep the notification raised
+    before, so a batch whose quantity changes every day is not notified every day.
+
+    batches of a product at a facility are assumed to be used first-expiry-first-out, so a batch is only used once
+    the batches that expire before it are. the scan is incremental: a run only rescans (facility, product) pairs
+    whose balances or consumption records changed since the last run, pairs with a batch that came within the
+    horizon since then and pairs already at risk. balances are only read for batches expiring within
+    EXPIRY_RISK_HORIZON_DAYS, which is served by the product item expiration date index.
+"""
+
+#import core python modules
+import datetime
+
+#import core django modules
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+#import project modules
+from alerts.models import OnSiteNotification, Priority
+from inventory.analytics import get_consumption_rates, DAYS_PER_MONTH
+from inventory.models import StockBalance, ConsumptionRecordLine, ExpiryRisk, ExpiryRiskScan
+
+
+BALANCE_COLUMNS = ('storage_location', 'storage_location__facility', 'storage_location__name', 'product_item',
+                   'product_item__product', 'product_item__name', 'product_item__batch_no',
+                   'product_item__expiration_date', 'program', 'quantity')
+
+
+#shares of the quantity on hand at risk that raise a new notification when a risk reaches them
+RISK_BANDS = (0.25, 0.5, 0.75)
+
+
+def get_pairs(balances):
+    return set(balances.values_list('storage_location__facility', 'product_item__product').distinct())
+
+
+def get_changed_pairs(since, today, horizon_date):
+    """
+        returns set of (facility id, product id) pairs that have to be rescanned, every pair with stock expiring
+        within the horizon if since is None.
+    """
+    in_horizon = StockBalance.objects.filter(quantity__gt=0, product_item__expiration_date__lte=horizon_date)
+    if since is None:
+        return get_pairs(in_horizon)
+
+    previous_horizon_date = horizon_date - (today - timezone.localtime(since).date())
+    pairs = get_pairs(StockBalance.objects.filter(modified__gt=since))
+    pairs |= set(ConsumptionRecordLine.objects.filter(modified__gt=since).values_list(
+        'consumption_record__facility', 'product_item__product').distinct())
+    pairs |= get_pairs(in_horizon.filter(product_item__expiration_date__gt=previous_horizon_date))
+    #projections of batches already at risk change every day
+    pairs |= set(ExpiryRisk.objects.values_list('facility', 'product'))
+    return pairs
+
+
+def get_priority(days_left):
+    if days_left <= 0:
+        return Priority.LEVELS.critical
+    if days_left <= 30:
+        return Priority.LEVELS.high
+    if days_left <= 90:
+        return Priority.LEVELS.medium
+    return Priority.LEVELS.low
+
+
+def get_risk_band(risk):
+    """
+        returns number of RISK_BANDS thresholds reached by the share of the quantity on hand at risk
+    """
+    share = float(risk.quantity_at_risk) / risk.quantity_on_hand if risk.quantity_on_hand else 1.0
+    return len([threshold for threshold in RISK_BANDS if share >= threshold])
+
+
+def is_escalated(old, risk, priority):
+    """
+        returns True if risk has to be notified again: it is new, its priority went up since old was notified or its
+        share at risk reached a higher band. old risks whose notification was deleted are only compared by band.
+    """
+    if old is None:
+        return True
+    if old.notification is not None and priority > old.notification.priority_level:
+        return True
+    return get_risk_band(risk) > get_risk_band(old)
+
+
+def compute_risks(pairs, today, horizon_date, rates):
+    """
+        returns list of unsaved ExpiryRisk rows of the given pairs.
+
+        rates: dict of {(facility id, product id): daily consumption}
+    """
+    facility_ids = set(facility_id for facility_id, product_id in pairs)
+    product_ids = set(product_id for facility_id, product_id in pairs)
+    balances = StockBalance.objects.filter(
+        quantity__gt=0, product_item__expiration_date__lte=horizon_date,
+        storage_location__facility__in=list(facility_ids), product_item__product__in=list(product_ids)
+    ).order_by('product_item__expiration_date', 'product_item__batch_no', 'product_item')
+
+    used_before = {}
+    risks = []
+    for row in balances.values_list(*BALANCE_COLUMNS):
+        location_id, facility_id, location_name, product_item_id, product_id, item_name, batch_no, \
+            expiration_date, program_id, quantity = row
+        pair = (facility_id, product_id)
+        if pair not in pairs:
+            continue
+        daily = rates.get(pair, 0.0)
+        days_left = max((expiration_date - today).days, 0)
+        #quantity of the batch used before it expires, after the batches that expire before it
+        used = min(quantity, max(int(daily * days_left - used_before.get(pair, 0)), 0))
+        used_before[pair] = used_before.get(pair, 0) + used
+        if used < quantity:
+            risk = ExpiryRisk(facility_id=facility_id, product_id=product_id, storage_location_id=location_id,
+                              product_item_id=product_item_id, program_id=program_id,
+                              expiration_date=expiration_date, quantity_on_hand=quantity,
+                              quantity_at_risk=quantity - used, daily_consumption=daily)
+            risk.description = '{item} batch {batch_no} at {location}: {at_risk} of {quantity} expire on {date} ' \
+                               'before they are used.'.format(item=item_name, batch_no=batch_no,
+                                                              location=location_name, at_risk=quantity - used,
+                                                              quantity=quantity, date=expiration_date)[:200]
+            risks.append(risk)
+    return risks
+
+
+def scan_expiry_risks(full=False):
+    """
+        runs a scan and returns the ExpiryRiskScan, see the module doc. a full scan rescans every pair.
+    """
+    now = timezone.now()
+    today = timezone.localtime(now).date()
+    horizon_date = today + datetime.timedelta(days=getattr(settings, 'EXPIRY_RISK_HORIZON_DAYS', 365))
+    last_scan = ExpiryRiskScan.objects.filter(finished_at__isnull=False).order_by('-started_at').first()
+    since = None if full or last_scan is None else last_scan.started_at
+    scan = ExpiryRiskScan.objects.create(started_at=now)
+
+    pairs = get_changed_pairs(since, today, horizon_date)
+    rates = {}
+    if pairs:
+        consumption_days = getattr(settings, 'EXPIRY_RISK_CONSUMPTION_DAYS', 180)
+        for rate in get_consumption_rates(facility_ids=list(set(pair[0] for pair in pairs)),
+                                          product_ids=list(set(pair[1] for pair in pairs)),
+                                          since=today - datetime.timedelta(days=consumption_days)):
+            rates[(rate['facility'], rate['product'])] = rate['amc'] / DAYS_PER_MONTH
+    risks = compute_risks(pairs, today, horizon_date, rates)
+
+    with transaction.atomic():
+        existing = [risk for risk in ExpiryRisk.objects.filter(
+            facility__in=list(set(pair[0] for pair in pairs)), product__in=list(set(pair[1] for pair in pairs))
+        ).select_related('notification') if (risk.facility_id, risk.product_id) in pairs]
+        previous = dict(((risk.storage_location_id, risk.product_item_id, risk.program_id), risk) for risk in existing)
+
+        notifications = []
+        for risk in risks:
+            old = previous.get((risk.storage_location_id, risk.product_item_id, risk.program_id))
+            priority = get_priority((risk.expiration_date - today).days)
+            if not is_escalated(old, risk, priority):
+                risk.notification_id = old.notification_id
+                continue
+            risk.notification = OnSiteNotification(
+                source_id=risk.facility_id, destination_id=risk.facility_id, message=risk.description,
+                priority_level=priority, date_time=now)
+            notifications.append(risk.notification)
+        OnSiteNotification.objects.bulk_create(notifications)
+        for risk in risks:
+            if risk.notification_id is None and getattr(risk, 'notification', None) is not None:
+                #bulk_create() gave the notification its uuid, assigning it again sets notification_id
+                risk.notification = risk.notification
+
+        ExpiryRisk.objects.filter(pk__in=[risk.pk for risk in existing]).delete()
+        ExpiryRisk.objects.bulk_create(risks, batch_size=1000)
+
+        scan.pairs_scanned = len(pairs)
+        scan.risks_found = len(risks)
+        scan.finished_at = timezone.now()
+        scan.save()
+    return scan
@@ -0,0 +1,194 @@
+"""
+    inventory/ledger.py recomputes StockBalance rows from the full movement history, it is only needed to
+    initialise the ledger or to repair it after writes that bypassed the models, e.g raw SQL, balances are otherwise
+    kept up to date as movements are saved.
+
+    it also answers what the balances were at a past time from periodic StockSnapshot rows and the StockLedgerEntry
+    journal. past times are business dates: a shipment received last week counts from the date it was received, not
+    from when it was entered. the journal starts when the ledger is first built, movements recorded before then are
+    all posted by the first rebuild.
+"""
+
+#import core django modules
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+from django.db.models import Sum
+from django.utils import timezone
+
+#import project modules
+from core.models import ProcessingPeriod
+from core.uom import UOMConverter
+from inventory.models import (StockBalance, StockLedgerEntry, StockSnapshot, StockSnapshotLine, IncomingShipmentLine,
+                              OutgoingShipmentLine, OutgoingShipment, Adjustment)
+
+
+def lock_stock_balances(using=DEFAULT_DB_ALIAS, mode='SHARE ROW EXCLUSIVE'):
+    """
+        locks the balance table against postings until the end of the current transaction, it is a no-op on
+        databases other than PostgreSQL.
+    """
+    if connections[using].vendor == 'postgresql':
+        connections[using].cursor().execute('LOCK TABLE {table} IN {mode} MODE'.format(
+            table=StockBalance._meta.db_table, mode=mode))
+
+
+def add_totals(balances, rows, location_key, quantity_key, sign=1):
+    for row in rows:
+        key = (row[location_key], row['product_item'], row['program'])
+        balances[key] = balances.get(key, 0) + sign * (row[quantity_key] or 0)
+
+
+def add_converted_totals(balances, rows, converter, location_key, sign=1):
+    """
+        adds rows summed per quantity_uom to the balances like add_totals(), each total is converted from its
+        quantity_uom to the base unit of the product and rounded to a whole number. postings round every line on
+        its own, so the two only differ when line quantities are not whole numbers of base units.
+    """
+    for row in rows:
+        total = row['total'] or 0
+        if row['quantity_uom'] != row['product_item__product__base_uom']:
+            total = int(round(converter.convert(total, row['quantity_uom'], row['product_item__product__base_uom'],
+                                                rounded=False)))
+        key = (row[location_key], row['product_item'], row['program'])
+        balances[key] = balances.get(key, 0) + sign * total
+
+
+def compute_stock_balances(storage_location_ids=None, using=DEFAULT_DB_ALIAS):
+    """
+        returns dict of {(storage location id, product item id, program id): quantity} summed from every posted
+        movement with one grouped query per movement type. shipment lines are summed per unit and converted to the
+        base unit of the product.
+    """
+    incoming = IncomingShipmentLine.objects.using(using).filter(incoming_shipment__is_deleted=False)
+    outgoing = OutgoingShipmentLine.objects.using(using).filter(
+        outgoing_shipment__is_deleted=False, outgoing_shipment__status=OutgoingShipment.STATUS.done)
+    adjustments = Adjustment.objects.using(using).filter(storage_location__isnull=False, product_item__isnull=False)
+    if storage_location_ids is not None:
+        incoming = incoming.filter(incoming_shipment__input_warehouse__in=storage_location_ids)
+        outgoing = outgoing.filter(outgoing_shipment__output_warehouse__in=storage_location_ids)
+        adjustments = adjustments.filter(storage_location__in=storage_location_ids)
+
+    balances, converter = {}, UOMConverter()
+    units = ('product_item', 'program', 'quantity_uom', 'product_item__product__base_uom')
+    add_converted_totals(balances, incoming.values('incoming_shipment__input_warehouse', *units)
+                         .annotate(total=Sum('quantity')), converter, 'incoming_shipment__input_warehouse')
+    add_converted_totals(balances, outgoing.values('outgoing_shipment__output_warehouse', *units)
+                         .annotate(total=Sum('quantity_issued')), converter, 'outgoing_shipment__output_warehouse',
+                         sign=-1)
+    add_totals(balances, adjustments.values('storage_location', 'product_item', 'program')
+               .annotate(total=Sum('revised_quantity')), 'storage_location', 'total')
+    add_totals(balances, adjustments.values('storage_location', 'product_item', 'program')
+               .annotate(total=Sum('previous_quantity')), 'storage_location', 'total', sign=-1)
+    return balances
+
+
+def rebuild_stock_balances(storage_location_ids=None, using=DEFAULT_DB_ALIAS):
+    """
+        recomputes StockBalance rows of the given storage locations or of every storage location and returns tuple
+        of (created, updated) number of balances.
+
+        the balance table is locked against postings while the history is summed, so movements saved during the
+        rebuild are either included in the sums or posted on top of the rebuilt balances, never lost or counted
+        twice. existing balances are updated in place so their uuids stay the same.
+    """
+    with transaction.atomic(using=using):
+        lock_stock_balances(using)
+        computed = compute_stock_balances(storage_location_ids, using)
+
+        existing = StockBalance.all_objects.using(using)
+        if storage_location_ids is not None:
+            existing = existing.filter(storage_location__in=storage_location_ids)
+        now = timezone.now()
+        corrections = {}
+        for pk, location_id, product_item_id, program_id, quantity in existing.values_list(
+                'pk', 'storage_location', 'product_item', 'program', 'quantity'):
+            key = (location_id, product_item_id, program_id)
+            expected = computed.pop(key, 0)
+            if expected != quantity:
+                StockBalance.all_objects.using(using).filter(pk=pk).update(quantity=expected, modified=now)
+                corrections[key] = expected - quantity
+        created = dict((key, quantity) for key, quantity in computed.items() if quantity)
+
+        StockBalance.all_objects.using(using).bulk_create([
+            StockBalance(storage_location_id=location_id, product_item_id=product_item_id, program_id=program_id,
+                         quantity=quantity)
+            for (location_id, product_item_id, program_id), quantity in created.items()])
+        #journal the corrections so balances worked out from snapshots agree with the rebuilt balances, the history
+        #they repair is not known so they are effective now
+        corrections.update(created)
+        StockLedgerEntry.objects.using(using).bulk_create([
+            StockLedgerEntry(storage_location_id=location_id, product_item_id=product_item_id, program_id=program_id,
+                             quantity=quantity, effective_at=now, posted_at=now)
+            for (location_id, product_item_id, program_id), quantity in corrections.items()])
+    return len(created), len(corrections) - len(created)
+
+
+def get_stock_balances_as_of(as_of, storage_location_ids=None, product_item_ids=None, using=DEFAULT_DB_ALIAS):
+    """
+        returns dict of {(storage location id, product item id, program id): quantity} of non zero balances as of the
+        given business date: the movements effective at or before it.
+
+        it starts from whichever is closest to as_of of the last snapshot taken before it, the first snapshot taken
+        after it and the current balances, then adds (or takes away) only the journal entries effective between the
+        two, so the cost is bounded by the snapshot interval and not by the length of the history. current balances
+        include movements dated in the future, so every entry effective after as_of is taken away from them.
+    """
+    now = timezone.now()
+    snapshots = StockSnapshot.objects.using(using)
+    candidates = [(abs(now - as_of), None, None)]
+    for snapshot in (snapshots.filter(taken_at__lte=as_of).order_by('-taken_at').first(),
+                     snapshots.filter(taken_at__gt=as_of).order_by('taken_at').first()):
+        if snapshot is not None:
+            candidates.append((abs(snapshot.taken_at - as_of), snapshot, snapshot.taken_at))
+    _, snapshot, start = min(candidates, key=lambda candidate: candidate[0])
+
+    entries = StockLedgerEntry.objects.using(using)
+    if snapshot is None:
+        base = StockBalance.all_objects.using(using).all()
+        entries, sign = entries.filter(effective_at__gt=as_of), -1
+    else:
+        base = StockSnapshotLine.objects.using(using).filter(snapshot=snapshot)
+        if start > as_of:
+            entries, sign = entries.filter(effective_at__gt=as_of, effective_at__lte=start), -1
+        else:
+            entries, sign = entries.filter(effective_at__gt=start, effective_at__lte=as_of), 1
+    if storage_location_ids is not None:
+        base = base.filter(storage_location__in=storage_location_ids)
+        entries = entries.filter(storage_location__in=storage_location_ids)
+    if product_item_ids is not None:
+        base = base.filter(product_item__in=product_item_ids)
+        entries = entries.filter(product_item__in=product_item_ids)
+
+    balances = {}
+    add_totals(balances, base.values('storage_location', 'product_item', 'program', 'quantity'), 'storage_location',
+               'quantity')
+    add_totals(balances, entries.values('storage_location', 'product_item', 'program').annotate(total=Sum('quantity')),
+               'storage_location', 'total', sign)
+    return dict((key, quantity) for key, quantity in balances.items() if quantity)
+
+
+def take_stock_snapshot(as_of=None, processing_period=None, using=DEFAULT_DB_ALIAS):
+    """
+        records every balance as of the given business date, or now, and returns the StockSnapshot. postings wait for
+        the snapshot to be taken so the balances and the journal are read consistently, movements posted later with
+        an earlier date are added to the snapshot as they are posted.
+    """
+    with transaction.atomic(using=using):
+        lock_stock_balances(using, mode='SHARE')
+        as_of = as_of or timezone.now()
+        balances = get_stock_balances_as_of(as_of, using=using)
+        snapshot = StockSnapshot.objects.using(using).create(taken_at=as_of, processing_period=processing_period)
+        StockSnapshotLine.objects.using(using).bulk_create([
+            StockSnapshotLine(snapshot=snapshot, storage_location_id=location_id, product_item_id=product_item_id,
+                              program_id=program_id, quantity=quantity)
+            for (location_id, product_item_id, program_id), quantity in balances.items()], batch_size=1000)
+    return snapshot
+
+
+def take_processing_period_snapshots(using=DEFAULT_DB_ALIAS):
+    """
+        takes a snapshot at the end of every processing period that has ended and has no snapshot yet, returns list
+        of the snapshots taken.
+    """
+    periods = ProcessingPeriod.objects.using(using).filter(end_date__lte=timezone.now(),
+                                                           stock_snapshot__isnull=True).order_by('end_date')
+    return [take_stock_snapshot(period.end_date, period, using) for period in periods]
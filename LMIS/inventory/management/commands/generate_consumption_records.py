@@ -0,0 +1,43 @@
+"""
+    manage.py generate_consumption_records generates draft consumption records of a processing period from the stock
+    ledger.
+"""
+
+#import core python modules
+from optparse import make_option
+
+#import core django modules
+from django.core.management.base import BaseCommand, CommandError
+
+#import project modules
+from core.models import Employee, ProcessingPeriod
+from inventory.consumption import generate_consumption_records
+
+
+class Command(BaseCommand):
+    args = '<processing_period_name>'
+    help = 'Generates draft consumption records of the given processing period for every facility.'
+    option_list = BaseCommand.option_list + (
+        make_option('--employee', action='store', dest='employee',
+                    help='Code of the employee the records are performed by.'),
+        make_option('--processes', action='store', type='int', dest='processes', default=1,
+                    help='Number of worker processes. Defaults to 1.'),
+        make_option('--chunk-size', action='store', type='int', dest='chunk_size', default=50,
+                    help='Number of facilities per chunk of work. Defaults to 50.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Expected the name of a processing period.')
+        try:
+            period = ProcessingPeriod.objects.get(name=args[0])
+        except ProcessingPeriod.DoesNotExist:
+            raise CommandError('Unknown processing period: {name}'.format(name=args[0]))
+        try:
+            employee = Employee.objects.get(code=options['employee'])
+        except Employee.DoesNotExist:
+            raise CommandError('Unknown employee: {code}'.format(code=options['employee']))
+
+        created = generate_consumption_records(period, employee, chunk_size=options['chunk_size'],
+                                               processes=options['processes'])
+        self.stdout.write('{created} consumption record(s) created.'.format(created=created))
@@ -0,0 +1,36 @@
+"""
+    manage.py rebuild_stock_balances recomputes stock on hand balances from the movement history.
+"""
+
+#import core python modules
+from optparse import make_option
+
+#import core django modules
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+#import project modules
+from cce.models import StorageLocation
+from inventory.ledger import rebuild_stock_balances
+
+
+class Command(BaseCommand):
+    args = '<storage_location_code storage_location_code ...>'
+    help = 'Recomputes stock balances of the given storage locations or of all storage locations.'
+    option_list = BaseCommand.option_list + (
+        make_option('--database', action='store', dest='database', default=DEFAULT_DB_ALIAS,
+                    help='Nominates a database to rebuild the balances on. Defaults to the "default" database.'),
+    )
+
+    def handle(self, *codes, **options):
+        storage_location_ids = None
+        if codes:
+            locations = dict(StorageLocation.all_objects.using(options['database']).filter(code__in=codes)
+                             .values_list('code', 'pk'))
+            missing = set(codes) - set(locations)
+            if missing:
+                raise CommandError('Unknown storage location(s): {codes}'.format(codes=', '.join(sorted(missing))))
+            storage_location_ids = list(locations.values())
+        created, updated = rebuild_stock_balances(storage_location_ids, using=options['database'])
+        self.stdout.write('{created} balance(s) created, {updated} balance(s) updated.'.format(
+            created=created, updated=updated))
@@ -0,0 +1,25 @@
+"""
+    manage.py scan_expiry_risks flags batches that will expire before they are used, run it from cron.
+"""
+
+#import core python modules
+from optparse import make_option
+
+#import core django modules
+from django.core.management.base import BaseCommand
+
+#import project modules
+from inventory.expiry import scan_expiry_risks
+
+
+class Command(BaseCommand):
+    help = 'Scans stock on hand for batches projected to expire before they are used.'
+    option_list = BaseCommand.option_list + (
+        make_option('--full', action='store_true', dest='full', default=False,
+                    help='Rescans all stock instead of what changed since the last scan.'),
+    )
+
+    def handle(self, *args, **options):
+        scan = scan_expiry_risks(full=options['full'])
+        self.stdout.write('{pairs} facility product(s) scanned, {risks} batch(es) at risk.'.format(
+            pairs=scan.pairs_scanned, risks=scan.risks_found))
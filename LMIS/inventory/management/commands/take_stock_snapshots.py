@@ -0,0 +1,31 @@
+"""
+    manage.py take_stock_snapshots records stock balances at the end of each processing period, run it from cron.
+"""
+
+#import core python modules
+from optparse import make_option
+
+#import core django modules
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+#import project modules
+from inventory.ledger import take_processing_period_snapshots, take_stock_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Takes stock balance snapshots of processing periods that have ended and have no snapshot yet.'
+    option_list = BaseCommand.option_list + (
+        make_option('--now', action='store_true', dest='now', default=False,
+                    help='Also takes a snapshot of the current balances.'),
+        make_option('--database', action='store', dest='database', default=DEFAULT_DB_ALIAS,
+                    help='Nominates a database to take the snapshots on. Defaults to the "default" database.'),
+    )
+
+    def handle(self, *args, **options):
+        snapshots = take_processing_period_snapshots(using=options['database'])
+        if options['now']:
+            snapshots.append(take_stock_snapshot(using=options['database']))
+        for snapshot in snapshots:
+            self.stdout.write('Took snapshot as of {taken_at}'.format(taken_at=snapshot.taken_at))
+        self.stdout.write('{count} snapshot(s) taken.'.format(count=len(snapshots)))
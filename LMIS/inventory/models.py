@@ -4,7 +4,11 @@
 """
 
 #import core django modules
-from django.db import models
+from django.db import models, transaction, connections, IntegrityError, DEFAULT_DB_ALIAS
+from django.db.models import F, Max
+from django.db.models.signals import post_syncdb, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.translation import ugettext as _
 
 #import external modules
@@ -13,7 +17,10 @@ from model_utils import Choices
 
 #import project modules
 from cce.models import StorageLocation
-from core.models import BaseModel, ProductItem, UnitOfMeasurement, Employee, VVMStage
+from core.indexes import get_existing_indexes
+from core.models import BaseModel, Product, ProductItem, UnitOfMeasurement, Employee, VVMStage, ProcessingPeriod
+from core.signals import post_update_is_deleted
+from core.uom import UOMConverter
 from orders.models import Voucher
 from facilities.models import Facility
 from partners.models import Program
@@ -47,6 +54,374 @@ class InventoryLine(BaseModel):
     active = models.BooleanField()
 
 
+def negate_movements(movements):
+    """
+        returns the given (storage location id, product item id, program id, quantity, effective_at) movements
+        reversed
+    """
+    return [(location_id, product_item_id, program_id, -quantity, effective_at)
+            for location_id, product_item_id, program_id, quantity, effective_at in movements]
+
+
+def get_base_uom_ids(product_item_ids):
+    """
+        returns dict of {product item id: id of the base unit of measurement of its product} of the given product
+        items, ids are strings.
+    """
+    items = ProductItem.objects.filter(pk__in=set(product_item_ids)).values_list('pk', 'product__base_uom')
+    return dict((str(product_item_id), str(base_uom_id)) for product_item_id, base_uom_id in items)
+
+
+def get_balance_lock_key(key):
+    """
+        returns sort key of a (storage location id, product item id, program id) balance key. balances are always
+        locked in this order: ids compared byte by byte, no program first. StockBalanceManager.locked() has the
+        database order rows the same way.
+    """
+    return tuple('' if value is None else str(value) for value in key)
+
+
+def post_backdated_entries(entries):
+    """
+        adds dict of {(storage location id, product item id, program id, effective_at): quantity} journal entries to
+        the lines of the snapshots taken at or after their effective_at, so snapshots stay the balances as of their
+        taken_at when movements are recorded late or their date is changed.
+    """
+    latest = StockSnapshot.objects.aggregate(latest=Max('taken_at'))['latest']
+    if latest is None:
+        return
+    for (location_id, product_item_id, program_id, effective_at), quantity in entries.items():
+        if effective_at > latest:
+            continue
+        snapshot_ids = set(StockSnapshot.objects.filter(taken_at__gte=effective_at).values_list('pk', flat=True))
+        lines = StockSnapshotLine.objects.filter(snapshot__in=snapshot_ids, storage_location_id=location_id,
+                                                 product_item_id=product_item_id, program=program_id)
+        updated = set(lines.values_list('snapshot', flat=True))
+        lines.update(quantity=F('quantity') + quantity)
+        StockSnapshotLine.objects.bulk_create([
+            StockSnapshotLine(snapshot_id=snapshot_id, storage_location_id=location_id,
+                              product_item_id=product_item_id, program_id=program_id, quantity=quantity)
+            for snapshot_id in snapshot_ids - updated])
+
+
+class StockBalanceManager(models.Manager):
+    """
+        StockBalance manager, post_movements() is the only way balances should be changed outside of a rebuild.
+    """
+    def post_movements(self, movements):
+        """
+            adds list of (storage location id, product item id, program id, quantity, effective_at) movements to the
+            balances and journals them as of their effective_at, the business date of the movement.
+
+            movements of the same balance are added up first and balances are updated in key order, so concurrent
+            postings lock balance rows in the same order and can not deadlock. each balance is changed with
+            "UPDATE ... SET quantity = quantity + n", which takes the row lock, so concurrent postings never lose
+            updates. missing balances are created. a movement whose date changed cancels out on the balance but still
+            moves its journal entry.
+        """
+        totals, entries = {}, {}
+        for location_id, product_item_id, program_id, quantity, effective_at in movements:
+            key = (location_id, product_item_id, program_id)
+            totals[key] = totals.get(key, 0) + quantity
+            entries[key + (effective_at,)] = entries.get(key + (effective_at,), 0) + quantity
+
+        now = timezone.now()
+        keys = sorted([key for key, quantity in totals.items() if quantity], key=get_balance_lock_key)
+        entries = dict((key, quantity) for key, quantity in entries.items() if quantity)
+        if not entries:
+            return
+        with transaction.atomic():
+            for key in keys:
+                self.add_quantity(key, totals[key], now)
+            StockLedgerEntry.objects.bulk_create([
+                StockLedgerEntry(storage_location_id=key[0], product_item_id=key[1], program_id=key[2],
+                                 quantity=quantity, effective_at=key[3], posted_at=now)
+                for key, quantity in entries.items()])
+            post_backdated_entries(entries)
+
+    def locked(self):
+        """
+            returns queryset of balances locked with SELECT ... FOR UPDATE in get_balance_lock_key() order. ids are
+            compared with the C collation on PostgreSQL, the default collation may order them differently.
+        """
+        collate = ' COLLATE "C"' if connections[self.db].vendor == 'postgresql' else ''
+        columns = ('storage_location_id', 'product_item_id', "COALESCE(program_id, '')")
+        select = dict(('lock_order_{index}'.format(index=index), column + collate)
+                      for index, column in enumerate(columns))
+        return self.select_for_update().extra(select=select, order_by=sorted(select))
+
+    def add_quantity(self, key, quantity, now):
+        location_id, product_item_id, program_id = key
+        balances = self.filter(storage_location_id=location_id, product_item_id=product_item_id, program=program_id)
+        if balances.update(quantity=F('quantity') + quantity, modified=now):
+            return
+        try:
+            with transaction.atomic():
+                self.create(storage_location_id=location_id, product_item_id=product_item_id,
+                            program_id=program_id, quantity=quantity)
+        except IntegrityError:
+            #created by a concurrent posting since the update above
+            balances.update(quantity=F('quantity') + quantity, modified=now)
+
+
+class StockBalance(BaseModel):
+    """
+        StockBalance is the quantity of a product item on hand at a storage location for a program. It is a
+        materialized sum of every posted movement: incoming shipment lines, outgoing shipment lines of done
+        shipments and adjustments. It is kept up to date in the same transaction the movements are saved in and can
+        be recomputed from history with "manage.py rebuild_stock_balances".
+
+        Quantities are in the base unit of measurement of the product, movements are converted to it when they are
+        posted, see StockMovementModel.get_stock_movements().
+    """
+    storage_location = models.ForeignKey(StorageLocation, related_name='stock_balances')
+    product_item = models.ForeignKey(ProductItem)
+    program = models.ForeignKey(Program, blank=True, null=True)
+    quantity = models.IntegerField(default=0)
+
+    all_objects = models.Manager()
+    objects = StockBalanceManager()
+
+    class Meta:
+        unique_together = ('storage_location', 'product_item', 'program')
+
+
+class StockLedgerEntry(BaseModel):
+    """
+        StockLedgerEntry is the journal of changes posted to StockBalance, one entry per balance and business date
+        changed by a posting. effective_at is the business date of the movements, e.g the date a shipment was
+        received, posted_at is when they were saved. balances at a past time are worked out from the nearest
+        StockSnapshot and the entries effective between the snapshot and that time.
+    """
+    storage_location = models.ForeignKey(StorageLocation, related_name='stock_ledger_entries')
+    product_item = models.ForeignKey(ProductItem)
+    program = models.ForeignKey(Program, blank=True, null=True)
+    quantity = models.IntegerField()
+    #the default only fills in entries journaled before effective_at was added, see docs/upgrade.rst
+    effective_at = models.DateTimeField(default=timezone.now)
+    posted_at = models.DateTimeField()
+
+    class Meta:
+        index_together = (('storage_location', 'effective_at'), ('effective_at',))
+
+
+class StockSnapshot(BaseModel):
+    """
+        StockSnapshot records every stock balance as of taken_at, e.g the end of a processing period: the movements
+        effective at or before taken_at. movements recorded later with an earlier date are added to its lines.
+    """
+    taken_at = models.DateTimeField(db_index=True)
+    processing_period = models.OneToOneField(ProcessingPeriod, blank=True, null=True,
+                                             related_name='stock_snapshot')
+
+    def __str__(self):
+        return '{taken_at}'.format(taken_at=self.taken_at)
+
+
+class StockSnapshotLine(BaseModel):
+    """
+        This is the quantity of a product item on hand at a storage location for a program when the snapshot was
+        taken, balances that were zero are left out.
+    """
+    snapshot = models.ForeignKey(StockSnapshot, related_name='lines')
+    storage_location = models.ForeignKey(StorageLocation, related_name='stock_snapshot_lines')
+    product_item = models.ForeignKey(ProductItem)
+    program = models.ForeignKey(Program, blank=True, null=True)
+    quantity = models.IntegerField()
+
+    class Meta:
+        index_together = (('snapshot', 'storage_location'),)
+
+
+class StockMovementManager(models.Manager):
+    """
+        objects manager of stock movement models, it leaves out soft deleted objects and posts the movements of
+        objects created with bulk_create()
+    """
+    def get_queryset(self):
+        return super(StockMovementManager, self).get_queryset().filter(is_deleted=False)
+
+    def bulk_create(self, objs, batch_size=None):
+        with transaction.atomic():
+            objs = super(StockMovementManager, self).bulk_create(objs, batch_size=batch_size)
+            StockBalance.objects.post_movements(self.model.get_bulk_stock_movements(objs))
+        return objs
+
+
+class StockMovementModel(BaseModel):
+    """
+        abstract base of records that move stock in or out of a storage location. the change from the saved
+        movements to the new ones is posted to StockBalance in the same transaction as save() and delete().
+
+        location_field: name of the foreign key to the storage location the record is posted to.
+        quantity_field: name of the field holding the quantity moved, quantity_sign is -1 for stock going out.
+        quantity_uom_field: name of the foreign key to the unit of the quantity, None if the quantity is in the base
+        unit of the product.
+        date_field: name of the field holding the business date of the movement.
+    """
+    location_field = None
+    quantity_field = None
+    quantity_sign = 1
+    quantity_uom_field = None
+    date_field = None
+
+    #all_objects stays the default manager, see BaseModel
+    all_objects = models.Manager()
+    objects = StockMovementManager()
+
+    class Meta:
+        abstract = True
+
+    def get_posting_location_id(self):
+        """
+            returns id of the storage location this record is posted to or None if it is not posted
+        """
+        if self.is_deleted:
+            return None
+        return getattr(self, self._meta.get_field(self.location_field).attname)
+
+    def get_quantity_moved(self):
+        return self.quantity_sign * getattr(self, self.quantity_field)
+
+    def get_quantity_uom_id(self):
+        if self.quantity_uom_field is None:
+            return None
+        return getattr(self, self._meta.get_field(self.quantity_uom_field).attname)
+
+    def get_effective_date(self):
+        return getattr(self, self.date_field)
+
+    def get_posted_quantity(self, converter=None, base_uom_ids=None):
+        """
+            returns get_quantity_moved() converted to the base unit of the product and rounded to a whole number, the
+            unit stock balances are kept in.
+
+            converter is the UOMConverter and base_uom_ids the get_base_uom_ids() of the product item, both are
+            loaded when they are not given.
+        """
+        quantity = self.get_quantity_moved()
+        uom_id = self.get_quantity_uom_id()
+        if uom_id is None:
+            return quantity
+        if base_uom_ids is None:
+            base_uom_ids = get_base_uom_ids([self.product_item_id])
+        base_uom_id = base_uom_ids[str(self.product_item_id)]
+        if str(uom_id) == base_uom_id:
+            return quantity
+        converter = converter or UOMConverter()
+        return int(round(converter.convert(quantity, uom_id, base_uom_id, rounded=False)))
+
+    def get_stock_movements(self, converter=None, base_uom_ids=None):
+        """
+            returns list of (storage location id, product item id, program id, quantity, effective_at) this record
+            posts, quantities are in the base unit of the product. see get_posted_quantity() for the arguments.
+        """
+        location_id = self.get_posting_location_id()
+        if location_id is None or self.product_item_id is None:
+            return []
+        return [(location_id, self.product_item_id, self.program_id,
+                 self.get_posted_quantity(converter, base_uom_ids), self.get_effective_date())]
+
+    @classmethod
+    def get_bulk_stock_movements(cls, objs):
+        """
+            loads the base units of the products of all objs with one query instead of one query per object.
+        """
+        base_uom_ids = get_base_uom_ids(obj.product_item_id for obj in objs if obj.product_item_id is not None)
+        converter = UOMConverter() if objs and cls.quantity_uom_field is not None else None
+        return [movement for obj in objs for movement in obj.get_stock_movements(converter, base_uom_ids)]
+
+    def get_saved_stock_movements(self):
+        saved = type(self).all_objects.filter(pk=self.pk).first() if self.pk else None
+        return saved.get_stock_movements() if saved is not None else []
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            previous = self.get_saved_stock_movements()
+            super(StockMovementModel, self).save(*args, **kwargs)
+            StockBalance.objects.post_movements(negate_movements(previous) + self.get_stock_movements())
+
+
+class StockMovementLine(StockMovementModel):
+    """
+        abstract base of document lines, lines are posted to the location returned by their document
+        get_posting_location_id().
+
+        document_field: name of the foreign key to the document.
+    """
+    document_field = None
+
+    class Meta:
+        abstract = True
+
+    def get_posting_location_id(self):
+        if self.is_deleted:
+            return None
+        return getattr(self, self.document_field).get_posting_location_id()
+
+    def get_effective_date(self):
+        return getattr(self, self.document_field).get_effective_date()
+
+    @classmethod
+    def get_bulk_stock_movements(cls, objs):
+        """
+            loads documents of all objs that are not set on them yet with one query instead of one query per line.
+        """
+        field = cls._meta.get_field(cls.document_field)
+        objs = list(objs)
+        unset = [obj for obj in objs if not hasattr(obj, field.get_cache_name())]
+        documents = field.rel.to.all_objects.in_bulk(list(set(getattr(obj, field.attname) for obj in unset)))
+        for obj in unset:
+            setattr(obj, cls.document_field, documents[getattr(obj, field.attname)])
+        return super(StockMovementLine, cls).get_bulk_stock_movements(objs)
+
+
+class StockDocument(BaseModel):
+    """
+        abstract base of documents whose lines are posted to a storage location: shipments. when a document is
+        moved, redated, cancelled, done or (soft) deleted the movements of all its lines are posted again.
+
+        lines_field: name of the related manager of the document lines.
+        location_field: name of the foreign key to the storage location the lines are posted to.
+        date_field: name of the field holding the business date the lines are posted as of.
+    """
+    lines_field = None
+    location_field = None
+    date_field = None
+
+    class Meta:
+        abstract = True
+
+    def get_posting_location_id(self):
+        """
+            returns id of the storage location lines of this document are posted to or None if they are not posted
+        """
+        if self.is_deleted:
+            return None
+        return getattr(self, self._meta.get_field(self.location_field).attname)
+
+    def get_effective_date(self):
+        return getattr(self, self.date_field)
+
+    def get_line_movements(self):
+        lines = list(getattr(self, self.lines_field).filter(is_deleted=False))
+        if not lines:
+            return []
+        for line in lines:
+            setattr(line, line.document_field, self)
+        return type(lines[0]).get_bulk_stock_movements(lines)
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            saved = type(self).all_objects.filter(pk=self.pk).first() if self.pk else None
+            super(StockDocument, self).save(*args, **kwargs)
+            if saved is None or (saved.get_posting_location_id() == self.get_posting_location_id() and
+                                 saved.get_effective_date() == self.get_effective_date()):
+                return
+            StockBalance.objects.post_movements(negate_movements(saved.get_line_movements()) +
+                                                self.get_line_movements())
+
+
 class InventoryLineAdjustment(BaseModel):
     """
         A one-to-many model for linking an inventory line to adjustments
@@ -59,10 +434,12 @@ class FacilityActivity(BaseModel):
     """
         This is abstract base model for activities that are performed at Facilities such as PhysicalStockCount,
         recording ConsumptionRecord
+
+        verified_by is empty until the activity is verified, e.g on generated draft consumption records.
     """
     facility = models.ForeignKey(Facility)
     performed_by = models.ForeignKey(Employee)
-    verified_by = models.ForeignKey(Employee, related_name='%(app_label)s_%(class)s_verifier')
+    verified_by = models.ForeignKey(Employee, related_name='%(app_label)s_%(class)s_verifier', blank=True, null=True)
 
     class Meta:
         abstract = True
@@ -71,8 +448,12 @@ class FacilityActivity(BaseModel):
 class PhysicalStockCount(FacilityActivity):
     """
         This is used record physical stock counts results.
+
+        storage_location is the storage location that was counted, counts are reconciled against its stock balances
+        by inventory.reconciliation.reconcile_physical_stock_count().
     """
-    pass
+    storage_location = models.ForeignKey(StorageLocation, blank=True, null=True,
+                                         related_name='%(app_label)s_%(class)s_storage_location')
 
 
 class PhysicalStockCountLine(BaseModel):
@@ -81,7 +462,7 @@ class PhysicalStockCountLine(BaseModel):
     """
     product_item = models.ForeignKey(ProductItem)
     program = models.ForeignKey(Program)
-    physical_stock_count = models.ForeignKey(PhysicalStockCount)
+    physical_stock_count = models.ForeignKey(PhysicalStockCount, related_name='physical_stock_count_lines')
     physical_quantity = models.IntegerField(verbose_name='%(app_label)s_%(class)s_counted_quantity')
     inventory_quantity = models.IntegerField()
     quantity_uom = models.ForeignKey(UnitOfMeasurement, related_name='%(app_label)s_%(class)s_quantity_uom')
@@ -111,6 +492,7 @@ class ConsumptionRecordLine(BaseModel):
         ConsumptionRecord start and end date
 
         previous_balance = stock balance before start date
+        quantity_adjusted = stock found less stock missing or given to others, adjustments other than discards
     """
     product_item = models.ForeignKey(ProductItem)
     program = models.ForeignKey(Program)
@@ -120,6 +502,7 @@ class ConsumptionRecordLine(BaseModel):
     quantity_received = models.IntegerField()
     consumption_record = models.ForeignKey(ConsumptionRecord)
     total_discarded = models.IntegerField()
+    quantity_adjusted = models.IntegerField(default=0)
     quantity_uom = models.ForeignKey(UnitOfMeasurement)
 
 
@@ -154,7 +537,7 @@ class StockEntry(BaseModel):
         abstract = True
 
 
-class IncomingShipment(BaseModel):
+class IncomingShipment(StockDocument):
     """
         This is used to record stock arrival from supplier or supplying facility.
 
@@ -170,14 +553,20 @@ class IncomingShipment(BaseModel):
     other = models.BooleanField(default=False)
     other_source = models.CharField(max_length=35, blank=True, help_text='Enter source of shipment if stock entry type '
                                                                         'is "Other".')
+    received_at = models.DateTimeField(default=timezone.now, help_text='Date the stock arrived at the input warehouse.')
 
+    lines_field = 'incoming_shipment_lines'
+    location_field = 'input_warehouse'
+    date_field = 'received_at'
 
-class IncomingShipmentLine(BaseModel):
+
+class IncomingShipmentLine(StockMovementLine):
     """
         This is used to record the detail of each unique item of an IncomingShipment
     """
     incoming_shipment = models.ForeignKey(IncomingShipment, related_name='incoming_shipment_lines')
     product_item = models.ForeignKey(ProductItem)
+    program = models.ForeignKey(Program, blank=True, null=True)
     quantity = models.IntegerField()
     quantity_uom = models.ForeignKey(UnitOfMeasurement,
                                      related_name='%(app_label)s_%(class)s_quantity_uom')
@@ -188,28 +577,49 @@ class IncomingShipmentLine(BaseModel):
     vvm_stage = models.IntegerField(choices=VVMStage.STAGES, blank=True, null=True)
     voucher = models.ForeignKey(Voucher, blank=True, null=True)
 
+    document_field = 'incoming_shipment'
+    quantity_field = 'quantity'
+    quantity_uom_field = 'quantity_uom'
+
 
-class OutgoingShipment(BaseModel):
+class OutgoingShipment(StockDocument):
     """
         This is used to track stock movements out to recipient or receiving facility
 
         output_warehouse is the storage location the product item will be shipped from and it belongs to the supplying
         facility from the output_warehouse: we can get the facility that made the supply.
+
+        status is changed with inventory.posting.transition_outgoing_shipment() which fills in quantity_before and
+        quantity_after of the lines from the locked stock balances.
     """
     STATUS = Choices((0, 'draft', ('Draft')), (1, 'assigned', ('Assigned')), (2, 'done', ('Done')),
                      (3, 'cancelled', ('Cancelled'))
                      )
     recipient = models.ForeignKey(Facility)
     output_warehouse = models.ForeignKey(StorageLocation)
-    status = models.IntegerField(choices=STATUS)
+    status = models.IntegerField(choices=STATUS, default=STATUS.draft)
+    shipped_at = models.DateTimeField(default=timezone.now, help_text='Date the stock left the output warehouse.')
 
+    lines_field = 'outgoing_shipment_lines'
+    location_field = 'output_warehouse'
+    date_field = 'shipped_at'
 
-class OutgoingShipmentLine(BaseModel):
+    def get_posting_location_id(self):
+        """
+            stock leaves the output warehouse when the shipment is done
+        """
+        if self.status != self.STATUS.done:
+            return None
+        return super(OutgoingShipment, self).get_posting_location_id()
+
+
+class OutgoingShipmentLine(StockMovementLine):
     """
         This is used to record the detail of each unique product item of an OutgoingShipment
     """
     outgoing_shipment = models.ForeignKey(OutgoingShipment, related_name='outgoing_shipment_lines')
     product_item = models.ForeignKey(ProductItem)
+    program = models.ForeignKey(Program, blank=True, null=True)
     quantity_issued = models.IntegerField()
     quantity_uom = models.ForeignKey(UnitOfMeasurement, related_name='%(app_label)s_%(class)s_quantity_uom')
     weight_issued = models.FloatField(blank=True, null=True)
@@ -218,10 +628,15 @@ class OutgoingShipmentLine(BaseModel):
     volume = models.FloatField(blank=True, null=True)
     volume_uom = models.ForeignKey(UnitOfMeasurement, blank=True, null=True,
                                    related_name='%(app_label)s_%(class)s_volume_uom')
-    quantity_before = models.IntegerField()
-    quantity_after = models.IntegerField()
+    quantity_before = models.IntegerField(default=0)
+    quantity_after = models.IntegerField(default=0)
     remark = models.CharField(max_length=55, blank=True, null=True)
 
+    document_field = 'outgoing_shipment'
+    quantity_field = 'quantity_issued'
+    quantity_uom_field = 'quantity_uom'
+    quantity_sign = -1
+
 
 class AdjustmentType(BaseModel):
     """
@@ -232,25 +647,74 @@ class AdjustmentType(BaseModel):
             VVM: this is adjustment type for quantity discarded due to VVM change.
             Missing: this is adjustment type for missing quantity recorded during physical stock count.
             Others: this is adjustment type for quantity distributed to others.
+            Found: this is adjustment type for surplus quantity recorded during physical stock count.
     """
     TYPES = Choices((0, 'broken', ('Broken')), (1, 'expired', ('Expired')), (2, 'frozen', ('Frozen')),
-                    (3, 'vvm', ('VVM')), (4, 'missing', ('Missing')), (5, 'others', ('Others')))
+                    (3, 'vvm', ('VVM')), (4, 'missing', ('Missing')), (5, 'others', ('Others')),
+                    (6, 'found', ('Found')))
 
     class Meta:
         managed = False
         abstract = True
 
 
-class Adjustment(BaseModel):
+class Adjustment(StockMovementModel):
     """
         Adjustment is used to account for difference between physical stock count quantities and inventory quantity.
         It is used to reconcile the difference between Physical stock count quantity and inventory quantity for an
         item.
+
+        storage_location, product_item and program tell which stock balance is adjusted, adjustments without them
+        are not posted.
     """
     previous_quantity = models.IntegerField()
     revised_quantity = models.IntegerField()
     adjustment_type = models.IntegerField(choices=AdjustmentType.TYPES)
     reason = models.CharField(max_length=55, verbose_name='reason for adjustment')
+    storage_location = models.ForeignKey(StorageLocation, blank=True, null=True,
+                                         related_name='%(app_label)s_%(class)s_storage_location')
+    product_item = models.ForeignKey(ProductItem, blank=True, null=True)
+    program = models.ForeignKey(Program, blank=True, null=True)
+    adjusted_at = models.DateTimeField(default=timezone.now, help_text='Date the stock was adjusted.')
+
+    location_field = 'storage_location'
+    date_field = 'adjusted_at'
+
+    def get_quantity_moved(self):
+        return self.revised_quantity - self.previous_quantity
+
+
+class ExpiryRiskScan(BaseModel):
+    """
+        This records each run of the expiry risk scanner, the next run only rescans balances and consumption records
+        changed since started_at of the last finished run.
+    """
+    started_at = models.DateTimeField(db_index=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    pairs_scanned = models.IntegerField(default=0)
+    risks_found = models.IntegerField(default=0)
+
+
+class ExpiryRisk(BaseModel):
+    """
+        This is a batch (product item) on hand at a storage location that is projected to expire before it is used up
+        at the rate the facility consumes its product.
+
+        quantity_at_risk: part of quantity_on_hand projected to be left when the batch expires.
+    """
+    facility = models.ForeignKey(Facility)
+    product = models.ForeignKey(Product)
+    storage_location = models.ForeignKey(StorageLocation, related_name='expiry_risks')
+    product_item = models.ForeignKey(ProductItem)
+    program = models.ForeignKey(Program, blank=True, null=True)
+    expiration_date = models.DateField()
+    quantity_on_hand = models.IntegerField()
+    quantity_at_risk = models.IntegerField()
+    daily_consumption = models.FloatField()
+    notification = models.ForeignKey('alerts.OnSiteNotification', blank=True, null=True, on_delete=models.SET_NULL)
+
+    class Meta:
+        index_together = (('facility', 'product'),)
 
 
 #register models that will be tracked by Reversion
@@ -264,4 +728,52 @@ reversion.register(IncomingShipment)
 reversion.register(IncomingShipmentLine)
 reversion.register(OutgoingShipment)
 reversion.register(OutgoingShipmentLine)
-reversion.register(Adjustment)
\ No newline at end of file
+reversion.register(Adjustment)
+
+
+@receiver(post_delete)
+def post_deleted_stock_movements(sender, instance, **kwargs):
+    """
+        reverses movements of hard deleted stock movement records, it runs inside the delete transaction and before
+        documents of cascade deleted lines are deleted.
+    """
+    if isinstance(instance, StockMovementModel):
+        StockBalance.objects.post_movements(negate_movements(instance.get_stock_movements()))
+
+
+@receiver(post_update_is_deleted)
+def post_stock_movements_is_deleted(sender, uuids, is_deleted, **kwargs):
+    """
+        posts movements of stock movement records soft deleted or recovered by a set-based update
+    """
+    if issubclass(sender, StockMovementModel):
+        objs = list(sender.all_objects.filter(uuid__in=uuids))
+        for obj in objs:
+            obj.is_deleted = False
+        movements = sender.get_bulk_stock_movements(objs)
+    elif issubclass(sender, StockDocument):
+        movements = []
+        for document in sender.all_objects.filter(uuid__in=uuids):
+            document.is_deleted = False
+            movements.extend(document.get_line_movements())
+    else:
+        return
+    StockBalance.objects.post_movements(negate_movements(movements) if is_deleted else movements)
+
+
+@receiver(post_syncdb)
+def create_stock_balance_indexes(sender, created_models, db=DEFAULT_DB_ALIAS, **kwargs):
+    """
+        unique_together does not stop two balances of a product item without a program at one storage location
+        because NULL program ids never conflict, a partial unique index does. it is created on databases synced
+        before it was added too.
+    """
+    if sender.__name__ != __name__ or connections[db].vendor != 'postgresql':
+        return
+    table = StockBalance._meta.db_table
+    cursor = connections[db].cursor()
+    if '{table}_no_program_uniq'.format(table=table) in get_existing_indexes(cursor, table, db):
+        return
+    cursor.execute(
+        'CREATE UNIQUE INDEX {table}_no_program_uniq ON {table} (storage_location_id, product_item_id) '
+        'WHERE program_id IS NULL'.format(table=table))
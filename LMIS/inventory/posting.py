@@ -0,0 +1,101 @@
+"""
+    inventory/posting.py moves OutgoingShipment documents through their statuses on the server:
+
+        draft -> assigned -> done, draft or assigned -> cancelled and assigned -> draft.
+
+    assigning and posting lock the stock balances the shipment draws from, so quantity_before and quantity_after of
+    each line are worked out from the balances as they are when the shipment is posted and concurrent issuers from
+    the same warehouse queue up on the balance rows instead of overwriting each other's numbers.
+"""
+
+#import core django modules
+from django.db import transaction
+from django.db.models import Q
+
+#import project modules
+from core.uom import UOMConverter
+from inventory.models import OutgoingShipment, OutgoingShipmentLine, StockBalance, get_base_uom_ids
+
+
+STATUS = OutgoingShipment.STATUS
+
+#allowed status transitions of outgoing shipments
+TRANSITIONS = {
+    STATUS.draft: (STATUS.assigned, STATUS.cancelled),
+    STATUS.assigned: (STATUS.draft, STATUS.done, STATUS.cancelled),
+    STATUS.done: (),
+    STATUS.cancelled: (),
+}
+
+
+class PostingError(Exception):
+    """
+        raised when a shipment can not be moved to the requested status, e.g there is not enough stock.
+    """
+    pass
+
+
+def lock_stock_balances(storage_location_id, product_item_ids):
+    """
+        locks balances of the given product items at the storage location with SELECT ... FOR UPDATE and returns
+        dict of {(storage location id, product item id, program id): quantity}.
+
+        rows are locked in the order StockBalanceManager.post_movements() updates them, so a posting and an issuer
+        that draw from the same balances always lock them in the same order and can not deadlock.
+    """
+    balances = StockBalance.objects.locked().filter(storage_location=storage_location_id,
+                                                    product_item__in=set(product_item_ids))
+    return dict(((balance.storage_location_id, balance.product_item_id, balance.program_id), balance.quantity)
+                for balance in balances)
+
+
+def compute_line_quantities(shipment, lines, balances):
+    """
+        sets quantity_before and quantity_after of lines in order from the locked balances, raises PostingError if a
+        line issues more than is on hand. like the balances they are in the base unit of the product.
+    """
+    converter = UOMConverter()
+    base_uom_ids = get_base_uom_ids(line.product_item_id for line in lines)
+    running = dict(balances)
+    shortages = []
+    for line in lines:
+        key = (shipment.output_warehouse_id, line.product_item_id, line.program_id)
+        line.quantity_before = running.get(key, 0)
+        line.quantity_after = line.quantity_before + line.get_posted_quantity(converter, base_uom_ids)
+        running[key] = line.quantity_after
+        if line.quantity_after < 0:
+            shortages.append(str(line.product_item_id))
+    if shortages:
+        raise PostingError('Not enough stock of product item(s) {items}.'.format(items=', '.join(shortages)))
+
+
+def transition_outgoing_shipment(shipment_id, status, user=None):
+    """
+        moves the shipment to status in one transaction and returns it, raises PostingError if the transition is not
+        allowed or there is not enough stock.
+
+        the shipment row is locked first so transitions of one shipment run one at a time, then the balances it draws
+        from. when the shipment is done its lines are posted to the stock balances by OutgoingShipment.save().
+    """
+    with transaction.atomic():
+        shipment = OutgoingShipment.objects.select_for_update().get(pk=shipment_id)
+        if status not in TRANSITIONS.get(shipment.status, ()):
+            raise PostingError('Can not move shipment from status {current} to {status}.'.format(
+                current=shipment.status, status=status))
+
+        if status in (STATUS.assigned, STATUS.done):
+            lines = list(shipment.outgoing_shipment_lines.filter(is_deleted=False).order_by('created', 'uuid'))
+            if not lines:
+                raise PostingError('Shipment has no lines.')
+            balances = lock_stock_balances(shipment.output_warehouse_id, [line.product_item_id for line in lines])
+            compute_line_quantities(shipment, lines, balances)
+            for line in lines:
+                #update() leaves the ledger alone, lines are posted when the shipment is saved below
+                OutgoingShipmentLine.all_objects.filter(pk=line.pk).update(
+                    quantity_before=line.quantity_before, quantity_after=line.quantity_after)
+
+        shipment.status = status
+        if user is not None:
+            shipment.modified_by = user
+        shipment.save()
+    return shipment
@@ -0,0 +1,105 @@
+"""
+    inventory/reconciliation.py reconciles a physical stock count against the stock balances of the counted storage
+    location and records the variances as adjustments.
+"""
+
+#import core python modules
+import uuid
+
+#import core django modules
+from django.db import transaction
+from django.utils.encoding import smart_text
+
+#import project modules
+from core.uom import UOMConverter, UOMConversionError
+from inventory.models import (Adjustment, AdjustmentType, PhysicalStockCount, PhysicalStockCountLine,
+                              PhysicalStockCountLineAdjustment, get_base_uom_ids)
+from inventory.posting import lock_stock_balances
+
+
+class ReconciliationError(Exception):
+    """
+        raised when a physical stock count can not be reconciled.
+    """
+    pass
+
+
+def reconcile_physical_stock_count(stock_count, user=None, dry_run=False):
+    """
+        compares every line of the stock count with the ledger balance of its product item and program and, unless
+        dry_run is True, records each variance as an Adjustment linked to the count line. returns a summary dict.
+
+        the lines are read with one query, the balances they are compared with are locked with one query, and the
+        adjustments and their links are inserted with two bulk inserts in one transaction. inserting the
+        adjustments posts them to the stock balances. lines counting the same product item and program are added up
+        after their quantities are converted to the base unit of the product, the unit balances are kept in.
+
+        the stock count row is locked before it is checked for earlier reconciliations, so two requests reconciling
+        the same count run one after the other and the second one fails. shortages are recorded as missing stock,
+        surpluses as found stock.
+    """
+    if stock_count.storage_location_id is None:
+        raise ReconciliationError('The stock count has no storage location.')
+
+    with transaction.atomic():
+        if not dry_run:
+            list(PhysicalStockCount.objects.select_for_update().filter(pk=stock_count.pk).values_list('pk'))
+        lines = list(PhysicalStockCountLine.objects.filter(physical_stock_count=stock_count).order_by('created')
+                     .only('uuid', 'product_item', 'program', 'physical_quantity', 'quantity_uom'))
+        if not dry_run and PhysicalStockCountLineAdjustment.objects.filter(
+                physical_stock_line__physical_stock_count=stock_count).exists():
+            raise ReconciliationError('The stock count has already been reconciled.')
+
+        location_id = stock_count.storage_location_id
+        balances = lock_stock_balances(location_id, [line.product_item_id for line in lines])
+        converter, base_uom_ids = UOMConverter(), get_base_uom_ids(line.product_item_id for line in lines)
+        counted, first_lines = {}, {}
+        for line in lines:
+            key = (location_id, line.product_item_id, line.program_id)
+            quantity = line.physical_quantity
+            base_uom_id = base_uom_ids[str(line.product_item_id)]
+            if str(line.quantity_uom_id) != base_uom_id:
+                try:
+                    quantity = int(round(converter.convert(quantity, line.quantity_uom_id, base_uom_id,
+                                                           rounded=False)))
+                except UOMConversionError as e:
+                    raise ReconciliationError('Line {line} can not be reconciled: {error}'.format(line=line.pk,
+                                                                                                 error=e))
+            counted[key] = counted.get(key, 0) + quantity
+            first_lines.setdefault(key, line)
+
+        variances, adjustments, links = [], [], []
+        for key, counted_quantity in counted.items():
+            ledger_quantity = balances.get(key, 0)
+            variance = counted_quantity - ledger_quantity
+            if not variance:
+                continue
+            _, product_item_id, program_id = key
+            variances.append({'product_item': product_item_id, 'program': program_id,
+                              'ledger_quantity': ledger_quantity, 'counted_quantity': counted_quantity,
+                              'variance': variance})
+            #uuids are given up front so the links can refer to the adjustments before they are inserted
+            adjustment = Adjustment(uuid=smart_text(uuid.uuid4()), previous_quantity=ledger_quantity,
+                                    revised_quantity=counted_quantity,
+                                    adjustment_type=AdjustmentType.TYPES.missing if variance < 0 else
+                                    AdjustmentType.TYPES.found,
+                                    reason='Physical stock count {variance:+d}'.format(variance=variance),
+                                    storage_location_id=location_id, product_item_id=product_item_id,
+                                    program_id=program_id, created_by=user, modified_by=user)
+            adjustments.append(adjustment)
+            links.append(PhysicalStockCountLineAdjustment(physical_stock_line=first_lines[key], adjustment=adjustment,
+                                                          created_by=user, modified_by=user))
+
+        if not dry_run and adjustments:
+            Adjustment.objects.bulk_create(adjustments)
+            PhysicalStockCountLineAdjustment.objects.bulk_create(links)
+
+    return {
+        'lines': len(lines),
+        'balances_counted': len(counted),
+        'balances_adjusted': len(variances),
+        'surplus': sum(item['variance'] for item in variances if item['variance'] > 0),
+        'shortage': -sum(item['variance'] for item in variances if item['variance'] < 0),
+        'dry_run': dry_run,
+        'variances': variances,
+    }
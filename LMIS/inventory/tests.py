@@ -1,3 +1,674 @@
-from django.test import TestCase
+#import core python modules
+import datetime
+import threading
+import unittest
 
-# Create your tests here.
+#import core django modules
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+#import external modules
+import numpy
+from rest_framework.test import APITestCase
+
+#import project modules
+from alerts.models import OnSiteNotification
+from cce.models import StorageLocation, StorageLocationType
+from core.models import (CompanyCategory, Company, UOMCategory, UnitOfMeasurement, ProductCategory, Product,
+                         ProductPresentation, ProductItem, VVMStage, Employee, EmployeeCategory, ProcessingPeriod)
+from core.testing import QueryBudgetMixin
+from facilities.models import Facility, FacilityType
+from inventory.models import (IncomingShipment, IncomingShipmentLine, OutgoingShipment, OutgoingShipmentLine,
+                              StockBalance, StockLedgerEntry, StockEntry, Adjustment, AdjustmentType,
+                              get_balance_lock_key, PhysicalStockCount, PhysicalStockCountLine,
+                              PhysicalStockCountLineAdjustment, ConsumptionRecord, ConsumptionRecordLine, ExpiryRisk)
+from inventory.allocation import allocate_fefo
+from inventory.analytics import compute_consumption_rates
+from inventory.capacity import CapacityTree
+from inventory.consumption import generate_consumption_records
+from inventory.expiry import scan_expiry_risks
+from inventory.ledger import get_stock_balances_as_of, rebuild_stock_balances, take_stock_snapshot
+from inventory.posting import transition_outgoing_shipment, PostingError
+from inventory.reconciliation import reconcile_physical_stock_count, ReconciliationError
+from locations.models import Location, LocationType
+from partners.models import Program
+
+
+def create_facility(code):
+    category, _ = CompanyCategory.objects.get_or_create(name='Store')
+    facility_type, _ = FacilityType.objects.get_or_create(code='store', name='Store', active=True)
+    location_type, _ = LocationType.objects.get_or_create(name='State')
+    location = Location.objects.create(name='Location {code}'.format(code=code), location_type=location_type)
+    return Facility.objects.create(name='Facility {code}'.format(code=code), code=code, category=category,
+                                   facility_type=facility_type, supplies_others=True, is_sdp=False,
+                                   location=location, has_electricity=True, is_online=True, has_electronic_scc=True,
+                                   go_live_date=datetime.date(2014, 1, 1), is_satellite=False, virtual_facility=False)
+
+
+def create_storage_location(code, facility):
+    location_type, _ = StorageLocationType.objects.get_or_create(name='Cold Room')
+    return StorageLocation.objects.create(code=code, name=code, facility=facility, type=location_type,
+                                          is_cold_store=True, status=StorageLocation.STATUS.working)
+
+
+def create_product_items(count, uom):
+    category = ProductCategory.objects.create(name='Vaccine')
+    manufacturer = Company.objects.create(name='Manufacturer', code='MAN', category=CompanyCategory.objects.first())
+    product = Product.objects.create(code='BCG', name='BCG', category=category, base_uom=uom)
+    presentation = ProductPresentation.objects.create(code='20', name='20 Doses', value=20, uom=uom)
+    return [ProductItem.objects.create(code='BCG-{index}'.format(index=index), name='BCG {index}'.format(index=index),
+                                       product=product, presentation=presentation, manufacturer=manufacturer,
+                                       batch_no='B{index}'.format(index=index), price_per_unit=1,
+                                       expiration_date=datetime.date(2030, 1, index + 1), active=True)
+            for index in range(count)]
+
+
+class StockMovementTest(TestCase):
+    """
+        shipment lines and adjustments post their movements to the stock balance of their storage location
+    """
+    def setUp(self):
+        uom_category = UOMCategory.objects.create(name='Unit', description='Unit')
+        self.uom = UnitOfMeasurement.objects.create(name='Dose', symbol='dose', uom_category=uom_category)
+        self.supplier = create_facility('SUP')
+        self.recipient = create_facility('REC')
+        self.warehouse = create_storage_location('WH-1', self.supplier)
+        self.item = create_product_items(1, self.uom)[0]
+        self.incoming = IncomingShipment.objects.create(supplier=self.supplier, input_warehouse=self.warehouse,
+                                                        stock_entry_type=StockEntry.TYPES.new_arrival)
+        self.incoming_line = IncomingShipmentLine.objects.create(
+            incoming_shipment=self.incoming, product_item=self.item, quantity=100, quantity_uom=self.uom,
+            weight_uom=self.uom, packed_volume_uom=self.uom)
+
+    def get_balance(self):
+        return StockBalance.objects.get(storage_location=self.warehouse, product_item=self.item, program=None).quantity
+
+    def test_incoming_line_is_posted_to_input_warehouse(self):
+        self.assertEqual(self.incoming_line.get_stock_movements(),
+                         [(self.warehouse.pk, self.item.pk, None, 100, self.incoming.received_at)])
+        self.assertEqual(self.get_balance(), 100)
+        self.incoming_line.is_deleted = True
+        self.incoming_line.save()
+        self.assertEqual(self.get_balance(), 0)
+
+    def test_outgoing_line_is_posted_when_shipment_is_done(self):
+        shipment = OutgoingShipment.objects.create(recipient=self.recipient, output_warehouse=self.warehouse)
+        line = OutgoingShipmentLine.objects.create(outgoing_shipment=shipment, product_item=self.item,
+                                                   quantity_issued=30, quantity_uom=self.uom)
+        self.assertEqual(line.get_stock_movements(), [])
+        shipment.status = OutgoingShipment.STATUS.done
+        shipment.save()
+        self.assertEqual(self.get_balance(), 70)
+
+    def test_adjustment_posts_difference(self):
+        adjustment = Adjustment.objects.create(previous_quantity=100, revised_quantity=90, reason='Broken vials',
+                                               adjustment_type=AdjustmentType.TYPES.broken,
+                                               storage_location=self.warehouse, product_item=self.item)
+        self.assertEqual(adjustment.get_stock_movements(),
+                         [(self.warehouse.pk, self.item.pk, None, -10, adjustment.adjusted_at)])
+        self.assertEqual(self.get_balance(), 90)
+        unposted = Adjustment.objects.create(previous_quantity=90, revised_quantity=80, reason='Not posted',
+                                             adjustment_type=AdjustmentType.TYPES.broken)
+        self.assertEqual(unposted.get_stock_movements(), [])
+
+    def test_lines_in_other_units_are_posted_in_base_units(self):
+        box = UnitOfMeasurement.objects.create(name='Box', symbol='box', uom_category=self.uom.uom_category,
+                                               factor=0.1)
+        IncomingShipmentLine.objects.create(incoming_shipment=self.incoming, product_item=self.item, quantity=3,
+                                            quantity_uom=box, weight_uom=self.uom, packed_volume_uom=self.uom)
+        shipment = OutgoingShipment.objects.create(recipient=self.recipient, output_warehouse=self.warehouse)
+        OutgoingShipmentLine.objects.create(outgoing_shipment=shipment, product_item=self.item, quantity_issued=2,
+                                            quantity_uom=box)
+        transition_outgoing_shipment(shipment.pk, OutgoingShipment.STATUS.assigned)
+        transition_outgoing_shipment(shipment.pk, OutgoingShipment.STATUS.done)
+        self.assertEqual(self.get_balance(), 110)
+        line = shipment.outgoing_shipment_lines.get()
+        self.assertEqual((line.quantity_before, line.quantity_after), (130, 110))
+        self.assertEqual(rebuild_stock_balances([self.warehouse.pk]), (0, 0))
+
+
+class StockBalanceLockOrderTest(TestCase):
+    """
+        issuers and postings lock balances in one order whatever the programs and ids of the balances
+    """
+    def test_database_and_posting_orders_agree(self):
+        uom_category = UOMCategory.objects.create(name='Unit', description='Unit')
+        uom = UnitOfMeasurement.objects.create(name='Dose', symbol='dose', uom_category=uom_category)
+        warehouse = create_storage_location('WH-1', create_facility('SUP'))
+        programs = [None] + [Program.objects.create(code='P{index}'.format(index=index),
+                                                    name='Program {index}'.format(index=index))
+                             for index in range(3)]
+        keys = [(warehouse.pk, item.pk, program.pk if program else None)
+                for item in create_product_items(3, uom) for program in programs]
+        StockBalance.objects.post_movements([key + (1, timezone.now()) for key in keys])
+
+        locked = [(balance.storage_location_id, balance.product_item_id, balance.program_id)
+                  for balance in StockBalance.objects.locked().filter(storage_location=warehouse)]
+        self.assertEqual(locked, sorted(keys, key=get_balance_lock_key))
+
+
+class StockBalanceAsOfTest(TestCase):
+    """
+        past balances are worked out as of the business date of the movements, not the time they were entered
+    """
+    def setUp(self):
+        uom_category = UOMCategory.objects.create(name='Unit', description='Unit')
+        self.uom = UnitOfMeasurement.objects.create(name='Dose', symbol='dose', uom_category=uom_category)
+        self.supplier = create_facility('SUP')
+        self.warehouse = create_storage_location('WH-1', self.supplier)
+        self.item = create_product_items(1, self.uom)[0]
+        self.now = timezone.now()
+
+    def receive(self, quantity, days_ago):
+        shipment = IncomingShipment.objects.create(supplier=self.supplier, input_warehouse=self.warehouse,
+                                                   stock_entry_type=StockEntry.TYPES.new_arrival,
+                                                   received_at=self.now - datetime.timedelta(days=days_ago))
+        IncomingShipmentLine.objects.create(incoming_shipment=shipment, product_item=self.item, quantity=quantity,
+                                            quantity_uom=self.uom, weight_uom=self.uom, packed_volume_uom=self.uom)
+        return shipment
+
+    def get_quantity(self, days_ago):
+        balances = get_stock_balances_as_of(self.now - datetime.timedelta(days=days_ago), [self.warehouse.pk])
+        return balances.get((self.warehouse.pk, self.item.pk, None), 0)
+
+    def test_backdated_movement_counts_from_its_date(self):
+        self.receive(100, days_ago=10)
+        self.receive(50, days_ago=3)
+        self.assertEqual(self.get_quantity(20), 0)
+        self.assertEqual(self.get_quantity(5), 100)
+        self.assertEqual(self.get_quantity(1), 150)
+
+    def test_snapshot_takes_in_movements_recorded_later(self):
+        self.receive(100, days_ago=10)
+        snapshot = take_stock_snapshot(self.now - datetime.timedelta(days=5))
+        shipment = self.receive(50, days_ago=7)
+        self.assertEqual(snapshot.lines.get(product_item=self.item).quantity, 150)
+        self.assertEqual(self.get_quantity(6), 150)
+
+        shipment.received_at = self.now - datetime.timedelta(days=2)
+        shipment.save()
+        self.assertEqual(snapshot.lines.get(product_item=self.item).quantity, 100)
+        self.assertEqual(self.get_quantity(6), 100)
+        self.assertEqual(self.get_quantity(1), 150)
+
+
+class NestedShipmentLinesTest(QueryBudgetMixin, APITestCase):
+    """
+        a shipment and its lines are validated and created in one request, at a cost that does not grow with the
+        number of lines
+    """
+    url = '/api/v1/inventory/incoming-shipment/'
+
+    def setUp(self):
+        uom_category = UOMCategory.objects.create(name='Unit', description='Unit')
+        self.uom = UnitOfMeasurement.objects.create(name='Dose', symbol='dose', uom_category=uom_category)
+        self.supplier = create_facility('SUP')
+        self.warehouse = create_storage_location('WH-1', self.supplier)
+        self.item = create_product_items(1, self.uom)[0]
+
+    def post_shipment(self, count):
+        lines = [{'product_item': self.item.pk, 'quantity': 10, 'quantity_uom': self.uom.pk,
+                  'weight_uom': self.uom.pk, 'packed_volume_uom': self.uom.pk} for _ in range(count)]
+        return self.client.post(self.url, {
+            'supplier': self.supplier.pk, 'stock_entry_type': StockEntry.TYPES.new_arrival,
+            'input_warehouse': self.warehouse.pk, 'incoming_shipment_lines': lines}, format='json')
+
+    def test_create_shipment_with_lines(self):
+        response = self.post_shipment(3)
+        self.assertEqual(response.status_code, 201, response.data)
+        shipment = IncomingShipment.objects.get()
+        self.assertEqual(shipment.incoming_shipment_lines.count(), 3)
+        self.assertEqual(len(response.data['incoming_shipment_lines']), 3)
+        self.assertEqual(StockBalance.objects.get(storage_location=self.warehouse, product_item=self.item).quantity,
+                         30)
+
+    def test_bulk_update_of_lines_posts_the_change(self):
+        self.post_shipment(2)
+        line = IncomingShipmentLine.objects.first()
+        response = self.client.patch('/api/v1/inventory/incoming-shipment-line/bulk/',
+                                     [{'uuid': line.pk, 'quantity': 25}], format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(StockBalance.objects.get(storage_location=self.warehouse, product_item=self.item).quantity,
+                         35)
+        self.assertEqual(sum(StockLedgerEntry.objects.filter(product_item=self.item).values_list('quantity',
+                                                                                                 flat=True)), 35)
+
+    def test_line_errors(self):
+        response = self.client.post(self.url, {
+            'supplier': self.supplier.pk, 'stock_entry_type': StockEntry.TYPES.new_arrival,
+            'input_warehouse': self.warehouse.pk,
+            'incoming_shipment_lines': [{'product_item': self.item.pk, 'quantity': 10}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('quantity_uom', response.data['incoming_shipment_lines'][0])
+        self.assertFalse(IncomingShipment.objects.exists())
+
+    def test_query_count_does_not_grow_with_lines(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.post_shipment(2)
+        #the second shipment updates the balance the first one created, it can only take fewer queries
+        with self.assertMaxQueries(len(queries)):
+            response = self.post_shipment(20)
+        self.assertEqual(response.status_code, 201, response.data)
+
+
+class OutgoingShipmentLineApiTest(APITestCase):
+    """
+        lines of shipments that are not drafts any more can not be written through the line end-point
+    """
+    url = '/api/v1/inventory/outgoing-shipment-line/'
+
+    def setUp(self):
+        uom_category = UOMCategory.objects.create(name='Unit', description='Unit')
+        self.uom = UnitOfMeasurement.objects.create(name='Dose', symbol='dose', uom_category=uom_category)
+        supplier = create_facility('SUP')
+        self.recipient = create_facility('REC')
+        self.warehouse = create_storage_location('WH-1', supplier)
+        self.item = create_product_items(1, self.uom)[0]
+        incoming = IncomingShipment.objects.create(supplier=supplier, input_warehouse=self.warehouse,
+                                                   stock_entry_type=StockEntry.TYPES.new_arrival)
+        IncomingShipmentLine.objects.create(incoming_shipment=incoming, product_item=self.item, quantity=100,
+                                            quantity_uom=self.uom, weight_uom=self.uom, packed_volume_uom=self.uom)
+        self.shipment = OutgoingShipment.objects.create(recipient=self.recipient, output_warehouse=self.warehouse)
+        self.line = OutgoingShipmentLine.objects.create(outgoing_shipment=self.shipment, product_item=self.item,
+                                                        quantity_issued=30, quantity_uom=self.uom)
+
+    def get_balance(self):
+        return StockBalance.objects.get(storage_location=self.warehouse, product_item=self.item).quantity
+
+    def test_draft_lines_can_be_changed(self):
+        response = self.client.patch('{url}{uuid}/'.format(url=self.url, uuid=self.line.pk), {'quantity_issued': 40},
+                                     format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(OutgoingShipmentLine.objects.get().quantity_issued, 40)
+
+    def test_lines_of_done_shipments_are_refused(self):
+        transition_outgoing_shipment(self.shipment.pk, OutgoingShipment.STATUS.assigned)
+        transition_outgoing_shipment(self.shipment.pk, OutgoingShipment.STATUS.done)
+        detail_url = '{url}{uuid}/'.format(url=self.url, uuid=self.line.pk)
+        responses = [
+            self.client.patch(detail_url, {'quantity_issued': 10}, format='json'),
+            self.client.delete(detail_url),
+            self.client.post(self.url, {'outgoing_shipment': self.shipment.pk, 'product_item': self.item.pk,
+                                        'quantity_issued': 10, 'quantity_uom': self.uom.pk}, format='json'),
+            self.client.patch(self.url + 'bulk/', [{'uuid': self.line.pk, 'quantity_issued': 10}], format='json'),
+            self.client.delete(self.url, {'uuids': [self.line.pk]}, format='json'),
+        ]
+        self.assertEqual([response.status_code for response in responses], [400] * len(responses))
+        self.assertEqual(OutgoingShipmentLine.objects.get().quantity_issued, 30)
+        self.assertEqual(self.get_balance(), 70)
+
+
+class StorageCapacityTest(APITestCase):
+    """
+        volumes follow the units of quantities, units that can not be converted only leave their rows out, and
+        shipment lines are checked against the free volume however they are saved
+    """
+    def setUp(self):
+        uom_category = UOMCategory.objects.create(name='Unit', description='Unit')
+        self.uom = UnitOfMeasurement.objects.create(name='Dose', symbol='dose', uom_category=uom_category)
+        volume = UOMCategory.objects.create(name='Volume', description='Volume')
+        self.litre = UnitOfMeasurement.objects.create(name='Litre', symbol='l', uom_category=volume)
+        self.millilitre = UnitOfMeasurement.objects.create(name='Millilitre', symbol='ml', uom_category=volume,
+                                                           factor=1000)
+        self.supplier = create_facility('SUP')
+        self.warehouse = create_storage_location('WH-1', self.supplier)
+        self.warehouse.net_capacity, self.warehouse.capacity_uom = 10, self.litre
+        self.warehouse.save()
+        #a vial of 20 doses takes up 100 ml
+        self.item, self.other_item = create_product_items(2, self.uom)
+        self.item.volume_per_unit, self.item.volume_uom = 100, self.millilitre
+        self.item.save()
+        self.other_item.volume_per_unit, self.other_item.volume_uom = 1, self.uom
+        self.other_item.save()
+        self.shipment = IncomingShipment.objects.create(supplier=self.supplier, input_warehouse=self.warehouse,
+                                                        stock_entry_type=StockEntry.TYPES.new_arrival)
+
+    def get_line_data(self, quantity):
+        return {'incoming_shipment': self.shipment.pk, 'product_item': self.item.pk, 'quantity': quantity,
+                'quantity_uom': self.uom.pk, 'weight_uom': self.uom.pk, 'packed_volume_uom': self.uom.pk}
+
+    def test_volumes_of_stock_balances(self):
+        StockBalance.objects.create(storage_location=self.warehouse, product_item=self.item, quantity=400)
+        StockBalance.objects.create(storage_location=self.warehouse, product_item=self.other_item, quantity=10)
+        result = CapacityTree().get_utilisation()[0]
+        self.assertEqual((result['capacity'], result['used'], result['unknown_volumes']), (10.0, 2.0, 1))
+        self.assertEqual(result['uom'], self.litre.pk)
+
+    def test_line_end_point_checks_capacity(self):
+        url = '/api/v1/inventory/incoming-shipment-line/'
+        response = self.client.post(url, self.get_line_data(4000), format='json')
+        self.assertEqual(response.status_code, 400, response.data)
+        self.assertFalse(IncomingShipmentLine.objects.exists())
+        response = self.client.post(url, self.get_line_data(1000), format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        response = self.client.post(url + 'bulk/', [self.get_line_data(1000), self.get_line_data(1000)],
+                                    format='json')
+        self.assertEqual(response.status_code, 400, response.data)
+        response = self.client.post(url + '?ignore_capacity=true', self.get_line_data(4000), format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+
+    def test_lines_deleted_by_a_partial_edit_are_credited(self):
+        line = IncomingShipmentLine.objects.create(incoming_shipment=self.shipment, product_item=self.item,
+                                                   quantity=1600, quantity_uom=self.uom, weight_uom=self.uom,
+                                                   packed_volume_uom=self.uom)
+        response = self.client.patch('/api/v1/inventory/incoming-shipment/{uuid}/'.format(uuid=self.shipment.pk), {
+            'incoming_shipment_lines': [{'uuid': line.pk, 'is_deleted': True}, self.get_line_data(1600)]},
+            format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+
+
+class ReconciliationTest(TestCase):
+    """
+        a physical stock count is reconciled once, shortages are recorded as missing stock and surpluses as found
+    """
+    def setUp(self):
+        uom_category = UOMCategory.objects.create(name='Unit', description='Unit')
+        self.uom = UnitOfMeasurement.objects.create(name='Dose', symbol='dose', uom_category=uom_category)
+        facility = create_facility('SUP')
+        self.warehouse = create_storage_location('WH-1', facility)
+        self.items = create_product_items(2, self.uom)
+        self.program = Program.objects.create(code='RI', name='Routine Immunization')
+        StockBalance.objects.post_movements([(self.warehouse.pk, item.pk, self.program.pk, 50, timezone.now())
+                                             for item in self.items])
+        employee = Employee.objects.create(name='Clerk', code='CLK', current_company=facility,
+                                           category=EmployeeCategory.objects.create(name='Store Keeper'))
+        self.stock_count = PhysicalStockCount.objects.create(facility=facility, performed_by=employee,
+                                                             storage_location=self.warehouse)
+        for item, counted in zip(self.items, (45, 60)):
+            PhysicalStockCountLine.objects.create(physical_stock_count=self.stock_count, product_item=item,
+                                                  program=self.program, physical_quantity=counted,
+                                                  inventory_quantity=50, quantity_uom=self.uom)
+
+    def test_variances_are_adjusted_once(self):
+        summary = reconcile_physical_stock_count(self.stock_count)
+        self.assertEqual((summary['shortage'], summary['surplus']), (5, 10))
+        types = dict(Adjustment.objects.values_list('product_item', 'adjustment_type'))
+        self.assertEqual(types, {self.items[0].pk: AdjustmentType.TYPES.missing,
+                                 self.items[1].pk: AdjustmentType.TYPES.found})
+        self.assertEqual(set(PhysicalStockCountLineAdjustment.objects.values_list('adjustment', flat=True)),
+                         set(Adjustment.objects.values_list('pk', flat=True)))
+        self.assertEqual(dict(StockBalance.objects.values_list('product_item', 'quantity')),
+                         {self.items[0].pk: 45, self.items[1].pk: 60})
+        self.assertRaises(ReconciliationError, reconcile_physical_stock_count, self.stock_count)
+
+    def test_counts_in_other_units_are_converted(self):
+        box = UnitOfMeasurement.objects.create(name='Box', symbol='box', uom_category=self.uom.uom_category,
+                                               factor=0.1)
+        PhysicalStockCountLine.objects.create(physical_stock_count=self.stock_count, product_item=self.items[0],
+                                              program=self.program, physical_quantity=1, inventory_quantity=5,
+                                              quantity_uom=box)
+        summary = reconcile_physical_stock_count(self.stock_count)
+        self.assertEqual((summary['shortage'], summary['surplus']), (0, 15))
+        self.assertEqual(dict(StockBalance.objects.values_list('product_item', 'quantity')),
+                         {self.items[0].pk: 55, self.items[1].pk: 60})
+
+
+class ConsumptionRecordGenerationTest(TestCase):
+    """
+        draft consumption records are worked out from the business dates of the movements
+    """
+    def setUp(self):
+        uom_category = UOMCategory.objects.create(name='Unit', description='Unit')
+        self.uom = UnitOfMeasurement.objects.create(name='Dose', symbol='dose', uom_category=uom_category)
+        self.facility = create_facility('SUP')
+        self.warehouse = create_storage_location('WH-1', self.facility)
+        self.item = create_product_items(1, self.uom)[0]
+        self.now = timezone.now()
+        self.period = ProcessingPeriod.objects.create(name='Last month', start_date=self.days_ago(30),
+                                                      end_date=self.days_ago(1))
+        self.employee = Employee.objects.create(name='Clerk', code='CLK', current_company=self.facility,
+                                                category=EmployeeCategory.objects.create(name='Store Keeper'))
+
+    def days_ago(self, days):
+        return self.now - datetime.timedelta(days=days)
+
+    def receive(self, quantity, days_ago, program=None):
+        shipment = IncomingShipment.objects.create(supplier=self.facility, input_warehouse=self.warehouse,
+                                                   stock_entry_type=StockEntry.TYPES.new_arrival,
+                                                   received_at=self.days_ago(days_ago))
+        IncomingShipmentLine.objects.create(incoming_shipment=shipment, product_item=self.item, quantity=quantity,
+                                            program=program, quantity_uom=self.uom, weight_uom=self.uom,
+                                            packed_volume_uom=self.uom)
+
+    def test_figures_follow_business_dates(self):
+        program = Program.objects.create(code='RI', name='Routine Immunization')
+        self.receive(100, 40, program)
+        self.receive(50, 10, program)
+        Adjustment.objects.create(previous_quantity=150, revised_quantity=140, reason='Broken vials',
+                                  adjustment_type=AdjustmentType.TYPES.broken, storage_location=self.warehouse,
+                                  product_item=self.item, program=program, adjusted_at=self.days_ago(5))
+        shipment = OutgoingShipment.objects.create(recipient=self.facility, output_warehouse=self.warehouse,
+                                                   shipped_at=self.days_ago(3))
+        OutgoingShipmentLine.objects.create(outgoing_shipment=shipment, product_item=self.item, program=program,
+                                            quantity_issued=20, quantity_uom=self.uom)
+        shipment.status = OutgoingShipment.STATUS.done
+        shipment.save()
+
+        self.assertEqual(generate_consumption_records(self.period, self.employee), 1)
+        line = ConsumptionRecordLine.objects.get()
+        self.assertEqual((line.previous_balance, line.quantity_received, line.total_discarded, line.current_balance,
+                          line.quantity_used), (100, 50, 10, 120, 20))
+
+    def test_other_adjustments_are_not_usage(self):
+        program = Program.objects.create(code='RI', name='Routine Immunization')
+        self.receive(100, 40, program)
+        box = UnitOfMeasurement.objects.create(name='Box', symbol='box', uom_category=self.uom.uom_category,
+                                               factor=0.1)
+        shipment = IncomingShipment.objects.create(supplier=self.facility, input_warehouse=self.warehouse,
+                                                   stock_entry_type=StockEntry.TYPES.new_arrival,
+                                                   received_at=self.days_ago(10))
+        IncomingShipmentLine.objects.create(incoming_shipment=shipment, product_item=self.item, quantity=5,
+                                            program=program, quantity_uom=box, weight_uom=self.uom,
+                                            packed_volume_uom=self.uom)
+        for previous, revised, adjustment_type in ((150, 165, AdjustmentType.TYPES.found),
+                                                   (165, 160, AdjustmentType.TYPES.missing)):
+            Adjustment.objects.create(previous_quantity=previous, revised_quantity=revised, reason='Stock count',
+                                      adjustment_type=adjustment_type, storage_location=self.warehouse,
+                                      product_item=self.item, program=program, adjusted_at=self.days_ago(5))
+
+        generate_consumption_records(self.period, self.employee)
+        line = ConsumptionRecordLine.objects.get()
+        self.assertEqual((line.previous_balance, line.quantity_received, line.quantity_adjusted, line.total_discarded,
+                          line.current_balance, line.quantity_used), (100, 50, 10, 0, 160, 0))
+
+    def test_no_record_without_program_stock(self):
+        self.receive(100, 10)
+        self.assertEqual(generate_consumption_records(self.period, self.employee), 0)
+        self.assertFalse(ConsumptionRecord.objects.exists())
+
+
+class ExpiryRiskScanTest(TestCase):
+    """
+        a batch at risk of expiring is notified when it is found or gets worse, not whenever its quantity changes
+    """
+    def setUp(self):
+        uom_category = UOMCategory.objects.create(name='Unit', description='Unit')
+        uom = UnitOfMeasurement.objects.create(name='Dose', symbol='dose', uom_category=uom_category)
+        self.warehouse = create_storage_location('WH-1', create_facility('SUP'))
+        self.item = create_product_items(1, uom)[0]
+        self.item.expiration_date = timezone.localtime(timezone.now()).date() + datetime.timedelta(days=60)
+        self.item.save()
+
+    def post(self, quantity):
+        StockBalance.objects.post_movements([(self.warehouse.pk, self.item.pk, None, quantity, timezone.now())])
+
+    def test_quantity_changes_keep_the_notification(self):
+        self.post(100)
+        scan_expiry_risks()
+        risk = ExpiryRisk.objects.get()
+        self.assertEqual(risk.quantity_at_risk, 100)
+        self.assertEqual(OnSiteNotification.objects.count(), 1)
+
+        self.post(-10)
+        scan_expiry_risks()
+        self.assertEqual(ExpiryRisk.objects.get().quantity_at_risk, 90)
+        self.assertEqual(ExpiryRisk.objects.get().notification_id, risk.notification_id)
+        self.assertEqual(OnSiteNotification.objects.count(), 1)
+
+
+class AllocationTest(TestCase):
+    """
+        allocation picks batches first-expiry-first-out and never issues batches past their VVM discard point
+    """
+    def setUp(self):
+        uom_category = UOMCategory.objects.create(name='Unit', description='Unit')
+        self.uom = UnitOfMeasurement.objects.create(name='Dose', symbol='dose', uom_category=uom_category)
+        supplier = create_facility('SUP')
+        self.warehouse = create_storage_location('WH-1', supplier)
+        self.items = create_product_items(4, self.uom)
+        self.product = self.items[0].product
+        incoming = IncomingShipment.objects.create(supplier=supplier, input_warehouse=self.warehouse,
+                                                   stock_entry_type=StockEntry.TYPES.new_arrival)
+        #items expire in order, the first one soonest
+        stages = (VVMStage.STAGES.stage_one, VVMStage.STAGES.stage_three, VVMStage.STAGES.stage_two,
+                  VVMStage.STAGES.stage_four)
+        for item, stage in zip(self.items, stages):
+            IncomingShipmentLine.objects.create(incoming_shipment=incoming, product_item=item, quantity=10,
+                                                quantity_uom=self.uom, weight_uom=self.uom,
+                                                packed_volume_uom=self.uom, vvm_stage=stage)
+
+    def allocate(self, quantity, use_vvm_stage=False):
+        return allocate_fefo(self.warehouse.pk, {self.product.pk: quantity}, use_vvm_stage=use_vvm_stage)
+
+    def test_unusable_stages_are_never_issued(self):
+        lines, shortfalls = self.allocate(30)
+        self.assertEqual([line.product_item_id for line in lines], [self.items[0].pk, self.items[2].pk])
+        self.assertEqual(shortfalls, {self.product.pk: 10})
+
+    def test_stage_two_goes_before_stage_one(self):
+        lines, _ = self.allocate(15, use_vvm_stage=True)
+        self.assertEqual([(line.product_item_id, line.quantity_issued) for line in lines],
+                         [(self.items[2].pk, 10), (self.items[0].pk, 5)])
+
+    def test_quantities_have_to_be_positive(self):
+        self.assertRaises(ValueError, self.allocate, 0)
+        self.assertRaises(ValueError, self.allocate, -5)
+
+
+class ConsumptionRatesTest(APITestCase):
+    """
+        consumption rates add up the batches of a product in a record before averaging the records
+    """
+    def get_columns(self, rows):
+        record, facility, product, start, end, used, discarded, balance = zip(*rows)
+        return {
+            'record': numpy.array(record, dtype=object),
+            'facility': numpy.array(facility, dtype=object),
+            'product': numpy.array(product, dtype=object),
+            'start': numpy.array(start, dtype='datetime64[D]'),
+            'end': numpy.array(end, dtype='datetime64[D]'),
+            'used': numpy.array(used, dtype=numpy.float64),
+            'discarded': numpy.array(discarded, dtype=numpy.float64),
+            'balance': numpy.array(balance, dtype=numpy.float64),
+        }
+
+    def test_batches_of_a_record_are_added_up(self):
+        january, february = ('2014-01-01', '2014-01-31'), ('2014-02-01', '2014-02-28')
+        #two batches in january, three in february
+        columns = self.get_columns([
+            ('r1', 'f1', 'p1') + january + (60, 0, 10),
+            ('r1', 'f1', 'p1') + january + (40, 0, 20),
+            ('r2', 'f1', 'p1') + february + (100, 5, 30),
+            ('r2', 'f1', 'p1') + february + (80, 5, 40),
+            ('r2', 'f1', 'p1') + february + (20, 10, 50),
+        ])
+        rate, = compute_consumption_rates(columns)
+        self.assertEqual(rate['months'], round(59 / (365.25 / 12), 2))
+        self.assertEqual(rate['total_used'], 300)
+        self.assertEqual(rate['current_balance'], 120)
+        self.assertEqual(rate['amc'], round(300 / 59.0 * 365.25 / 12, 2))
+        self.assertTrue(rate['trend'] > 0)
+
+    def test_invalid_dates(self):
+        response = self.client.get('/api/v1/inventory/consumption-analytics/', {'since': '2014-02-30'})
+        self.assertEqual(response.status_code, 400)
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'row locking needs PostgreSQL')
+class OutgoingShipmentPostingStressTest(TransactionTestCase):
+    """
+        many issuers post shipments from the same warehouse at once, every unit has to be accounted for exactly once
+    """
+    issuers = 40
+    quantity = 5
+
+    def setUp(self):
+        uom_category = UOMCategory.objects.create(name='Unit', description='Unit')
+        self.uom = UnitOfMeasurement.objects.create(name='Dose', symbol='dose', uom_category=uom_category)
+        supplier = create_facility('SUP')
+        self.recipient = create_facility('REC')
+        self.warehouse = create_storage_location('WH-1', supplier)
+        self.items = create_product_items(2, self.uom)
+
+        incoming = IncomingShipment.objects.create(supplier=supplier, stock_entry_type=StockEntry.TYPES.new_arrival,
+                                                   input_warehouse=self.warehouse)
+        for item in self.items:
+            IncomingShipmentLine.objects.create(incoming_shipment=incoming, product_item=item, quantity=300,
+                                                quantity_uom=self.uom, weight_uom=self.uom,
+                                                packed_volume_uom=self.uom)
+
+    def create_shipment(self, index):
+        shipment = OutgoingShipment.objects.create(recipient=self.recipient, output_warehouse=self.warehouse)
+        #half of the shipments list the items in reverse order, locking must not depend on line order
+        items = self.items if index % 2 else list(reversed(self.items))
+        for item in items:
+            OutgoingShipmentLine.objects.create(outgoing_shipment=shipment, product_item=item,
+                                                quantity_issued=self.quantity, quantity_uom=self.uom)
+        return shipment
+
+    def post_concurrently(self, shipments):
+        errors, failures = [], []
+        start = threading.Event()
+
+        def issue(shipment):
+            start.wait()
+            try:
+                transition_outgoing_shipment(shipment.pk, OutgoingShipment.STATUS.assigned)
+                transition_outgoing_shipment(shipment.pk, OutgoingShipment.STATUS.done)
+            except PostingError as e:
+                failures.append(e)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=issue, args=(shipment,)) for shipment in shipments]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        return failures
+
+    def get_balance(self, item):
+        return StockBalance.objects.get(storage_location=self.warehouse, product_item=item, program=None).quantity
+
+    def test_concurrent_issuers_do_not_lose_updates(self):
+        shipments = [self.create_shipment(index) for index in range(self.issuers)]
+        failures = self.post_concurrently(shipments)
+
+        self.assertEqual(failures, [])
+        for item in self.items:
+            self.assertEqual(self.get_balance(item), 300 - self.issuers * self.quantity)
+            lines = OutgoingShipmentLine.objects.filter(product_item=item)
+            #each issuer saw the balance left by the one before it
+            self.assertEqual(sorted(lines.values_list('quantity_before', flat=True)),
+                             list(range(300 - (self.issuers - 1) * self.quantity, 301, self.quantity)))
+            for before, after in lines.values_list('quantity_before', 'quantity_after'):
+                self.assertEqual(after, before - self.quantity)
+
+    def test_concurrent_issuers_never_issue_more_than_on_hand(self):
+        shipments = [self.create_shipment(index) for index in range(self.issuers)]
+        for item in self.items:
+            IncomingShipmentLine.objects.filter(product_item=item).update(quantity=100)
+            StockBalance.objects.filter(product_item=item).update(quantity=100)
+        failures = self.post_concurrently(shipments)
+
+        self.assertEqual(len(failures), self.issuers - 100 // self.quantity)
+        for item in self.items:
+            self.assertEqual(self.get_balance(item), 0)
+        self.assertEqual(OutgoingShipment.objects.filter(status=OutgoingShipment.STATUS.done).count(),
+                         100 // self.quantity)
@@ -1,11 +1,11 @@
 from django.conf.urls import patterns, include, url
 
-from rest_framework import routers
+from core.api.routers import BaseModelRouter
 
 from . import views
 
 
-router = routers.DefaultRouter()
+router = BaseModelRouter()
 router.register(r'^program', views.ProgramViewSet)
 router.register(r'^program-product', views.ProgramProductViewSet)
 
@@ -1,3 +1,51 @@
-from django.test import TestCase
+#import core django modules
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
-# Create your tests here.
+#import external modules
+from rest_framework.test import APITestCase
+
+#import project modules
+from core.models import Company, CompanyCategory
+from core.testing import QueryBudgetMixin
+from partners.models import Program
+
+
+class ProgramApiTest(QueryBudgetMixin, APITestCase):
+    """
+        partners of programs are prefetched, listing more programs does not take more queries
+    """
+    url = '/api/v1/partners/program/'
+
+    def setUp(self):
+        category = CompanyCategory.objects.create(name='Donor')
+        self.partners = [Company.objects.create(name='Partner {index}'.format(index=index),
+                                                code='PA{index}'.format(index=index), category=category)
+                         for index in range(2)]
+
+    def create_programs(self, start, count):
+        programs = []
+        for index in range(start, start + count):
+            program = Program.objects.create(code='P{index}'.format(index=index),
+                                             name='Program {index}'.format(index=index), active=True)
+            program.partners.add(*self.partners)
+            programs.append(program)
+        return programs
+
+    def test_list_query_count_does_not_grow(self):
+        self.create_programs(0, 2)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url)
+        self.create_programs(2, 20)
+        with self.assertMaxQueries(len(queries)):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 22)
+
+    def test_soft_deleted_partners_are_left_out(self):
+        program = self.create_programs(0, 1)[0]
+        self.partners[1].is_deleted = True
+        self.partners[1].save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.data[0]['uuid'], program.pk)
+        self.assertEqual(response.data[0]['partners'], [self.partners[0].pk])